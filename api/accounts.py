@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Registration and login, each in as few queries as the database allows.
+
+A login finds the active user by username or by email (case-insensitively, on the expression index of
+`core/migrations/0014_user_email_index.py`) in one query, the user's API token then comes from `TOKEN_CACHE`.
+A registration inserts the user and its token straight away: the unique username and the unique
+case-insensitive email refuse duplicates, two racing sign-ups can't both get through a check done beforehand.
+
+`api.authentication.CachedModelBackend` takes the signed-in user of each request from `USER_CACHE`, until the
+user is saved or deleted. A `USER_CACHE` living in each process (LocMem) would keep a deactivated user or an old
+password hash signed in on the other workers, with one the user is read from the database.
+
+API requests authenticate with `Authorization: Token <key>` (`api.authentication.CachedTokenAuthentication`),
+`token_user` resolves the key to its user through `TOKEN_AUTH_CACHE`, a bounded LRU in each worker whose entries
+live at most its TIMEOUT. An entry holds the user's token generation, a counter in `TOKEN_CACHE` that deleting or
+saving a token and saving its user (say with `is_active=False`) move on: every worker then drops its entries of
+the user on their next use. Without a `TOKEN_CACHE` shared between the workers, tokens aren't cached.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.encoding import force_bytes
+from rest_framework.authtoken.models import Token
+
+from core.cache import shared_cache
+
+User = get_user_model()
+
+
+class AlreadyRegistered(Exception):
+    pass
+
+
+def cache():
+    return shared_cache(getattr(settings, 'TOKEN_CACHE', 'default'))
+
+
+def timeout():
+    return getattr(settings, 'TOKEN_CACHE_TIMEOUT', 3600)
+
+
+def user_cache():
+    return shared_cache(getattr(settings, 'USER_CACHE', 'default'))
+
+
+def auth_cache():
+    return caches[getattr(settings, 'TOKEN_AUTH_CACHE', 'tokens')]
+
+
+def user_key(user_id):
+    return 'auth:user:{}'.format(user_id)
+
+
+def token_key(user_id):
+    return 'token:user:{}'.format(user_id)
+
+
+def generation_key(user_id):
+    return 'token:generation:{}'.format(user_id)
+
+
+def auth_key(key):
+    # Hashed, the cache backend could be shared and the keys are credentials
+    return 'token:auth:{}'.format(hashlib.sha1(force_bytes(key)).hexdigest())
+
+
+def find_user(username_email):
+    """
+    The active user with this username or email, or None
+    """
+    # Users without an email are left out of the email index, and have to be left out here for it to be used
+    return User.objects.filter(Q(username=username_email) | (Q(email__iexact=username_email) & ~Q(email='')),
+                               is_active=True).first()
+
+
+def cached_user(user_id):
+    """
+    The user with this id, or None, cached until the user is saved or deleted
+    """
+    user = user_cache().get(user_key(user_id))
+    if user is None:
+        user = User.objects.filter(pk=user_id).first()
+        if user is not None:
+            user_cache().set(user_key(user_id), user, getattr(settings, 'USER_CACHE_TIMEOUT', 300))
+    return user
+
+
+def forget_user(user_id):
+    user_cache().delete(user_key(user_id))
+    transaction.on_commit(lambda: user_cache().delete(user_key(user_id)))
+
+
+def token_for(user):
+    """
+    Key of the API token of the user, created on first use
+    """
+    key = cache().get(token_key(user.pk))
+    if key is None:
+        token, created = Token.objects.get_or_create(user=user)
+        key = token.key
+        cache().set(token_key(user.pk), key, timeout())
+    return key
+
+
+def token_generation(user_id):
+    """
+    Counter of the writes to the user and its tokens, None if `TOKEN_CACHE` can't keep it
+    """
+    generation = cache().get(generation_key(user_id))
+    if generation is None:
+        # Starting from the clock, a counter evicted from the cache can't come back as an old one
+        cache().add(generation_key(user_id), int(time.time() * 1000), timeout=None)
+        generation = cache().get(generation_key(user_id))
+    return generation
+
+
+def next_generation(user_id):
+    try:
+        cache().incr(generation_key(user_id))
+    except ValueError:
+        # Evicted, the next read starts a newer one
+        pass
+
+
+def token_user(key):
+    """
+    The user of the API token `key`, or None if there's no such token
+    """
+    entry = auth_cache().get(auth_key(key))
+    if entry is not None:
+        user, generation = entry
+        if generation == token_generation(user.pk):
+            return user
+    token = Token.objects.select_related('user').filter(key=key).first()
+    if token is None:
+        return None
+    generation = token_generation(token.user_id)
+    if generation is not None:
+        auth_cache().set(auth_key(key), (token.user, generation))
+    return token.user
+
+
+def forget_token(user_id, key=None):
+    """
+    Drops the cached token key of the user, and moves its token generation on so that every worker drops the
+    cached user of its tokens
+    """
+    cache().delete(token_key(user_id))
+    next_generation(user_id)
+    if key:
+        auth_cache().delete(auth_key(key))
+    # Once more after the commit, a request racing the write could have cached the old user meanwhile
+    transaction.on_commit(lambda: next_generation(user_id))
+
+
+def register(username, email, first_name='', last_name=''):
+    """
+    Creates the user with its API token
+
+    :returns: (user, token key)
+    :raises AlreadyRegistered: if the username or the email is taken
+    """
+    try:
+        with transaction.atomic():
+            user = User.objects.create(username=username, email=email, first_name=first_name,
+                                       last_name=last_name)
+            token = Token.objects.create(user=user)
+    except IntegrityError:
+        raise AlreadyRegistered(username)
+    cache().set(token_key(user.pk), token.key, timeout())
+    return user, token.key
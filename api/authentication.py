@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth.backends import ModelBackend
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from api import accounts
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    `Authorization: Token <key>`, with the key resolved to its user through `accounts.token_user` so a cached
+    token costs no query. `request.auth` is the key rather than the `Token`
+    """
+
+    def authenticate_credentials(self, key):
+        user = accounts.token_user(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return user, key
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    `ModelBackend` taking the signed-in user of a session from `accounts.cached_user`
+    """
+
+    def get_user(self, user_id):
+        user = accounts.cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
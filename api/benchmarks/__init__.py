@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+Latency and throughput benchmarks of every route of `api.urls`.
+
+`corpus` generates a synthetic corpus at a given scale, `scenarios` has the requests made against it and
+`runner` times them with the Django test client and gathers the results, which the `benchmark` command writes
+out as JSON so two commits can be compared:
+
+    ./manage.py benchmark --scale small --output before.json
+    ./manage.py benchmark --scale small --compare before.json
+
+The command runs in a test database of the configured backend (SQLite or Postgres), never in the real one.
+"""
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic corpus for the benchmarks.
+
+Popularity follows Zipf's law as it does on real Q&A sites: a few tags are on most questions, a few users write
+most of the posts, a few words make up most of the text, and most questions get none to a couple of answers
+while some get dozens. A share of the answers reply to an earlier answer of the same thread, at any depth.
+
+Everything is drawn from one seeded generator and dated back from a fixed point, the same spec and seed always
+give the same corpus. It's written through `core.importer`, the way a real import is.
+"""
+import bisect
+import datetime
+import json
+import random
+import tempfile
+from collections import OrderedDict, namedtuple
+from timeit import default_timer
+
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.six.moves import range
+
+from core import ranking
+from core.importer import import_questions
+from core.models import Profile, Tag
+
+CorpusSpec = namedtuple('CorpusSpec', ('questions', 'profiles', 'tags', 'vocabulary', 'max_answers',
+                                       'reply_ratio'))
+
+SCALES = OrderedDict((
+    ('tiny', CorpusSpec(questions=50, profiles=20, tags=15, vocabulary=300, max_answers=10, reply_ratio=0.3)),
+    ('small', CorpusSpec(questions=2000, profiles=300, tags=150, vocabulary=3000, max_answers=40,
+                         reply_ratio=0.3)),
+    ('medium', CorpusSpec(questions=20000, profiles=3000, tags=1000, vocabulary=10000, max_answers=100,
+                          reply_ratio=0.3)),
+    ('large', CorpusSpec(questions=200000, profiles=30000, tags=5000, vocabulary=30000, max_answers=200,
+                         reply_ratio=0.3)),
+))
+
+EPOCH = datetime.datetime(2019, 1, 1, tzinfo=timezone.utc)
+SPAN_SECONDS = 365 * 24 * 3600
+CHECKPOINT = 'benchmark-corpus'
+SYLLABLES = ('ba', 'ca', 'de', 'do', 'fi', 'ga', 'ho', 'ja', 'ke', 'lo', 'ma', 'ne', 'no', 'pi', 'qu', 'ra',
+             'ri', 'sa', 'so', 'ta', 'tu', 've', 'xi', 'zo')
+
+
+class Zipf(object):
+    """
+    Draws ranks 0 to n - 1, rank r with a probability proportional to 1 / (r + 1) ** exponent
+    """
+
+    def __init__(self, n, exponent=1.1):
+        self.cumulative = []
+        total = 0.0
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** exponent
+            self.cumulative.append(total)
+        self.total = total
+
+    def draw(self, rng):
+        return bisect.bisect_left(self.cumulative, rng.random() * self.total)
+
+
+def make_words(count, rng, exclude=()):
+    words, seen = [], set(exclude)
+    while len(words) < count:
+        word = ''.join(rng.choice(SYLLABLES) for index in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def vocabulary(spec, rng):
+    """
+    (words, tag names), most frequent first. The first draws of `rng`, so the scenarios can get them back
+    """
+    words = make_words(spec.vocabulary, rng)
+    return words, make_words(spec.tags, rng, exclude=words)
+
+
+def username(rank):
+    return 'bench{rank}'.format(rank=rank)
+
+
+def question_records(spec, seed=0):
+    """
+    The records of the corpus in the import format of `core.importer`
+    """
+    rng = random.Random(seed)
+    words, tag_names = vocabulary(spec, rng)
+    word_rank, tag_rank, author_rank = Zipf(len(words)), Zipf(len(tag_names)), Zipf(spec.profiles)
+    answer_count, vote_count = Zipf(spec.max_answers + 1, exponent=1.5), Zipf(1000, exponent=1.5)
+
+    def text(low, high):
+        return ' '.join(words[word_rank.draw(rng)] for index in range(rng.randint(low, high)))
+
+    for index in range(spec.questions):
+        created = EPOCH - datetime.timedelta(seconds=rng.randint(0, SPAN_SECONDS))
+        answered = created
+        answers = []
+        for ref in range(answer_count.draw(rng)):
+            answered += datetime.timedelta(seconds=rng.randint(60, 24 * 3600))
+            answers.append({
+                'ref': str(ref), 'parent': str(rng.randrange(ref)) if ref and rng.random() < spec.reply_ratio else None,
+                'answer': text(10, 120), 'answer_by': username(author_rank.draw(rng)), 'accepted': False,
+                'up_vote': vote_count.draw(rng), 'down_vote': vote_count.draw(rng) // 4,
+                'favourite': vote_count.draw(rng) // 8, 'created': answered.isoformat()})
+        top_level = [answer for answer in answers if answer['parent'] is None]
+        if top_level and rng.random() < 0.4:
+            rng.choice(top_level)['accepted'] = True
+        yield {
+            'title': text(4, 12).capitalize() + '?', 'question': text(20, 200),
+            'asked_by': username(author_rank.draw(rng)),
+            'tags': sorted(set(tag_names[tag_rank.draw(rng)] for tag in range(rng.randint(1, 5)))),
+            'up_vote': vote_count.draw(rng), 'down_vote': vote_count.draw(rng) // 4,
+            'created': created.isoformat(), 'answers': answers,
+        }
+
+
+def build_corpus(spec, seed=0, chunk_size=1000):
+    """
+    Generates the corpus and imports it, the authors get their users and profiles on the way, then scores the
+    questions for `sort=hot`
+
+    :returns: {'questions', 'answers', 'profiles', 'tags', 'generate_seconds', 'import_seconds', 'rank_seconds'}
+    """
+    started = default_timer()
+    with tempfile.TemporaryFile() as stream:
+        for record in question_records(spec, seed):
+            stream.write(force_bytes(json.dumps(record)) + b'\n')
+        generated = default_timer()
+        questions = answers = 0
+        for chunk_questions, chunk_answers in import_questions(stream, CHECKPOINT, chunk_size=chunk_size,
+                                                               create_profiles=True, restart=True):
+            questions += chunk_questions
+            answers += chunk_answers
+    imported = default_timer()
+    ranking.rank_questions()
+    return OrderedDict((
+        ('questions', questions),
+        ('answers', answers),
+        ('profiles', Profile.objects.count()),
+        ('tags', Tag.objects.count()),
+        ('generate_seconds', generated - started),
+        ('import_seconds', imported - generated),
+        ('rank_seconds', default_timer() - imported),
+    ))
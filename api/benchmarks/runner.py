@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Times the scenarios with the Django test client and compares two runs.
+
+Every scenario makes `warmup` untimed requests, then `requests` timed ones spread over `concurrency` threads,
+each thread with its own client, connection and random generator seeded from the run's seed. A request counts
+as an error when it raises or answers with a 5xx. The queries of each request are counted as well, they don't
+depend on the machine the way the timings do.
+"""
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from timeit import default_timer
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.six.moves import range
+
+from api import accounts
+from api.benchmarks import corpus
+from api.benchmarks.scenarios import SCENARIOS, Fixtures
+from core.cache import is_process_local
+from core.tags import tag_catalog
+
+# Latencies and query counts a comparison looks at, a change above the tolerance is a regression
+COMPARED = ('p50_ms', 'p95_ms', 'queries_max')
+# Session engines a run can use instead of SESSION_ENGINE
+SESSION_ENGINES = OrderedDict((
+    ('db', 'django.contrib.sessions.backends.db'),
+    ('cached-db', 'django.contrib.sessions.backends.cached_db'),
+    ('api', 'api.sessions'),
+))
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile of sorted `values`
+    """
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+
+def benchmark_caches(directory):
+    """
+    A copy of every cache only the run uses, so it neither reads nor clears anything a deployment shares. The
+    shared ones are copied to files in `directory`, a process local copy would leave them unused
+    (`core.cache.shared_cache`)
+    """
+    copies = {}
+    for alias, config in settings.CACHES.items():
+        if is_process_local(caches[alias]):
+            copies[alias] = dict(config, BACKEND='core.cache.LRUCache', LOCATION='benchmark-{}'.format(alias))
+        else:
+            copies[alias] = dict(config, BACKEND='django.core.cache.backends.filebased.FileBasedCache',
+                                 LOCATION=os.path.join(directory, alias))
+    return copies
+
+
+def scenario_rng(seed, name, worker):
+    return random.Random(seed * 1000003 + (zlib.crc32(force_bytes(name)) & 0xffffffff) * 101 + worker)
+
+
+class Worker(threading.Thread):
+
+    def __init__(self, scenario, fixtures, seed, number, count):
+        super(Worker, self).__init__(name='benchmark-{name}-{number}'.format(name=scenario.name, number=number))
+        self.scenario = scenario
+        self.fixtures = fixtures
+        self.rng = scenario_rng(seed, scenario.name, number)
+        self.count = count
+        self.client = Client()
+        self.samples = []
+        self.errors = Counter()
+
+    def login(self):
+        if self.scenario.token:
+            self.client.defaults['HTTP_AUTHORIZATION'] = 'Token {key}'.format(
+                key=accounts.token_for(getattr(self.fixtures, self.scenario.user)))
+        elif self.scenario.user:
+            self.client.force_login(getattr(self.fixtures, self.scenario.user))
+
+    def request(self, record=True):
+        method, path, data = self.scenario.build(self.fixtures, self.rng)
+        if self.scenario.relogin:
+            self.login()
+        started = default_timer()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(path, data)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+        except Exception as error:
+            if record:
+                self.errors[error.__class__.__name__] += 1
+            return
+        if record:
+            self.samples.append((default_timer() - started, response.status_code, len(queries)))
+
+    def run(self):
+        try:
+            self.work()
+        finally:
+            connection.close()
+
+    def work(self):
+        self.login()
+        for index in range(self.count):
+            self.request()
+
+
+def run_scenario(scenario, fixtures, requests=100, warmup=10, concurrency=1, seed=0):
+    """
+    :returns: the summary of the timed requests, see `summarize`
+    """
+    warming = Worker(scenario, fixtures, seed, -1, warmup)
+    warming.login()
+    for index in range(warmup):
+        warming.request(record=False)
+    workers = [Worker(scenario, fixtures, seed, number, requests // concurrency + (number < requests % concurrency))
+               for number in range(concurrency)]
+    started = default_timer()
+    if concurrency == 1:
+        workers[0].work()
+    else:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    elapsed = default_timer() - started
+    return summarize(scenario, [sample for worker in workers for sample in worker.samples],
+                     sum((worker.errors for worker in workers), Counter()), elapsed, concurrency)
+
+
+def summarize(scenario, samples, exceptions, elapsed, concurrency):
+    latencies = sorted(1000 * seconds for seconds, status, queries in samples)
+    queries = [count for seconds, status, count in samples]
+    statuses = Counter(str(status) for seconds, status, count in samples)
+    statuses.update(exceptions)
+
+    def rounded(value):
+        return round(value, 3) if value is not None else None
+
+    return OrderedDict((
+        ('route', scenario.route),
+        ('requests', len(samples) + sum(exceptions.values())),
+        ('concurrency', concurrency),
+        ('errors', sum(exceptions.values()) + sum(1 for seconds, status, count in samples if status >= 500)),
+        ('statuses', OrderedDict(sorted(statuses.items()))),
+        ('mean_ms', rounded(sum(latencies) / len(latencies) if latencies else None)),
+        ('p50_ms', rounded(percentile(latencies, 50))),
+        ('p95_ms', rounded(percentile(latencies, 95))),
+        ('p99_ms', rounded(percentile(latencies, 99))),
+        ('max_ms', rounded(latencies[-1] if latencies else None)),
+        ('throughput_rps', rounded(len(samples) / elapsed if elapsed else None)),
+        ('queries_mean', rounded(float(sum(queries)) / len(queries) if queries else None)),
+        ('queries_max', max(queries) if queries else None),
+    ))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                       stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(spec, names=None, seed=0, requests=100, warmup=10, concurrency=1, log=None, sessions=None):
+    """
+    Builds the corpus in the current database and runs the scenarios called `names` (all of them by default)
+    against it, with the `sessions` engine of `SESSION_ENGINES` if given. `log` is called with each scenario name
+    and its summary as they finish.
+
+    :returns: the results as a JSON serializable dict
+    """
+    started = timezone.now()
+    session_engine = SESSION_ENGINES[sessions] if sessions else settings.SESSION_ENGINE
+    directory = tempfile.mkdtemp(prefix='benchmark-caches-')
+    try:
+        with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False, PERF_SAMPLE_RATE=0,
+                               CACHES=benchmark_caches(directory), SESSION_ENGINE=session_engine):
+            for cache in caches.all():
+                cache.clear()
+            tag_catalog.invalidate()
+            built = corpus.build_corpus(spec, seed)
+            fixtures = Fixtures(spec, seed)
+            results = OrderedDict()
+            for name in names or SCENARIOS:
+                results[name] = run_scenario(SCENARIOS[name], fixtures, requests, warmup, concurrency, seed)
+                if log is not None:
+                    log(name, results[name])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return OrderedDict((
+        ('meta', OrderedDict((
+            ('commit', git_commit()),
+            ('started', started.isoformat()),
+            ('python', platform.python_version()),
+            ('django', django.get_version()),
+            ('database', connection.vendor),
+            ('sessions', session_engine),
+            ('seed', seed),
+            ('requests', requests),
+            ('warmup', warmup),
+            ('concurrency', concurrency),
+        ))),
+        ('corpus', OrderedDict([('spec', spec._asdict())] + list(built.items()))),
+        ('scenarios', results),
+    ))
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    [(scenario, metric, before, after, regressed), ...] of the scenarios both runs have. Timings regress past
+    `tolerance` (a ratio), query counts on any increase
+    """
+    rows = []
+    for name, result in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        for metric in COMPARED:
+            old, new = before.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            limit = old if metric.startswith('queries') else old * (1 + tolerance)
+            rows.append((name, metric, old, new, new > limit))
+    return rows
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+The requests the benchmarks time, at least one scenario per route of `api.urls`.
+
+A scenario builds one request at a time as (method, path, data) out of the corpus, picking the questions to read
+or vote on by popularity. `user` is who the test client is logged in as: nobody, `member` (the most active author
+of the corpus) or `staff`; `relogin` logs in again before every request, for scenarios that log out, and `token`
+sends the user's API token with every request instead of logging in.
+"""
+import itertools
+import random
+from collections import OrderedDict, namedtuple
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from api.benchmarks.corpus import Zipf, vocabulary, username
+from core.models import Question, Profile
+
+User = get_user_model()
+
+Scenario = namedtuple('Scenario', ('name', 'route', 'user', 'relogin', 'token', 'build'))
+
+SCENARIOS = OrderedDict()
+# Questions and answers the vote storms pile onto
+HOT_POSTS = 10
+
+
+def scenario(name, route, user=None, relogin=False, token=False):
+    def register(build):
+        SCENARIOS[name] = Scenario(name, route, user, relogin, token, build)
+        return build
+    return register
+
+
+class Fixtures(object):
+    """
+    What the scenarios build their requests from, read back from the corpus in the database
+    """
+
+    def __init__(self, spec, seed=0):
+        # The corpus drew its vocabulary first from the same seed
+        self.words, self.tag_names = vocabulary(spec, random.Random(seed))
+        self.word_rank, self.tag_rank = Zipf(len(self.words)), Zipf(len(self.tag_names))
+        self.question_ids = list(Question.objects.order_by('-up_vote', 'id').values_list('id', flat=True))
+        self.question_rank = Zipf(len(self.question_ids))
+        self.hot_questions = list(Question.objects.order_by('-up_vote', 'id').values_list(
+            'id', 'title', 'question')[:HOT_POSTS])
+        self.hot_answers = list(Question.answer.through.objects.order_by('-answer__up_vote', 'answer_id').values_list(
+            'question_id', 'answer_id', 'answer__answer')[:HOT_POSTS])
+        self.profile_ids = list(Profile.objects.order_by('id').values_list('id', flat=True))
+        self.member = User.objects.get(username=username(0))
+        self.member_profile_id = Profile.objects.get(user=self.member).id
+        self.staff, created = User.objects.get_or_create(username='bench-staff',
+                                                         defaults={'is_staff': True, 'is_superuser': True})
+        self.sign_ups = itertools.count()
+
+    def popular_question(self, rng):
+        return self.question_ids[self.question_rank.draw(rng)]
+
+    def word(self, rng):
+        return self.words[self.word_rank.draw(rng)]
+
+    def tag_name(self, rng):
+        return self.tag_names[self.tag_rank.draw(rng)]
+
+    def text(self, rng, length):
+        return ' '.join(self.word(rng) for index in range(length))
+
+
+@scenario('home', 'page')
+def home(fixtures, rng):
+    return 'get', reverse('api:page'), {}
+
+
+@scenario('home-signed-in', 'page', user='member')
+def home_signed_in(fixtures, rng):
+    return 'get', reverse('api:page'), {}
+
+
+@scenario('home-by-votes', 'page')
+def home_by_votes(fixtures, rng):
+    return 'get', reverse('api:page'), {'ordering': 'votes'}
+
+
+@scenario('home-hot', 'page')
+def home_hot(fixtures, rng):
+    return 'get', reverse('api:page'), {'sort': 'hot'}
+
+
+@scenario('home-unanswered', 'page')
+def home_unanswered(fixtures, rng):
+    return 'get', reverse('api:page'), {'sort': 'unanswered'}
+
+
+@scenario('search', 'page')
+def search(fixtures, rng):
+    return 'get', reverse('api:page'), {'searchText': ' '.join(fixtures.word(rng) for index in range(2))}
+
+
+@scenario('thread', 'page')
+def thread(fixtures, rng):
+    return 'get', reverse('api:page'), {'question_thread_id': fixtures.popular_question(rng)}
+
+
+@scenario('question-page', 'page')
+def question_page(fixtures, rng):
+    return 'get', reverse('api:page'), {'question_id': fixtures.popular_question(rng)}
+
+
+@scenario('profile-page', 'page', user='member')
+def profile_page(fixtures, rng):
+    return 'get', reverse('api:page'), {'profile': 1}
+
+
+@scenario('sign-up', 'sign-up')
+def sign_up(fixtures, rng):
+    number = next(fixtures.sign_ups)
+    return 'post', reverse('api:sign-up'), {
+        'username': 'signup{number}'.format(number=number), 'email': 'signup{number}@example.com'.format(
+            number=number), 'first_name': fixtures.word(rng), 'last_name': fixtures.word(rng)}
+
+
+@scenario('login', 'user-login')
+def user_login(fixtures, rng):
+    return 'post', reverse('api:user-login'), {'username_email': fixtures.member.username}
+
+
+@scenario('logout', 'user-logout', user='member', relogin=True)
+def user_logout(fixtures, rng):
+    return 'get', reverse('api:user-logout'), {}
+
+
+@scenario('ask', 'question', user='member')
+def ask(fixtures, rng):
+    return 'post', reverse('api:question'), {
+        'title': fixtures.text(rng, 8), 'question': fixtures.text(rng, 60), 'profile_id': fixtures.member_profile_id,
+        'tag': [fixtures.tag_name(rng) for index in range(3)]}
+
+
+@scenario('question-vote-storm', 'question', user='member')
+def question_vote_storm(fixtures, rng):
+    question_id, title, question = rng.choice(fixtures.hot_questions)
+    return 'post', reverse('api:question'), {
+        'id': question_id, 'title': title, 'question': question, 'profile_id': fixtures.member_profile_id,
+        'up_vote': rng.random() < 0.8, 'down_vote': rng.random() < 0.1}
+
+
+@scenario('answer', 'answer', user='member')
+def answer(fixtures, rng):
+    return 'post', reverse('api:answer'), {
+        'question_id': fixtures.popular_question(rng), 'answer': fixtures.text(rng, 40),
+        'profile_id': fixtures.member_profile_id}
+
+
+@scenario('answer-vote-storm', 'answer', user='member')
+def answer_vote_storm(fixtures, rng):
+    question_id, answer_id, text = rng.choice(fixtures.hot_answers)
+    return 'post', reverse('api:answer'), {
+        'question_id': question_id, 'answer_id': answer_id, 'answer': text,
+        'profile_id': fixtures.member_profile_id, 'up_vote': rng.random() < 0.8,
+        'down_vote': rng.random() < 0.1, 'favourite': rng.random() < 0.2}
+
+
+@scenario('profile-update', 'profile', user='member')
+def profile_update(fixtures, rng):
+    return 'post', reverse('api:profile'), {
+        'profile_id': fixtures.member_profile_id, 'user_id': fixtures.member.id, 'title': fixtures.text(rng, 3),
+        'first_name': fixtures.word(rng), 'last_name': fixtures.word(rng), 'location': fixtures.word(rng),
+        'description': fixtures.text(rng, 30)}
+
+
+@scenario('question-list', 'question-list')
+def question_list(fixtures, rng):
+    return 'get', reverse('api:question-list'), {'sort': rng.choice(['hot', 'top', 'new', 'unanswered'])}
+
+
+@scenario('question-detail', 'question-detail')
+def question_detail(fixtures, rng):
+    return 'get', reverse('api:question-detail', kwargs={'pk': fixtures.popular_question(rng)}), {}
+
+
+@scenario('tag-list', 'tag-list')
+def tag_list(fixtures, rng):
+    return 'get', reverse('api:tag-list'), {}
+
+
+@scenario('tag-autocomplete', 'tag-autocomplete')
+def tag_autocomplete(fixtures, rng):
+    return 'get', reverse('api:tag-autocomplete'), {'q': fixtures.tag_name(rng)[:rng.randint(1, 4)]}
+
+
+@scenario('profile-detail', 'profile-detail')
+def profile_detail(fixtures, rng):
+    return 'get', reverse('api:profile-detail', kwargs={'pk': rng.choice(fixtures.profile_ids)}), {}
+
+
+@scenario('profile-detail-token', 'profile-detail', user='member', token=True)
+def profile_detail_token(fixtures, rng):
+    return profile_detail(fixtures, rng)
+
+
+@scenario('export-tags', 'export', user='staff')
+def export_tags(fixtures, rng):
+    return 'get', reverse('api:export', kwargs={'dataset': 'tags'}), {'output': rng.choice(['jsonl', 'csv'])}
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Whole page cache for anonymous readers of `PageViewSet`.
+
+Pages are keyed on their normalized query string and on a generation number of the scope they belong to:
+the listing (home page and searches) or a single question thread. A write bumps the generation of exactly
+the scopes it affects, which makes their old pages unreachable; the backend then evicts them by LRU/TTL.
+
+The pages are kept in the `responses` alias of CACHES, any Django cache backend works (`core.cache.LRUCache`,
+file based, database...). The generations are kept in RESPONSE_GENERATION_CACHE, which has to be shared by the
+workers (and the `rollup_votes`, `rank_questions` and import processes): a write in one of them moves on the
+generations every worker reads, and a worker keeping pages of its own stops serving the old ones. With a cache
+living in each process, no page is cached.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlencode
+
+from core.cache import shared_cache
+
+LISTING = 'listing'
+
+
+def thread_scope(question_id):
+    return 'thread:{id}'.format(id=question_id)
+
+
+class ResponseCache(object):
+    cache_alias = 'responses'
+    # Only the parameters of the pages that are the same for every anonymous reader
+    cacheable_parameters = ('question_thread_id', 'searchText', 'sort', 'ordering', 'page_size', 'cursor',
+                            'reply_depth', 'collapse')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def generation_cache(self):
+        return shared_cache(getattr(settings, 'RESPONSE_GENERATION_CACHE', 'shared'))
+
+    def is_cacheable(self, request):
+        return (request.method in ('GET', 'HEAD') and not request.user.is_authenticated and
+                all(parameter in self.cacheable_parameters for parameter in request.GET) and
+                request.GET.get('question_thread_id', '0').isdigit())
+
+    def scope(self, request):
+        question_id = request.GET.get('question_thread_id')
+        return thread_scope(question_id) if question_id else LISTING
+
+    def generation(self, scope):
+        """
+        :returns: None if the generations can't be shared
+        """
+        key = 'generation:{scope}'.format(scope=scope)
+        generation = self.generation_cache.get(key)
+        if generation is None:
+            # Starting from the clock, a generation evicted from the cache can't come back as an old one
+            self.generation_cache.add(key, int(time.time() * 1000), timeout=None)
+            generation = self.generation_cache.get(key)
+        return generation
+
+    def key(self, request):
+        """
+        :returns: None if the page can't be cached
+        """
+        scope = self.scope(request)
+        generation = self.generation(scope)
+        if generation is None:
+            return None
+        query = urlencode(sorted((key, value) for key, values in request.GET.lists() for value in values if value))
+        return 'page:{scope}:{generation}:{hash}'.format(scope=scope, generation=generation,
+                                                          hash=hashlib.md5(force_bytes(query)).hexdigest())
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, request):
+        key = self.key(request)
+        cached = None if key is None else self.cache.get(key)
+        self.count(cached is not None)
+        if cached is None:
+            return None
+        content, content_type, status = cached
+        response = HttpResponse(content, content_type=content_type, status=status)
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def set(self, request, response):
+        # A page holding a CSRF token belongs to the reader it was rendered for
+        if response.status_code != 200 or request.META.get('CSRF_COOKIE_USED') or response.cookies:
+            return
+        key = self.key(request)
+        if key is None:
+            return
+        self.cache.set(key, (response.content, response['Content-Type'], response.status_code))
+        response['X-Cache'] = 'MISS'
+
+    def invalidate(self, *scopes):
+        for scope in scopes:
+            key = 'generation:{scope}'.format(scope=scope)
+            try:
+                self.generation_cache.incr(key)
+            except ValueError:
+                pass
+
+    def invalidate_listing(self):
+        self.invalidate(LISTING)
+
+    def invalidate_threads(self, question_ids, listing=False):
+        scopes = [thread_scope(question_id) for question_id in set(question_ids)]
+        self.invalidate(*(scopes + [LISTING] if listing else scopes))
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_ratio': float(self.hits) / total if total else 0.0}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request query and latency instrumentation.
+
+A sampled request (`PERF_SAMPLE_RATE`) records every SQL query it runs on every connection, with its time, and
+the time spent rendering templates (DRF responses included) and running serializers. The numbers are aggregated
+per view in this process and shown on `/qa-admin/perf/`, or scraped in the Prometheus text format from
+`/qa-admin/perf/metrics/`.
+
+Every worker keeps numbers of its own, and a page or a scrape only covers the worker that happened to answer it.
+The metrics are labelled with the `pid` of that worker, so each worker's counters are series of their own rather
+than one series jumping between workers; add them up across `pid`s (`sum without (pid) (...)`).
+
+A request running the same SQL shape (the query with its literals taken out) more than
+`PERF_N_PLUS_ONE_THRESHOLD` times is flagged as an N+1 pattern and logged to the `qa.perf` logger.
+
+A request that isn't sampled costs one random number and a thread-local lookup per `timer()`.
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('qa.perf')
+
+# Upper bounds of the request duration histogram, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SQL_LITERALS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+_local = threading.local()
+
+
+def sample_rate():
+    return getattr(settings, 'PERF_SAMPLE_RATE', 0)
+
+
+def n_plus_one_threshold():
+    return getattr(settings, 'PERF_N_PLUS_ONE_THRESHOLD', 10)
+
+
+def sql_shape(sql):
+    """
+    The query with its literals and IN lists replaced, the same for every row an N+1 loop fetches
+    """
+    for pattern, replacement in SQL_LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class RequestProfile(object):
+    """
+    What one sampled request spent its time on
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.duration = 0.0
+        self.queries = []
+        self.timings = Counter()
+        self._connections = []
+
+    def start_queries(self):
+        # The debug cursor logs every query with its time, as it does with DEBUG on
+        for connection in connections.all():
+            self._connections.append((connection, connection.force_debug_cursor, len(connection.queries_log)))
+            connection.force_debug_cursor = True
+
+    def stop_queries(self):
+        for connection, force_debug_cursor, start in self._connections:
+            connection.force_debug_cursor = force_debug_cursor
+            self.queries.extend(list(connection.queries_log)[start:])
+        self._connections = []
+
+    @property
+    def sql_time(self):
+        return sum(float(query['time']) for query in self.queries)
+
+    def repeated_shapes(self, threshold=None):
+        """
+        [(shape, times), ...] of the SQL shapes run more than `threshold` times, most repeated first
+        """
+        threshold = n_plus_one_threshold() if threshold is None else threshold
+        shapes = Counter(sql_shape(query['sql']) for query in self.queries)
+        return [(shape, count) for shape, count in shapes.most_common() if count > threshold]
+
+
+class timer(object):
+    """
+    Adds the time spent in the block to `name` of the current sampled request, does nothing otherwise
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        self.profile = getattr(_local, 'profile', None)
+        if self.profile is not None:
+            self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.timings[self.name] += time.time() - self.started
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+class ViewStats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.timings = Counter()
+        self.n_plus_one = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+    def add(self, profile, flagged):
+        self.requests += 1
+        self.seconds += profile.duration
+        self.max_seconds = max(self.max_seconds, profile.duration)
+        self.sql_queries += len(profile.queries)
+        self.sql_seconds += profile.sql_time
+        self.timings.update(profile.timings)
+        self.n_plus_one += 1 if flagged else 0
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if profile.duration <= bound:
+                self.buckets[index] += 1
+
+
+class Registry(object):
+    """
+    Aggregates of the sampled requests of this process (one worker only), per view
+    """
+
+    def __init__(self, recent_size=50):
+        self.lock = threading.Lock()
+        self.views = OrderedDict()
+        self.recent_n_plus_one = deque(maxlen=recent_size)
+
+    def record(self, view, profile):
+        repeated = profile.repeated_shapes()
+        for shape, count in repeated:
+            logger.warning('N+1 in %s: %d x %s', view, count, shape)
+        with self.lock:
+            self.views.setdefault(view, ViewStats()).add(profile, bool(repeated))
+            for shape, count in repeated:
+                self.recent_n_plus_one.appendleft((view, shape, count, profile.started))
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+            self.recent_n_plus_one.clear()
+
+    def snapshot(self):
+        """
+        [(view, stats as a dict), ...] by view name, and the recent N+1 patterns
+        """
+        with self.lock:
+            views = [(view, {
+                'requests': stats.requests,
+                'seconds': stats.seconds,
+                'avg_ms': 1000 * stats.seconds / stats.requests,
+                'max_ms': 1000 * stats.max_seconds,
+                'sql_queries': stats.sql_queries,
+                'avg_sql_queries': float(stats.sql_queries) / stats.requests,
+                'sql_seconds': stats.sql_seconds,
+                'avg_sql_ms': 1000 * stats.sql_seconds / stats.requests,
+                'template_seconds': stats.timings['template'],
+                'avg_template_ms': 1000 * stats.timings['template'] / stats.requests,
+                'serializer_seconds': stats.timings['serializer'],
+                'avg_serializer_ms': 1000 * stats.timings['serializer'] / stats.requests,
+                'n_plus_one': stats.n_plus_one,
+                'buckets': list(stats.buckets),
+            }) for view, stats in sorted(self.views.items())]
+            return views, list(self.recent_n_plus_one)
+
+    def prometheus(self):
+        """
+        The aggregates in the Prometheus text exposition format, labelled with the pid of this process
+        """
+        views = self.snapshot()[0]
+        pid = str(os.getpid())
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP {name} {help}'.format(name=name, help=help_text))
+            lines.append('# TYPE {name} {kind}'.format(name=name, kind=kind))
+            for suffix, labels, value in samples:
+                lines.append('{name}{suffix}{{{labels}}} {value}'.format(
+                    name=name, suffix=suffix, labels=','.join('{}="{}"'.format(key, escape_label(label_value))
+                                                              for key, label_value in [('pid', pid)] + labels),
+                    value=repr(float(value)) if isinstance(value, float) else value))
+
+        metric('qa_requests_total', 'counter', 'Sampled requests.',
+               [('', [('view', view)], stats['requests']) for view, stats in views])
+        histogram = []
+        for view, stats in views:
+            for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+                histogram.append(('_bucket', [('view', view), ('le', repr(bound))], count))
+            histogram.append(('_bucket', [('view', view), ('le', '+Inf')], stats['requests']))
+            histogram.append(('_sum', [('view', view)], stats['seconds']))
+            histogram.append(('_count', [('view', view)], stats['requests']))
+        metric('qa_request_duration_seconds', 'histogram', 'Duration of sampled requests.', histogram)
+        metric('qa_sql_queries_total', 'counter', 'SQL queries run by sampled requests.',
+               [('', [('view', view)], stats['sql_queries']) for view, stats in views])
+        metric('qa_sql_duration_seconds_total', 'counter', 'Time sampled requests spent in SQL.',
+               [('', [('view', view)], stats['sql_seconds']) for view, stats in views])
+        metric('qa_template_duration_seconds_total', 'counter', 'Time sampled requests spent rendering templates.',
+               [('', [('view', view)], stats['template_seconds']) for view, stats in views])
+        metric('qa_serializer_duration_seconds_total', 'counter', 'Time sampled requests spent in serializers.',
+               [('', [('view', view)], stats['serializer_seconds']) for view, stats in views])
+        metric('qa_n_plus_one_requests_total', 'counter', 'Sampled requests with a repeated SQL shape.',
+               [('', [('view', view)], stats['n_plus_one']) for view, stats in views])
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+class TimedSerializerMixin(object):
+    """
+    Counts validation (which is where these serializers save) and representation as serializer time
+    """
+
+    def is_valid(self, *args, **kwargs):
+        with timer('serializer'):
+            return super(TimedSerializerMixin, self).is_valid(*args, **kwargs)
+
+    @property
+    def data(self):
+        with timer('serializer'):
+            return super(TimedSerializerMixin, self).data
+
+
+class InstrumentationMiddleware(object):
+    """
+    Profiles a `PERF_SAMPLE_RATE` share of the requests, keep it first in MIDDLEWARE so it sees the whole request
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = sample_rate()
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+        profile = RequestProfile()
+        _local.profile = profile
+        profile.start_queries()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.stop_queries()
+            profile.duration = time.time() - profile.started
+            _local.profile = None
+        match = getattr(request, 'resolver_match', None)
+        registry.record(match.view_name if match else 'unresolved', profile)
+        response['X-Query-Count'] = str(len(profile.queries))
+        return response
+
+    def process_template_response(self, request, response):
+        profile = current_profile()
+        if profile is not None and not response.is_rendered:
+            started = time.time()
+
+            def rendered(response):
+                profile.timings['template'] += time.time() - started
+            response.add_post_render_callback(rendered)
+        return response
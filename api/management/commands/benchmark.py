@@ -0,0 +1,71 @@
+import io
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from api.benchmarks import corpus, runner
+from api.benchmarks.scenarios import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = ('Time every API route against a synthetic corpus built in a throwaway test database and write the '
+            'results as JSON, see `api.benchmarks`')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Any of {scenarios}, defaults to all of them'.format(
+            scenarios=', '.join(SCENARIOS)))
+        parser.add_argument('--scale', choices=list(corpus.SCALES), default='small')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Threads per scenario, needs Postgres or an on-disk SQLite test database')
+        parser.add_argument('--sessions', choices=list(runner.SESSION_ENGINES),
+                            help='Session engine to run with instead of SESSION_ENGINE')
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--compare', help='Results of an earlier run to compare with')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Slowdown ratio above which a timing counts as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Delete a leftover test database without asking')
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']).difference(SCENARIOS)
+        if unknown:
+            raise CommandError('Unknown scenarios: {scenarios}'.format(scenarios=', '.join(sorted(unknown))))
+        if options['requests'] < options['concurrency'] or options['concurrency'] < 1:
+            raise CommandError('--requests has to be at least --concurrency, which has to be at least 1')
+        baseline = None
+        if options['compare']:
+            with io.open(options['compare'], encoding='utf-8') as stream:
+                baseline = json.load(stream)
+        connection = connections[DEFAULT_DB_ALIAS]
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=options['verbosity'], autoclobber=not options['interactive'],
+                                           serialize=False)
+        try:
+            results = runner.run(corpus.SCALES[options['scale']], options['scenarios'], options['seed'],
+                                 options['requests'], options['warmup'], options['concurrency'], log=self.log,
+                                 sessions=options['sessions'])
+        finally:
+            connection.creation.destroy_test_db(old_name, options['verbosity'])
+        results['meta']['scale'] = options['scale']
+        with io.open(options['output'], 'w', encoding='utf-8') as output:
+            output.write(json.dumps(results, indent=2, ensure_ascii=False) + u'\n')
+        self.stdout.write('Wrote {path}'.format(path=options['output']))
+        if baseline is not None:
+            self.report(runner.compare(baseline, results, options['tolerance']), options['fail_on_regression'])
+
+    def log(self, name, result):
+        self.stdout.write('{name:<22} p50 {p50_ms!s:>9} ms  p95 {p95_ms!s:>9} ms  {throughput_rps!s:>9} req/s  '
+                          '{queries_mean!s:>6} queries  {errors} errors'.format(name=name, **result))
+
+    def report(self, rows, fail):
+        regressions = [row for row in rows if row[4]]
+        for name, metric, before, after, regressed in rows:
+            self.stdout.write('{flag} {name:<22} {metric:<12} {before!s:>10} -> {after!s:>10}'.format(
+                flag='!' if regressed else ' ', name=name, metric=metric, before=before, after=after))
+        if regressions and fail:
+            raise CommandError('{count} regressions'.format(count=len(regressions)))
@@ -0,0 +1,19 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.sessions import SessionStore
+
+
+class Command(BaseCommand):
+    help = 'Delete the expired sessions in batches, for SESSION_ENGINE = "api.sessions"'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SESSION_PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.time()
+        deleted = SessionStore.clear_expired(options['batch_size'])
+        self.stdout.write('Deleted {count} expired sessions in {seconds:.2f}s'.format(
+            count=deleted, seconds=time.time() - started))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.encoding import force_bytes, force_text
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorPage(object):
+    """
+    One page of a keyset paginated queryset with the opaque tokens to reach its neighbours
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator(object):
+    """
+    **Keyset (cursor) pagination**
+        Pages through a queryset by remembering the ordering key of the last row it returned instead of
+        an offset, so every page is a single indexed range scan no matter how deep it is.
+
+        The ordering must end with a unique field, by default it's `(created, id)` from `TimeStampedModel`.
+        Cursors are opaque url-safe tokens, `next_cursor`/`previous_cursor` are `None` at the edges.
+    """
+    default_ordering = ('-created', '-id')
+
+    def __init__(self, queryset, page_size, ordering=None):
+        self.queryset = queryset
+        self.page_size = page_size
+        self.ordering = tuple(ordering or self.default_ordering)
+        opts = queryset.model._meta
+        self.fields = [(opts.get_field(name.lstrip('-')), name.startswith('-')) for name in self.ordering]
+
+    def position_of(self, obj):
+        """
+        Ordering key of a model instance or of a `values()` row
+        """
+        for field, descending in self.fields:
+            value = obj[field.attname] if isinstance(obj, dict) else field.value_from_object(obj)
+            yield value.isoformat() if hasattr(value, 'isoformat') else value
+
+    def encode_cursor(self, obj, backwards=False):
+        position = list(self.position_of(obj))
+        payload = json.dumps({'p': position, 'b': backwards}, separators=(',', ':'))
+        return force_text(base64.urlsafe_b64encode(force_bytes(payload))).rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = base64.urlsafe_b64decode(force_bytes(cursor + '=' * (-len(cursor) % 4)))
+            data = json.loads(force_text(payload))
+            position = [field.to_python(value) for (field, descending), value in zip(self.fields, data['p'])]
+            backwards = bool(data.get('b'))
+        except (TypeError, ValueError, KeyError, AttributeError, ValidationError) as e:
+            raise InvalidCursor(str(e))
+        if len(position) != len(self.fields):
+            raise InvalidCursor('Cursor does not match the ordering')
+        return position, backwards
+
+    def keyset_filter(self, position, backwards):
+        """
+        (a, b) after (x, y)  ==  a > x OR (a = x AND b > y), with the comparison flipped for descending keys
+        """
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.fields, position):
+            lookup = 'lt' if descending != backwards else 'gt'
+            condition |= equal & Q(**{'{}__{}'.format(field.name, lookup): value})
+            equal &= Q(**{field.name: value})
+        return condition
+
+    def page(self, cursor=None):
+        position, backwards = self.decode_cursor(cursor) if cursor else (None, False)
+        if backwards:
+            ordering = [name[1:] if name.startswith('-') else '-' + name for name in self.ordering]
+        else:
+            ordering = self.ordering
+        queryset = self.queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position, backwards))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return CursorPage(rows)
+        next_cursor = previous_cursor = None
+        if backwards or has_more:
+            next_cursor = self.encode_cursor(rows[-1])
+        if (backwards and has_more) or (not backwards and position is not None):
+            previous_cursor = self.encode_cursor(rows[0], backwards=True)
+        return CursorPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Row shaping for the read-only JSON endpoints.
+
+Rows come straight out of `values()` and are turned into plain dicts, related rows (tags, answers) are fetched
+with one query per page instead of one per row. There are no serializer fields involved at all, which is what
+keeps a page cheap to produce.
+"""
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+
+from core.models import Question, Answer, Profile
+
+# Output name -> `values()` lookup
+QUESTION_COLUMNS = {
+    'id': 'id',
+    'title': 'title',
+    'question': 'question',
+    'up_vote': 'up_vote',
+    'down_vote': 'down_vote',
+    'answer_count': 'answer_count',
+    'accepted_answer_id': 'accepted_answer_id',
+    'asked_by_id': 'asked_by_id',
+    'asked_by': 'asked_by__user__username',
+    'created': 'created',
+    'modified': 'modified',
+    'last_activity_at': 'last_activity_at',
+}
+QUESTION_FIELDS = tuple(sorted(QUESTION_COLUMNS)) + ('tags',)
+
+ANSWER_COLUMNS = {
+    'id': 'id',
+    'answer': 'answer',
+    'parent_id': 'parent_id',
+    'up_vote': 'up_vote',
+    'down_vote': 'down_vote',
+    'favourite': 'favourite',
+    'accepted_or_not': 'accepted_or_not',
+    'answer_by_id': 'answer_by_id',
+    'answer_by': 'answer_by__user__username',
+    'created': 'created',
+    'modified': 'modified',
+}
+ANSWER_FIELDS = tuple(sorted(ANSWER_COLUMNS))
+
+TAG_COLUMNS = {
+    'id': 'id',
+    'name': 'name',
+    'slug': 'slug',
+}
+TAG_FIELDS = tuple(sorted(TAG_COLUMNS))
+
+PROFILE_COLUMNS = {
+    'id': 'id',
+    'username': 'user__username',
+    'title': 'title',
+    'description': 'description',
+    'location': 'location',
+    'personal_website': 'personal_website',
+    'twitter_username': 'twitter_username',
+    'github_username': 'github_username',
+    'avatar': 'avatar',
+    'reputation': 'reputation',
+}
+PROFILE_FIELDS = tuple(sorted(PROFILE_COLUMNS))
+
+
+def parse_fields(value, allowed):
+    """
+    Sparse fieldset from a `fields=a,b` parameter, every allowed field when it's missing or names nothing valid
+    """
+    requested = [field.strip() for field in (value or '').split(',')]
+    fields = tuple(field for field in allowed if field in requested)
+    return fields or allowed
+
+
+def shaped(queryset, columns, fields, required=()):
+    """
+    `values()` queryset of only the columns behind `fields`, plus the `required` lookups (e.g. ordering keys)
+    """
+    lookups = set(columns[field] for field in fields if field in columns) | set(required)
+    return queryset.values(*lookups)
+
+
+def shape(row, columns, fields):
+    return {field: row[columns[field]] for field in fields if field in columns}
+
+
+def tags_by_question(question_ids):
+    tags = defaultdict(list)
+    for question_id, name in Question.tag.through.objects.filter(question_id__in=question_ids).order_by(
+            'tag__name').values_list('question_id', 'tag__name'):
+        tags[question_id].append(name)
+    return tags
+
+
+def question_rows(queryset, fields, ordering):
+    return shaped(queryset, QUESTION_COLUMNS, fields, required=['id'] + [name.lstrip('-') for name in ordering])
+
+
+def shape_questions(rows, fields):
+    rows = list(rows)
+    tags = tags_by_question([row['id'] for row in rows]) if 'tags' in fields else {}
+    questions = []
+    for row in rows:
+        question = shape(row, QUESTION_COLUMNS, fields)
+        if 'tags' in fields:
+            question['tags'] = tags.get(row['id'], [])
+        questions.append(question)
+    return questions
+
+
+def read_thread(question_id, fields=QUESTION_FIELDS, answer_fields=ANSWER_FIELDS):
+    """
+    A question with its answers, in three queries however many answers it has
+
+    :raises Question.DoesNotExist:
+    """
+    row = shaped(Question.objects.filter(id=question_id), QUESTION_COLUMNS, fields, required=['id']).get()
+    question, = shape_questions([row], fields)
+    answers = shaped(Answer.objects.filter(question_answer=question_id).order_by('created', 'id'),
+                     ANSWER_COLUMNS, answer_fields)
+    question['answers'] = [shape(answer, ANSWER_COLUMNS, answer_fields) for answer in answers]
+    return question
+
+
+def tag_rows(queryset, fields):
+    return shaped(queryset, TAG_COLUMNS, fields, required=['id', 'name'])
+
+
+def read_profile(profile_id, fields=PROFILE_FIELDS):
+    """
+    :raises Profile.DoesNotExist:
+    """
+    profile = shape(shaped(Profile.objects.filter(id=profile_id), PROFILE_COLUMNS, fields).get(), PROFILE_COLUMNS,
+                    fields)
+    if profile.get('avatar'):
+        profile['avatar'] = default_storage.url(profile['avatar'])
+    return profile
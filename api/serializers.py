@@ -1,13 +1,33 @@
 from django.contrib.auth import authenticate, get_user_model
-from django.db.models import Q
+from django.db import transaction
+from django.utils import timezone
+from django.utils import six
 from rest_framework import serializers, status
-from core.models import Profile, Question, Answer
-from rest_framework.authtoken.models import Token
+from rest_framework.utils import html
+from api import accounts
+from api.cache import response_cache
+from api.instrumentation import TimedSerializerMixin
+from core import profiles, ranking, reputation, tags, threads, votes
+from core.models import Profile, Question, Answer, Tag, ReputationEvent
 
 User = get_user_model()
 
 
-class UserRegistrationSerializer(serializers.Serializer):
+def check_voter(serializer, profile_id):
+    """
+    Votes are cast by the signed-in user, as the profile the request names
+
+    :raises ValidationError: for anonymous requests and the profile of somebody else
+    """
+    request = serializer.context.get('request')
+    profile = profiles.request_profile(request) if request is not None else None
+    if profile is None:
+        raise serializers.ValidationError('Sign in to vote.')
+    if str(profile.id) != str(profile_id):
+        raise serializers.ValidationError("Profile id doesn't match")
+
+
+class UserRegistrationSerializer(TimedSerializerMixin, serializers.Serializer):
     """
     **User Registeration Serilizer**
         Serialize Profile model
@@ -29,23 +49,21 @@ class UserRegistrationSerializer(serializers.Serializer):
         fields = ('first_name', 'last_name', 'username', 'email')
 
     def validate(self, attrs):
-        email = attrs.get('email')
-        username = attrs.get('username')
-        if email and username:
-            user_object = User.objects.filter(Q(email=email) | Q(username=username))
-            if user_object:
-                raise serializers.ValidationError('This user is already registered.')
-            else:
-                return self.create(attrs)
+        return self.create(attrs)
 
     def create(self, validated_data):
-        user = User.objects.create(**validated_data)
-        token, created = Token.objects.get_or_create(user=user)
-        return {'token': token.key, 'user_email': user.email, 'user_username': user.username, "user_id": user.id,
-                'reason': 'Successfully registered', 'success': True}
+        """
+        Leaves the new user in `self.user` for the view to log in
+        """
+        try:
+            self.user, token = accounts.register(**validated_data)
+        except accounts.AlreadyRegistered:
+            raise serializers.ValidationError('This user is already registered.')
+        return {'token': token, 'user_email': self.user.email, 'user_username': self.user.username,
+                "user_id": self.user.id, 'reason': 'Successfully registered', 'success': True}
 
 
-class UserLoginSerializer(serializers.Serializer):
+class UserLoginSerializer(TimedSerializerMixin, serializers.Serializer):
     """
     **User Login Serilizer**
         Fields:
@@ -55,12 +73,14 @@ class UserLoginSerializer(serializers.Serializer):
     username_email = serializers.CharField()
 
     def validate(self, attrs):
+        """
+        Leaves the user in `self.user` for the view to log in
+        """
         username_email = attrs.get('username_email')
         if username_email:
-            user = User.objects.filter(Q(username=username_email) | Q(email=username_email))
-            if user:
-                token, created = Token.objects.get_or_create(user=user[0])
-                return {"user_id": token.user_id, "token": token.key, 'success': True,
+            self.user = accounts.find_user(username_email)
+            if self.user:
+                return {"user_id": self.user.id, "token": accounts.token_for(self.user), 'success': True,
                         'reason': 'Logged in Successfully'}
             else:
                 raise serializers.ValidationError('This is not a registered user.')
@@ -68,7 +88,36 @@ class UserLoginSerializer(serializers.Serializer):
             raise serializers.ValidationError('Need Username or email')
 
 
-class QuestionSerializer(serializers.Serializer):
+class TagListField(serializers.Field):
+    """
+    Tag names, as a list, repeated form values or one comma separated string ("python, django")
+    """
+    default_error_messages = {
+        'invalid': 'Expected tag names.',
+        'max_length': 'Tag names can\'t be longer than {max_length} characters.',
+    }
+
+    def get_value(self, dictionary):
+        if html.is_html_input(dictionary) and self.field_name in dictionary:
+            return dictionary.getlist(self.field_name)
+        return super(TagListField, self).get_value(dictionary)
+
+    def to_internal_value(self, data):
+        if isinstance(data, six.string_types):
+            data = [data]
+        if not isinstance(data, (list, tuple)) or not all(isinstance(item, six.string_types) for item in data):
+            self.fail('invalid')
+        names = tags.parse_tag_names(data)
+        max_length = Tag._meta.get_field('name').max_length
+        if any(len(name) > max_length for name in names):
+            self.fail('max_length', max_length=max_length)
+        return names
+
+    def to_representation(self, value):
+        return list(value)
+
+
+class QuestionSerializer(TimedSerializerMixin, serializers.Serializer):
     """
     **Question Serilizer**
         Serialize Question model
@@ -84,7 +133,7 @@ class QuestionSerializer(serializers.Serializer):
     """
     title = serializers.CharField(required=True)
     question = serializers.CharField(required=True)
-    tag = serializers.CharField(required=False)
+    tag = TagListField(required=False)
     id = serializers.CharField(required=False)
     up_vote = serializers.BooleanField(required=False)
     down_vote = serializers.BooleanField(required=False)
@@ -109,6 +158,8 @@ class QuestionSerializer(serializers.Serializer):
         if question_id:
             instance = Question.objects.filter(id=question_id)
             if instance:
+                if attrs.get('up_vote') or attrs.get('down_vote'):
+                    check_voter(self, profile_id)
                 return self.update(instance.first(), attrs)
             else:
                 raise serializers.ValidationError('This question doesn\'t exist.')
@@ -120,41 +171,49 @@ class QuestionSerializer(serializers.Serializer):
 
     def create(self, validated_data):
         # Let's first remove the tag so that we can add it after creating the question object
-        try:
-            tags = validated_data.pop('tag')
-        except:
-            tags = None
+        names = validated_data.pop('tag', None)
         profile_id = validated_data.pop('profile_id')
-        question = Question.objects.create(**validated_data)
-        profile_instance = Profile.objects.get(id=profile_id)
-        question.asked_by = profile_instance
-        profile_instance.reputation += 1
-        profile_instance.save()
-        question.save()
-        if tags:
-            for item in tags:
-                question.tag.add(item)
+        with transaction.atomic():
+            question = ranking.rank_new(Question(asked_by_id=profile_id, **validated_data))
+            question.save()
+            reputation.record(ReputationEvent.QUESTION_ASKED, profile_id, question_id=question.id)
+            if names:
+                question.tag.add(*set(tags.resolve_tags(names).values()))
+        response_cache.invalidate_listing()
         return {'reason': 'Successfully added question', 'success': True, 'status': status.HTTP_201_CREATED}
 
     def update(self, instance, validated_data):
-        instance.title = validated_data.get('title')
-        instance.question = validated_data.get('question')
-        if validated_data.get('up_vote'):
-            instance.up_vote += 1
-        if validated_data.get('down_vote'):
-            instance.down_vote += 1
-        instance.save()
-        tags = validated_data.get('tag')
-        if tags:
-            for item in tags:
-                try:
-                    instance.tag.add(item)
-                except:
-                    pass
+        changed_fields = [field for field in ('title', 'question')
+                          if getattr(instance, field) != validated_data.get(field)]
+        if changed_fields:
+            for field in changed_fields:
+                setattr(instance, field, validated_data.get(field))
+            instance.last_activity_at = timezone.now()
+            instance.save(update_fields=changed_fields + ['modified', 'last_activity_at'])
+            response_cache.invalidate_threads([instance.id], listing=True)
+        votes.vote_question(instance.id, validated_data.get('profile_id'), up_vote=validated_data.get('up_vote'),
+                            down_vote=validated_data.get('down_vote'))
+        if 'tag' in validated_data and self.update_tags(instance, validated_data['tag']):
+            response_cache.invalidate_threads([instance.id], listing=True)
         return {'reason': 'Successfully updated question', 'success': True, 'status': status.HTTP_200_OK}
 
+    @transaction.atomic
+    def update_tags(self, instance, names):
+        """
+        Makes the tags of the question exactly `names`, touching only the links that differ
 
-class ProfileSerializer(serializers.Serializer):
+        :returns: whether the tags changed
+        """
+        wanted = set(tags.resolve_tags(names).values())
+        current = set(instance.tag.values_list('id', flat=True))
+        if current - wanted:
+            instance.tag.remove(*(current - wanted))
+        if wanted - current:
+            instance.tag.add(*(wanted - current))
+        return wanted != current
+
+
+class ProfileSerializer(TimedSerializerMixin, serializers.Serializer):
     """
     **User Serilizer**
         Serialize Profile model
@@ -218,10 +277,15 @@ class ProfileSerializer(serializers.Serializer):
         instance.twitter_username = validated_data.get('twitter_username')
         instance.title = validated_data.get('title')
         instance.save()
+        # Thread pages show who wrote each post
+        response_cache.invalidate_threads(
+            list(Question.objects.filter(asked_by=instance).values_list('id', flat=True)) +
+            list(Question.answer.through.objects.filter(answer__answer_by=instance).values_list('question_id',
+                                                                                                flat=True)))
         return {'reason': 'Successfully updated profile', 'success': True, 'status': status.HTTP_200_OK}
 
 
-class AnswerSerializer(serializers.Serializer):
+class AnswerSerializer(TimedSerializerMixin, serializers.Serializer):
     """
     **Answer Serilizer**
         Serialize Answer model
@@ -229,7 +293,9 @@ class AnswerSerializer(serializers.Serializer):
         It creates the answer object and assign to the relevant question object. Or if the answer is a reply
         to a particular answer then it assigns that answer to the parent answer object
         It updates the answer object - Up vote, down vote, favourite
-        With every up vote - it increases the question reputation by 1 point.
+        Votes are cast by the signed-in user and recorded once per profile in the vote ledger, the counters are
+        rolled up from it.
+        Votes earn or cost the author of the answer reputation, see `core.reputation`.
 
         **fields:**
         answer - CharField
@@ -263,6 +329,8 @@ class AnswerSerializer(serializers.Serializer):
                 if answer_id:
                     answer_instance = Answer.objects.filter(id=answer_id)
                     if answer_instance:
+                        if attrs.get('up_vote') or attrs.get('down_vote') or attrs.get('favourite'):
+                            check_voter(self, profile_id)
                         return self.update(answer_instance.first(), attrs)
                 return self.create(attrs)
             else:
@@ -278,25 +346,25 @@ class AnswerSerializer(serializers.Serializer):
             parent_answer = None
         profile_instance = Profile.objects.get(id=validated_data.pop('profile_id'))
         question_instance = Question.objects.get(id=validated_data.pop('question_id'))
-        answer = Answer.objects.create(**validated_data)
-        answer.answer_by = profile_instance
-        question_instance.answer.add(answer)
-        if parent_answer:
-            answer.parent = parent_answer
-        answer.save()
+        # Votes only count through the ledger, an acceptance through `accept_answer`
+        with transaction.atomic():
+            answer = Answer.objects.create(answer=validated_data['answer'], answer_by=profile_instance,
+                                           parent=parent_answer)
+            threads.add_answer(question_instance, answer)
+            if validated_data.get('accepted_or_not'):
+                threads.accept_answer(question_instance.id, answer.id)
+        response_cache.invalidate_threads([question_instance.id], listing=True)
         return {'reason': 'Successfully added Answer', 'success': True, 'status': status.HTTP_201_CREATED}
 
     def update(self, instance, validated_data):
-        if validated_data.get('accepted_or_not'):
-            instance.accepted_or_not = True
-        if validated_data.get('favourite'):
-            instance.favourite += 1
-        if validated_data.get('up_vote'):
-            profile_instance = Profile.objects.get(id=validated_data.get('profile_id'))
-            profile_instance.reputation += 1
-            profile_instance.save()
-            instance.up_vote += 1
-        if validated_data.get('down_vote'):
-            instance.down_vote += 1
-        instance.save()
+        with transaction.atomic():
+            votes.vote_answer(instance.id, validated_data.get('profile_id'), up_vote=validated_data.get('up_vote'),
+                              down_vote=validated_data.get('down_vote'), favourite=validated_data.get('favourite'))
+            if validated_data.get('accepted_or_not'):
+                try:
+                    threads.accept_answer(validated_data.get('question_id'), instance.id)
+                except Answer.DoesNotExist:
+                    raise serializers.ValidationError('This answer doesn\'t belong to the question.')
+        if validated_data.get('favourite') or validated_data.get('accepted_or_not'):
+            response_cache.invalidate_threads([validated_data.get('question_id')])
         return {'reason': 'Successfully updated answer', 'success': True, 'status': status.HTTP_200_OK}
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Session engine for a site where most requests read the session and few change it.
+
+    SESSION_ENGINE = 'api.sessions'
+
+Sessions are cached database sessions: a read comes from `SESSION_CACHE_ALIAS` and only goes to the database
+when the cache lost the session. The cache has to be shared by the workers, or a session ended in one worker
+would live on in the others: with a cache living in each process (LocMem), every read goes to the database.
+
+`SessionActivityMiddleware` stamps the sessions the requests used with the time of their last activity. The
+stamp is written behind: to the cache on every request, to the database (which also pushes back the expiry of
+the session) at most every `SESSION_ACTIVITY_WRITE_INTERVAL` seconds, so a cache losing a session loses at most
+that much of its activity.
+
+With `SESSION_ANONYMOUS_SIGNED_COOKIES`, a session without a signed-in user lives in a signed cookie instead,
+the way `django.contrib.sessions.backends.signed_cookies` keeps it, and costs neither a cache nor a database
+access. It moves to the database as soon as a user signs in.
+
+`manage.py purge_sessions` deletes the expired sessions in batches.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends import cached_db
+from django.core import signing
+from django.utils import timezone
+
+from core.cache import shared_cache
+
+SIGNING_SALT = 'api.sessions'
+# Unix times of the last request that used the session and of the last time that got to the database
+LAST_ACTIVITY_KEY = '_last_activity'
+SAVED_ACTIVITY_KEY = '_saved_activity'
+
+
+def write_interval():
+    return getattr(settings, 'SESSION_ACTIVITY_WRITE_INTERVAL', 300)
+
+
+def anonymous_signed_cookies():
+    return getattr(settings, 'SESSION_ANONYMOUS_SIGNED_COOKIES', False)
+
+
+def is_signed(session_key):
+    # The random keys of stored sessions are lowercase letters and digits, signed values hold a `:`
+    return bool(session_key) and ':' in session_key
+
+
+class SessionStore(cached_db.SessionStore):
+
+    def __init__(self, session_key=None):
+        super(SessionStore, self).__init__(session_key)
+        self._cache = shared_cache(settings.SESSION_CACHE_ALIAS)
+
+    @property
+    def in_cookie(self):
+        return is_signed(self.session_key)
+
+    def load(self):
+        if not self.in_cookie:
+            return super(SessionStore, self).load()
+        try:
+            return signing.loads(self.session_key, salt=SIGNING_SALT, serializer=self.serializer,
+                                 max_age=settings.SESSION_COOKIE_AGE)
+        except Exception:
+            # A bad signature, an expired cookie or one that doesn't decode all start a new session
+            self._session_key = None
+            return {}
+
+    def exists(self, session_key):
+        return not is_signed(session_key) and super(SessionStore, self).exists(session_key)
+
+    def save(self, must_create=False):
+        if anonymous_signed_cookies() and SESSION_KEY not in self._get_session(no_load=must_create):
+            self._session_key = signing.dumps(self._session, compress=True, salt=SIGNING_SALT,
+                                              serializer=self.serializer)
+            self.modified = True
+            return
+        if self.in_cookie:
+            # Signing in, the session moves from the cookie to the database under a new random key
+            self._session_key = None
+            self.create()
+            return
+        self._get_session(no_load=must_create)[SAVED_ACTIVITY_KEY] = int(time.time())
+        super(SessionStore, self).save(must_create)
+
+    def delete(self, session_key=None):
+        if not is_signed(session_key or self.session_key):
+            super(SessionStore, self).delete(session_key)
+
+    def record_activity(self):
+        """
+        Stamps the session as used now, in the cache only unless it's time for the database to catch up
+        """
+        if self.session_key is None or self.in_cookie:
+            return
+        now = int(time.time())
+        self._session[LAST_ACTIVITY_KEY] = now
+        if now - self._session.get(SAVED_ACTIVITY_KEY, 0) >= write_interval():
+            # Saved to the database and the cache at the end of the request, with a new expiry
+            self.modified = True
+        elif not self.modified:
+            self._cache.set(self.cache_key, self._session, self.get_expiry_age())
+
+    @classmethod
+    def clear_expired(cls, batch_size=500):
+        """
+        Deletes the expired sessions `batch_size` at a time, rather than in one statement locking the whole table
+
+        :returns: number of sessions deleted
+        """
+        model = cls.get_model_class()
+        deleted = 0
+        while True:
+            keys = list(model.objects.filter(expire_date__lt=timezone.now()).order_by().values_list(
+                'session_key', flat=True)[:batch_size])
+            if keys:
+                deleted += model.objects.filter(session_key__in=keys).delete()[0]
+            if len(keys) < batch_size:
+                return deleted
+
+
+class SessionActivityMiddleware(object):
+    """
+    Records the activity of the sessions the requests used, keep it right after `SessionMiddleware`
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        session = getattr(request, 'session', None)
+        if session is not None and session.accessed and hasattr(session, 'record_activity') and \
+                response.status_code != 500:
+            session.record_activity()
+        return response
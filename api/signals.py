@@ -0,0 +1,49 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api import accounts
+from api.cache import response_cache
+from core.models import Question
+from core.signals import votes_rolled_up, questions_imported, questions_ranked
+
+User = get_user_model()
+
+
+@receiver(votes_rolled_up, dispatch_uid='invalidate_pages_on_vote_rollup')
+def invalidate_pages_on_vote_rollup(sender, question_ids, answer_ids, **kwargs):
+    if answer_ids:
+        response_cache.invalidate_threads(Question.answer.through.objects.filter(
+            answer_id__in=answer_ids).values_list('question_id', flat=True))
+    if question_ids:
+        response_cache.invalidate_threads(question_ids, listing=True)
+
+
+@receiver(questions_imported, dispatch_uid='invalidate_listing_on_import')
+def invalidate_listing_on_import(sender, question_ids, **kwargs):
+    response_cache.invalidate_listing()
+
+
+@receiver(questions_ranked, dispatch_uid='invalidate_listing_on_rank')
+def invalidate_listing_on_rank(sender, question_ids, **kwargs):
+    response_cache.invalidate_listing()
+
+
+@receiver(post_save, sender=Token, dispatch_uid='forget_cached_token_on_save')
+@receiver(post_delete, sender=Token, dispatch_uid='forget_cached_token_on_delete')
+def forget_cached_token(sender, instance, **kwargs):
+    accounts.forget_token(instance.user_id, instance.key)
+
+
+@receiver(post_save, sender=User, dispatch_uid='forget_cached_token_on_user_save')
+def forget_cached_token_on_user_save(sender, instance, created, update_fields=None, **kwargs):
+    # A new user has no token yet, and logging in only stamps `last_login`, which the cached user can do without
+    if not created and (update_fields is None or set(update_fields) != {'last_login'}):
+        accounts.forget_token(instance.pk)
+
+
+@receiver(post_save, sender=User, dispatch_uid='forget_cached_user_on_save')
+@receiver(post_delete, sender=User, dispatch_uid='forget_cached_user_on_delete')
+def forget_cached_user(sender, instance, **kwargs):
+    accounts.forget_user(instance.pk)
@@ -1,6 +1,1383 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+from django.contrib.auth import SESSION_KEY, get_user_model
+import base64
+import difflib
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from importlib import import_module
+from unittest import skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command, CommandError
+from django.http import HttpResponse
+from django.db import IntegrityError, connection, connections
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.six import BytesIO, StringIO
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from api import accounts, urls as api_urls
+from api.benchmarks import corpus, runner
+from api.benchmarks.scenarios import SCENARIOS, Fixtures
+from api.cache import ResponseCache, response_cache
+from api.instrumentation import RequestProfile, registry, sql_shape
+from api.sessions import SessionStore, LAST_ACTIVITY_KEY
+from core import avatars, profiles, ranking, reputation, search, threads, votes
+from core.tags import tag_catalog
+from core.models import Profile, Question, Answer, Tag, ImportCheckpoint, ReputationEvent, Vote
+
+User = get_user_model()
+# Well-formed, with a position that isn't a date
+TAMPERED_CURSOR = base64.urlsafe_b64encode(b'{"p":["not-a-date",1],"b":false}').decode('ascii').rstrip('=')
+
+
+def threads_share_test_database():
+    # An in-memory SQLite test database lives in its connection, other threads get an empty one of their own
+    if connection.vendor != 'sqlite':
+        return True
+    name = connection.settings_dict['TEST']['NAME']
+    return bool(name) and not connection.creation.is_in_memory_db(name)
+
+
+def make_profile(username):
+    user = User.objects.create(username=username, email='{}@example.com'.format(username))
+    return Profile.objects.create(user=user, title='Title', description='Description')
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+    tag_catalog.invalidate()
+
+
+def make_questions(profile, count):
+    for index in range(count):
+        Question.objects.create(title='Question {}'.format(index), question='Body {}'.format(index),
+                                asked_by=profile)
+
+
+class HomePageListingTest(TestCase):
+
+    def setUp(self):
+        self.profile = make_profile('asker')
+
+    def count_queries(self, **params):
+        clear_caches()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('api:page'), params)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_query_count_does_not_grow_with_questions(self):
+        make_questions(self.profile, 2)
+        small, _ = self.count_queries()
+        make_questions(self.profile, 30)
+        large, response = self.count_queries()
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.context['questions']), 20)
+
+    def test_page_size_and_ordering(self):
+        make_questions(self.profile, 5)
+        Question.objects.filter(title='Question 1').update(up_vote=10)
+        _, response = self.count_queries(page_size=2, ordering='votes')
+        questions = list(response.context['questions'])
+        self.assertEqual(len(questions), 2)
+        self.assertEqual(questions[0].title, 'Question 1')
+        self.assertTrue(response.context['page_obj'].has_next())
+
+    def test_cursor_walks_every_question_once(self):
+        make_questions(self.profile, 7)
+        seen, cursor, queries = [], None, set()
+        while True:
+            params = {'page_size': 3}
+            if cursor:
+                params['cursor'] = cursor
+            count, response = self.count_queries(**params)
+            queries.add(count)
+            page = response.context['page_obj']
+            seen.extend(question.id for question in page)
+            cursor = page.next_cursor
+            if not cursor:
+                break
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(seen, list(Question.objects.order_by('-created', '-id').values_list('id', flat=True)))
+        _, response = self.count_queries(page_size=3, cursor=page.previous_cursor)
+        self.assertEqual([question.id for question in response.context['page_obj']], seen[3:6])
+
+    def test_tampered_cursor_starts_over(self):
+        make_questions(self.profile, 3)
+        _, response = self.count_queries(cursor=TAMPERED_CURSOR)
+        self.assertEqual(len(response.context['questions']), 3)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        search.reset_fallback_index()
+        self.profile = make_profile('searcher')
+
+    def test_ranked_search_matches_title_body_and_tags(self):
+        tag = Tag.objects.create(name='Django')
+        tagged = Question.objects.create(title='Migrations', question='How to squash them', asked_by=self.profile)
+        tagged.tag.add(tag)
+        twice = Question.objects.create(title='Django forms', question='Django form validation',
+                                        asked_by=self.profile)
+        Question.objects.create(title='Flask', question='Blueprints', asked_by=self.profile)
+        self.assertEqual([question.id for question in search.search_questions('django')], [twice.id, tagged.id])
+        tagged.tag.remove(tag)
+        self.assertEqual([question.id for question in search.search_questions('django')], [twice.id])
+        self.assertEqual(search.search_questions('django flask'), [])
+
+    def test_search_page(self):
+        clear_caches()
+        question = Question.objects.create(title='Keyset pagination', question='Body', asked_by=self.profile)
+        response = self.client.get(reverse('api:page'), {'searchText': 'KEYSET'})
+        self.assertEqual(list(response.context['questions']), [question])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Needs the full-text index of Postgres')
+    def test_full_text_index_follows_the_search_config(self):
+        self.assertFalse(search.rebuild_full_text_index())
+        with override_settings(SEARCH_CONFIG='simple'):
+            self.assertTrue(search.rebuild_full_text_index())
+            self.assertEqual(search.full_text_index_config(), 'simple')
+            self.assertFalse(search.rebuild_full_text_index())
+
+
+@skipUnless(threads_share_test_database(), 'Needs a test database the threads share')
+class ConcurrentVoteTest(TransactionTestCase):
+    threads = 8
+    voters_per_thread = 10
+
+    def run_concurrently(self, target, voters):
+        errors = []
+
+        def worker(chunk):
+            try:
+                for voter in chunk:
+                    target(voter)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        chunk_size = self.voters_per_thread
+        workers = [threading.Thread(target=worker, args=(voters[start:start + chunk_size],))
+                   for start in range(0, len(voters), chunk_size)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_no_votes_are_lost(self):
+        author = make_profile('author')
+        voters = [make_profile('voter{}'.format(index)) for index in range(self.threads * self.voters_per_thread)]
+        question = Question.objects.create(title='Title', question='Body', asked_by=author)
+        answer = Answer.objects.create(answer='Answer', answer_by=author)
+        for _ in range(2):
+            self.run_concurrently(lambda voter: votes.vote_question(question.id, voter.id, up_vote=True), voters)
+            self.run_concurrently(
+                lambda voter: votes.vote_answer(answer.id, voter.id, up_vote=True, favourite=True), voters)
+        self.assertEqual(votes.rollup_votes(batch_size=7), 2 * len(voters))
+        question.refresh_from_db()
+        answer.refresh_from_db()
+        self.assertEqual((question.up_vote, question.down_vote), (len(voters), 0))
+        self.assertEqual((answer.up_vote, answer.down_vote, answer.favourite), (len(voters), 0, 2 * len(voters)))
+        # The author earns the votes, the voters nothing
+        self.assertEqual(reputation.apply_events(batch_size=7), 2 * len(voters))
+        weights = reputation.weights()
+        self.assertEqual(Profile.objects.get(id=author.id).reputation,
+                         len(voters) * (weights['question_up_voted'] + weights['answer_up_voted']))
+        self.assertEqual(sum(Profile.objects.exclude(id=author.id).values_list('reputation', flat=True)), 0)
+
+
+class VoteLedgerTest(TestCase):
+
+    def test_repeat_votes_are_no_ops_and_changes_roll_up(self):
+        voter = make_profile('voter')
+        question = Question.objects.create(title='Title', question='Body', asked_by=voter)
+        votes.vote_question(question.id, voter.id, up_vote=True)
+        votes.vote_question(question.id, voter.id, up_vote=True)
+        self.assertEqual(votes.rollup_votes(), 1)
+        question.refresh_from_db()
+        self.assertEqual((question.up_vote, question.down_vote), (1, 0))
+        votes.vote_question(question.id, voter.id, down_vote=True)
+        self.assertEqual(votes.rollup_votes(), 1)
+        self.assertEqual(votes.rollup_votes(), 0)
+        question.refresh_from_db()
+        self.assertEqual((question.up_vote, question.down_vote), (0, 1))
+
+    def test_votes_are_cast_by_the_signed_in_user(self):
+        clear_caches()
+        voter, other = make_profile('voter'), make_profile('other')
+        question = Question.objects.create(title='Title', question='Body', asked_by=other)
+        answer = Answer.objects.create(answer='Answer', answer_by=other)
+        threads.add_answer(question, answer)
+        question_vote = {'id': question.id, 'title': 'Title', 'question': 'Body', 'up_vote': True}
+        answer_vote = {'question_id': question.id, 'answer_id': answer.id, 'answer': 'Answer', 'up_vote': True}
+        for url, vote in ((reverse('api:question'), question_vote), (reverse('api:answer'), answer_vote)):
+            # Nobody signed in, then somebody else's profile
+            self.assertEqual(self.client.post(url, dict(vote, profile_id=voter.id)).status_code, 400)
+            self.client.force_login(voter.user)
+            self.assertEqual(self.client.post(url, dict(vote, profile_id=other.id)).status_code, 400)
+            self.assertEqual(self.client.post(url, dict(vote, profile_id=voter.id)).status_code, 200)
+            self.client.logout()
+        self.assertEqual(votes.rollup_votes(), 2)
+        self.assertEqual(sorted(Vote.objects.values_list('voter_id', flat=True)), [voter.id, voter.id])
+
+
+class ThreadPageTest(TestCase):
+
+    def setUp(self):
+        self.asker = make_profile('asker')
+        self.question = Question.objects.create(title='Title', question='Body', asked_by=self.asker)
+
+    def add_answers(self, count):
+        for index in range(count):
+            answer = Answer.objects.create(answer='Answer {}'.format(index),
+                                           answer_by=make_profile('answerer{}'.format(Answer.objects.count())))
+            self.question.answer.add(answer)
+
+    def count_queries(self):
+        clear_caches()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('api:page'), {'question_thread_id': self.question.id})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_query_count_does_not_depend_on_answers(self):
+        self.add_answers(1)
+        few, _ = self.count_queries()
+        self.add_answers(20)
+        threads.accept_answer(self.question.id, Answer.objects.get(answer='Answer 3').id)
+        many, response = self.count_queries()
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.context['answers']), 21)
+        self.assertEqual(response.context['accepted'].answer, 'Answer 3')
+        self.assertContains(response, 'answerer20')
+
+    def test_replies_are_nested_and_depth_limited(self):
+        parent = None
+        for depth in range(5):
+            parent = Answer.objects.create(answer='Reply {}'.format(depth), answer_by=self.asker, parent=parent)
+            self.question.answer.add(parent)
+        _, response = self.count_queries()
+        root, = response.context['answer_tree']
+        self.assertEqual(root.descendants, 4)
+        node = root
+        while node.children:
+            node, = node.children
+        self.assertEqual((node.depth, node.hidden_replies, node.answer.answer), (3, 1, 'Reply 3'))
+        self.assertContains(response, '1 more reply')
+        clear_caches()
+        response = self.client.get(reverse('api:page'), {'question_thread_id': self.question.id,
+                                                         'collapse': '{},999'.format(root.answer.id)})
+        root, = response.context['answer_tree']
+        self.assertEqual((root.children, root.hidden_replies), ([], 4))
+        # Expanding keeps the other collapsed answers collapsed
+        self.assertContains(response, 'reply_depth=3&collapse=999,"')
+        clear_caches()
+        response = self.client.get(reverse('api:page'), {'question_thread_id': self.question.id,
+                                                         'reply_depth': 10 ** 6})
+        self.assertEqual(response.context['reply_depth'], settings.THREAD_REPLY_DEPTH * 4)
+
+    def test_answering_and_accepting_maintain_question_stats(self):
+        answerer = make_profile('answerer')
+        response = self.client.post(reverse('api:answer'), {'answer': 'Use keysets', 'question_id': self.question.id,
+                                                             'profile_id': answerer.id})
+        self.assertEqual(response.status_code, 201)
+        answer = Answer.objects.get(answer='Use keysets')
+        self.client.post(reverse('api:answer'), {'answer': answer.answer, 'question_id': self.question.id,
+                                                 'answer_id': answer.id, 'profile_id': self.asker.id,
+                                                 'accepted_or_not': True})
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.answer_count, self.question.accepted_answer), (1, answer))
+        self.assertGreaterEqual(self.question.last_activity_at, answer.created)
+        # Only an answer of the question can be accepted
+        other = Question.objects.create(title='Other', question='Body', asked_by=self.asker)
+        response = self.client.post(reverse('api:answer'), {'answer': answer.answer, 'question_id': other.id,
+                                                            'answer_id': answer.id, 'profile_id': self.asker.id,
+                                                            'accepted_or_not': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(Question.objects.get(id=other.id).accepted_answer)
+
+        Question.objects.filter(id=self.question.id).update(answer_count=5, accepted_answer=None)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_question_stats', check=True, stdout=StringIO())
+        call_command('rebuild_question_stats', stdout=StringIO())
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.answer_count, self.question.accepted_answer), (1, answer))
+        call_command('rebuild_question_stats', check=True, stdout=StringIO())
+
+    def test_new_answers_take_no_counters_from_the_request(self):
+        answerer = make_profile('answerer')
+        response = self.client.post(reverse('api:answer'), {
+            'answer': 'Accepted already', 'question_id': self.question.id, 'profile_id': answerer.id,
+            'accepted_or_not': True, 'up_vote': True, 'favourite': True})
+        self.assertEqual(response.status_code, 201)
+        answer = Answer.objects.get(answer='Accepted already')
+        self.assertEqual((answer.up_vote, answer.down_vote, answer.favourite, answer.accepted_or_not), (0, 0, 0, True))
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.accepted_answer, answer)
+        self.assertEqual(list(ReputationEvent.objects.filter(kind=ReputationEvent.ANSWER_ACCEPTED).values_list(
+            'profile_id', 'answer_id')), [(answerer.id, answer.id)])
+
+    def test_missing_question(self):
+        response = self.client.get(reverse('api:page'), {'question_thread_id': self.question.id + 1})
+        self.assertEqual(response.status_code, 404)
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.asker = make_profile('asker')
+        self.question = Question.objects.create(title='Title', question='Body', asked_by=self.asker)
+        self.thread = {'question_thread_id': self.question.id}
+
+    def get(self, params=None):
+        return self.client.get(reverse('api:page'), params or {})
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        self.assertEqual(self.get(self.thread)['X-Cache'], 'MISS')
+        stats = response_cache.stats()
+        with self.assertNumQueries(0):
+            response = self.get({'question_thread_id': str(self.question.id), 'page_size': ''})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, 'Title')
+        self.assertEqual(response_cache.stats()['hits'], stats['hits'] + 1)
+
+    def test_writes_invalidate_only_the_affected_thread(self):
+        other = Question.objects.create(title='Other', question='Body', asked_by=self.asker)
+        self.get(self.thread)
+        self.get({'question_thread_id': other.id})
+        self.get()
+        self.client.post(reverse('api:answer'), {'answer': 'New answer', 'question_id': self.question.id,
+                                                 'profile_id': self.asker.id})
+        self.assertContains(self.get(self.thread), 'New answer')
+        self.assertEqual(self.get({'question_thread_id': other.id})['X-Cache'], 'HIT')
+        self.assertEqual(self.get()['X-Cache'], 'MISS')
+
+    def test_rollup_invalidates_voted_threads(self):
+        self.get(self.thread)
+        votes.vote_question(self.question.id, self.asker.id, up_vote=True)
+        self.assertEqual(self.get(self.thread)['X-Cache'], 'HIT')
+        votes.rollup_votes()
+        self.assertEqual(self.get(self.thread)['X-Cache'], 'MISS')
+
+    def test_logged_in_readers_are_not_cached(self):
+        self.client.force_login(self.asker.user)
+        self.assertFalse(self.get(self.thread).has_header('X-Cache'))
+
+    @override_settings(CACHES=dict(settings.CACHES, other_worker={'BACKEND': 'core.cache.LRUCache',
+                                                                  'LOCATION': 'other-worker'}))
+    def test_invalidation_reaches_every_worker(self):
+        # Each worker keeps pages of its own, keyed on the generations they share
+        workers = [ResponseCache(), ResponseCache()]
+        workers[1].cache_alias = 'other_worker'
+        request = RequestFactory().get(reverse('api:page'), self.thread)
+        request.user = AnonymousUser()
+        for worker in workers:
+            worker.set(request, HttpResponse('Title'))
+            self.assertEqual(worker.get(request)['X-Cache'], 'HIT')
+        workers[0].invalidate_threads([self.question.id])
+        self.assertIsNone(workers[1].get(request))
+
+    @override_settings(RESPONSE_GENERATION_CACHE='default')
+    def test_generations_in_a_process_local_cache_cache_nothing(self):
+        self.get(self.thread)
+        self.assertFalse(self.get(self.thread).has_header('X-Cache'))
+
+
+class FragmentCacheTest(TestCase):
+
+    def test_answer_fragments_are_versioned_on_modified_and_counts(self):
+        clear_caches()
+        asker = make_profile('asker')
+        question = Question.objects.create(title='Title', question='Body', asked_by=asker)
+        answer = Answer.objects.create(answer='First text', answer_by=asker)
+        question.answer.add(answer)
+        self.client.force_login(asker.user)
+        thread = {'question_thread_id': question.id}
+        self.assertContains(self.client.get(reverse('api:page'), thread), 'First text')
+        Answer.objects.filter(id=answer.id).update(answer='Unversioned text')
+        self.assertContains(self.client.get(reverse('api:page'), thread), 'First text')
+        answer.answer = 'Edited text'
+        answer.save()
+        self.assertContains(self.client.get(reverse('api:page'), thread), 'Edited text')
+        Answer.objects.filter(id=answer.id).update(up_vote=42)
+        self.assertContains(self.client.get(reverse('api:page'), thread), '42')
+
+
+class ReadOnlyAPITest(TestCase):
+
+    def setUp(self):
+        self.profile = make_profile('reader')
+        self.tag = Tag.objects.create(name='Python')
+        make_questions(self.profile, 5)
+        for question in Question.objects.all():
+            question.tag.add(self.tag)
+
+    def test_question_list_is_paginated_sparse_and_constant(self):
+        url = reverse('api:question-list')
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'page_size': 2, 'fields': 'id,title,tags,bogus'})
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(sorted(data['results'][0]), ['id', 'tags', 'title'])
+        self.assertEqual(data['results'][0]['tags'], ['Python'])
+        self.assertIsNone(data['previous'])
+        with self.assertNumQueries(2):
+            data = json.loads(self.client.get(url, {'page_size': 2, 'cursor': data['next']}).content.decode('utf-8'))
+        self.assertEqual(len(data['results']), 2)
+        self.assertEqual(self.client.get(url, {'cursor': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': TAMPERED_CURSOR}).status_code, 400)
+
+    def test_etag(self):
+        url = reverse('api:question-detail', args=[Question.objects.first().id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Question.objects.update(title='Changed')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_thread_tags_and_profile(self):
+        question = Question.objects.first()
+        answer = Answer.objects.create(answer='Answer', answer_by=self.profile)
+        threads.add_answer(question, answer)
+        data = json.loads(self.client.get(reverse('api:question-detail', args=[question.id]),
+                                          {'answer_fields': 'answer,answer_by'}).content.decode('utf-8'))
+        self.assertEqual(data['answers'], [{'answer': 'Answer', 'answer_by': 'reader'}])
+        self.assertEqual(data['answer_count'], 1)
+        data = json.loads(self.client.get(reverse('api:tag-list')).content.decode('utf-8'))
+        self.assertEqual(data['results'], [{'id': self.tag.id, 'name': 'Python', 'slug': 'python'}])
+        data = json.loads(self.client.get(reverse('api:profile-detail', args=[self.profile.id]),
+                                          {'fields': 'username,reputation'}).content.decode('utf-8'))
+        self.assertEqual(data, {'username': 'reader', 'reputation': 0})
+        self.assertEqual(self.client.get(reverse('api:profile-detail', args=[self.profile.id + 1])).status_code, 404)
+
+
+class ImportQuestionsTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        make_profile('asker')
+        clear_caches()
+        search.reset_fallback_index()
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as dump:
+            dump.write('\n'.join(lines).encode('utf-8') + b'\n')
+        return path
+
+    def record(self, number, **extra):
+        record = {'title': 'Imported {}'.format(number), 'question': 'Body {}'.format(number),
+                  'asked_by': 'asker', 'tags': ['python', 'django'], 'created': '2019-01-0{}T10:00:00Z'.format(number)}
+        record.update(extra)
+        return json.dumps(record)
+
+    def test_jsonl_with_answers_and_replies(self):
+        answers = [{'ref': 'a', 'answer': 'Top', 'answer_by': 'replier', 'accepted': True,
+                    'created': '2019-01-05T10:00:00Z'},
+                   {'ref': 'b', 'parent': 'a', 'answer': 'Reply', 'answer_by': 'asker', 'created': '2019-01-03'},
+                   {'ref': 'c', 'parent': 'b', 'answer': 'Nested', 'created': '2019-01-04T00:00:00'}]
+        path = self.write('dump.jsonl', [self.record(1, answers=answers), self.record(2)])
+        out = StringIO()
+        call_command('import_questions', path, '--create-profiles', stdout=out)
+        self.assertIn('2 questions, 3 answers', out.getvalue())
+        question = Question.objects.get(title='Imported 1')
+        self.assertEqual(question.asked_by.user.username, 'asker')
+        self.assertEqual(sorted(question.tag.values_list('name', flat=True)), ['django', 'python'])
+        self.assertEqual(dict(Tag.objects.values_list('name', 'question_count')), {'python': 2, 'django': 2})
+        thread = threads.load_thread(question.id)
+        self.assertEqual(thread.accepted.answer, 'Top')
+        self.assertEqual(thread.accepted.answer_by.user.username, 'replier')
+        by_text = {answer.answer: answer for answer in thread.answers}
+        self.assertEqual(by_text['Reply'].parent_id, by_text['Top'].id)
+        self.assertEqual(by_text['Nested'].parent_id, by_text['Reply'].id)
+        self.assertEqual((question.answer_count, question.created.day, question.modified.day,
+                          question.last_activity_at.day), (3, 1, 1, 5))
+        self.assertEqual(threads.compute_question_stats([question.id])[question.id][:2], (3, thread.accepted.id))
+        self.assertEqual([result.id for result in search.search_questions('imported python')],
+                         sorted(Question.objects.values_list('id', flat=True), reverse=True))
+
+    def test_resumes_after_a_failed_chunk(self):
+        lines = [self.record(1), self.record(2), '{not json', self.record(4)]
+        path = self.write('dump.jsonl', lines)
+        with self.assertRaises(ValueError):
+            call_command('import_questions', path, '--chunk-size', '2', stdout=StringIO())
+        self.assertEqual(Question.objects.count(), 2)
+        lines[2] = self.record(3)
+        self.write('dump.jsonl', lines)
+        call_command('import_questions', path, '--chunk-size', '2', stdout=StringIO())
+        self.assertEqual(sorted(Question.objects.values_list('title', flat=True)),
+                         ['Imported 1', 'Imported 2', 'Imported 3', 'Imported 4'])
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual((checkpoint.questions, checkpoint.answers), (4, 0))
+        call_command('import_questions', path, stdout=StringIO())
+        self.assertEqual(Question.objects.count(), 4)
+
+    def test_csv(self):
+        path = self.write('dump.csv', ['title,question,asked_by,tags,created,up_vote',
+                                       'First,"Multi\nline",asker,python|c++,2019-01-01 10:00,3',
+                                       'Second,Body,nobody,,,'])
+        with self.assertNumQueries(19):
+            call_command('import_questions', path, stdout=StringIO())
+        first, second = Question.objects.order_by('id')
+        self.assertEqual((first.question, first.up_vote, first.asked_by.user.username), ('Multi\nline', 3, 'asker'))
+        self.assertEqual(sorted(first.tag.values_list('name', flat=True)), ['c++', 'python'])
+        self.assertIsNone(second.asked_by)
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.profile = make_profile('exporter')
+        self.tag = Tag.objects.create(name='Python')
+        make_questions(self.profile, 3)
+        for question in Question.objects.all():
+            question.tag.add(self.tag)
+            answer = Answer.objects.create(answer='Answer to {}'.format(question.title), answer_by=self.profile)
+            threads.add_answer(question, answer)
+            reply = Answer.objects.create(answer='Reply', answer_by=self.profile, parent=answer)
+            threads.add_answer(question, reply)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def read(self, name):
+        path = os.path.join(self.directory, name)
+        with (gzip.open(path) if name.endswith('.gz') else open(path, 'rb')) as export:
+            return export.read().decode('utf-8')
+
+    def test_command_streams_every_dataset(self):
+        # One query for the questions, plus the tags and answers of each chunk of two
+        with self.assertNumQueries(5):
+            call_command('export_corpus', 'questions', '--chunk-size', '2', '--output-dir', self.directory,
+                         stdout=StringIO())
+        questions = [json.loads(line) for line in self.read('questions.jsonl').splitlines()]
+        self.assertEqual([question['id'] for question in questions],
+                         sorted(Question.objects.values_list('id', flat=True)))
+        self.assertEqual(questions[0]['tags'], ['Python'])
+        self.assertEqual([answer['answer'] for answer in questions[0]['answers']],
+                         ['Answer to ' + questions[0]['title'], 'Reply'])
+        self.assertEqual(questions[0]['answers'][1]['parent'], questions[0]['answers'][0]['ref'])
+
+        call_command('export_corpus', '--format', 'csv', '--gzip', '--output-dir', self.directory, stdout=StringIO())
+        lines = self.read('answers.csv.gz').splitlines()
+        self.assertEqual(lines[0], 'id,question_id,parent_id,answer,answer_by,accepted_or_not,up_vote,down_vote,'
+                                   'favourite,created,modified')
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(self.read('tags.csv.gz').splitlines()[1], '{},Python,python'.format(self.tag.id))
+        self.assertIn(',exporter,', self.read('profiles.csv.gz'))
+        self.assertTrue(self.read('questions.csv.gz').splitlines()[1].endswith(',Python'))
+
+    def test_endpoint_is_staff_only(self):
+        url = reverse('api:export', args=['tags'])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(url, {'output': 'csv', 'gzip': '1'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="tags.csv.gz"')
+        content = gzip.GzipFile(fileobj=BytesIO(b''.join(response.streaming_content))).read()
+        self.assertEqual(content.decode('utf-8').splitlines(), ['id,name,slug', '{},Python,python'.format(self.tag.id)])
+        self.assertEqual(self.client.get(reverse('api:export', args=['users'])).status_code, 404)
+
+
+class TagCatalogTest(TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.profile = make_profile('tagger')
+        self.python, self.pandas, self.django = [Tag.objects.create(name=name)
+                                                 for name in ('Python', 'pandas', 'Django')]
+        make_questions(self.profile, 3)
+        self.questions = list(Question.objects.order_by('id'))
+
+    def counts(self):
+        return dict(Tag.objects.values_list('name', 'question_count'))
+
+    def test_question_counts_follow_tag_links(self):
+        first, second, third = self.questions
+        first.tag.add(self.python, self.django)
+        first.tag.add(self.python)
+        second.tag.add(self.python)
+        self.pandas.question_tag.add(first, second, third)
+        self.assertEqual(self.counts(), {'Python': 2, 'pandas': 3, 'Django': 1})
+        first.tag.remove(self.django, self.pandas)
+        second.tag.remove(self.django)
+        self.pandas.question_tag.remove(second, first)
+        self.assertEqual(self.counts(), {'Python': 2, 'pandas': 1, 'Django': 0})
+        second.tag.clear()
+        self.pandas.question_tag.clear()
+        third.tag.add(self.django)
+        first.delete()
+        self.assertEqual(self.counts(), {'Python': 0, 'pandas': 0, 'Django': 1})
+        self.assertEqual(tag_catalog.question_count(self.django.id), 1)
+        self.assertEqual(tag_catalog.question_count(self.python.id), 0)
+
+    def test_autocomplete(self):
+        self.pandas.question_tag.add(*self.questions)
+        self.python.question_tag.add(self.questions[0])
+        perl = Tag.objects.create(name='Perl')
+        response = self.client.get(reverse('api:tag-autocomplete'), {'q': 'P'})
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([(tag['name'], tag['question_count']) for tag in data['results']],
+                         [('pandas', 3), ('Python', 1), ('Perl', 0)])
+        data = json.loads(self.client.get(reverse('api:tag-autocomplete'), {'q': 'py', 'limit': 1}).content.decode(
+            'utf-8'))
+        self.assertEqual([tag['name'] for tag in data['results']], ['Python'])
+        self.assertEqual(tag_catalog.autocomplete('pz'), [])
+        perl.question_tag.add(*self.questions[1:])
+        self.assertEqual([(tag.name, count) for tag, count in tag_catalog.autocomplete('p')],
+                         [('pandas', 3), ('Perl', 2), ('Python', 1)])
+        with self.assertNumQueries(0):
+            tag_catalog.autocomplete('d')
+
+    def test_reloads_when_another_worker_writes(self):
+        self.assertEqual([tag.name for tag in tag_catalog.all()], ['Django', 'pandas', 'Python'])
+        # Another worker renames a tag and bumps the shared version
+        Tag.objects.filter(id=self.django.id).update(name='Flask')
+        tag_catalog.cache.incr(tag_catalog.version_key)
+        self.assertEqual([tag.name for tag in tag_catalog.all()], ['Django', 'pandas', 'Python'])
+        tag_catalog.checked_at = 0
+        self.assertEqual([tag.name for tag in tag_catalog.all()], ['Flask', 'pandas', 'Python'])
+        # Counts applied here leave the version alone, the other workers don't all reload for each tagged question
+        version = tag_catalog.cache.get(tag_catalog.version_key)
+        self.python.question_tag.add(self.questions[0])
+        self.assertEqual(tag_catalog.cache.get(tag_catalog.version_key), version)
+        self.assertEqual(tag_catalog.question_count(self.python.id), 1)
+
+    def test_reloads_once_too_old(self):
+        tag_catalog.all()
+        # Another worker's write, with a version cache this worker doesn't share
+        Tag.objects.filter(id=self.django.id).update(name='Flask', question_count=7)
+        tag_catalog.checked_at = 0
+        self.assertEqual(tag_catalog.question_count(self.django.id), 0)
+        tag_catalog.checked_at = tag_catalog.loaded_at = 0
+        self.assertEqual([tag.name for tag in tag_catalog.all()], ['Flask', 'pandas', 'Python'])
+        self.assertEqual(tag_catalog.question_count(self.django.id), 7)
+
+
+class QuestionTagsTest(TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.profile = make_profile('author')
+        self.python = Tag.objects.create(name='Python')
+
+    def post(self, **data):
+        data.update({'title': 'Title', 'question': 'Body', 'profile_id': self.profile.id})
+        return self.client.post(reverse('api:question'), data)
+
+    def tags(self, question):
+        return sorted(question.tag.values_list('slug', flat=True))
+
+    def test_create_resolves_and_bulk_creates_tags(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.post(tag=['python, Django', 'django', 'Web Apps', '+++']).status_code, 201)
+        self.assertEqual([query['sql'] for query in queries if '"core_tag"."slug" = ' in query['sql']], [])
+        question = Question.objects.get()
+        self.assertEqual(self.tags(question), ['django', 'python', 'web-apps'])
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertEqual(Tag.objects.get(slug='django').name, 'Django')
+        self.assertEqual(Tag.objects.get(slug='python').question_count, 1)
+
+    def test_update_diffs_the_tag_set(self):
+        self.post(tag='python, django')
+        question = Question.objects.get()
+        django = Tag.objects.get(slug='django')
+        with CaptureQueriesContext(connection) as queries:
+            self.post(id=question.id, tag='Django, flask')
+        self.assertEqual(self.tags(question), ['django', 'flask'])
+        self.assertEqual(dict(Tag.objects.values_list('slug', 'question_count')),
+                         {'python': 0, 'django': 1, 'flask': 1})
+        links = [query['sql'] for query in queries if 'core_question_tag' in query['sql'] and
+                 query['sql'].startswith(('INSERT', 'DELETE'))]
+        self.assertEqual(len(links), 2)
+        self.assertNotIn(str(django.id), links[0] if links[0].startswith('DELETE') else links[1])
+        self.post(id=question.id)
+        self.assertEqual(self.tags(question), ['django', 'flask'])
+        self.assertEqual(self.post(id=question.id, tag=['x' * 201]).status_code, 400)
+
+    def test_edit_form_selects_every_tag(self):
+        self.post(tag='python, django')
+        question = Question.objects.get()
+        response = self.client.get(reverse('api:page'), {'question_id': question.id})
+        self.assertContains(response, '<select class="form-control" name="tag" id="select2" multiple>')
+        for name in ('Python', 'django'):
+            self.assertContains(response, '<option value="{0}" selected>{0}</option>'.format(name))
+
+
+class InstrumentationTest(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.profile = make_profile('measured')
+        make_questions(self.profile, 3)
+
+    def test_sql_shape(self):
+        self.assertEqual(sql_shape('SELECT "a" FROM "t" WHERE "id" = 12 AND "name" = \'it\'\'s\'  AND "x" IN (1, 2)'),
+                         'SELECT "a" FROM "t" WHERE "id" = ? AND "name" = ? AND "x" IN (...)')
+
+    def test_off_by_default(self):
+        response = self.client.get(reverse('api:page'))
+        self.assertNotIn('X-Query-Count', response)
+        self.assertEqual(registry.snapshot(), ([], []))
+
+    @override_settings(PERF_SAMPLE_RATE=1, PERF_N_PLUS_ONE_THRESHOLD=2)
+    def test_records_queries_timings_and_n_plus_one(self):
+        response = self.client.get(reverse('api:page'))
+        # The listing and the first load of the tag catalog
+        self.assertEqual(response['X-Query-Count'], '2')
+        question = Question.objects.first()
+        self.client.post(reverse('api:question'), {'title': 'T', 'question': 'Q', 'profile_id': self.profile.id,
+                                                   'id': question.id, 'tag': 'a, b, c'})
+        views, recent = registry.snapshot()
+        stats = dict(views)
+        self.assertEqual(stats['api:page']['requests'], 1)
+        self.assertEqual(stats['api:page']['sql_queries'], 2)
+        self.assertGreater(stats['api:page']['template_seconds'], 0)
+        self.assertGreater(stats['api:question']['serializer_seconds'], 0)
+        # New tags are created with their slugs worked out, not looked up one by one
+        self.assertEqual(stats['api:question']['n_plus_one'], 0)
+        looping = RequestProfile()
+        looping.queries = [{'sql': 'SELECT "name" FROM "core_tag" WHERE "id" = {}'.format(tag_id), 'time': '0.001'}
+                           for tag_id in range(3)]
+        registry.record('api:tags', looping)
+        views, recent = registry.snapshot()
+        self.assertEqual(dict(views)['api:tags']['n_plus_one'], 1)
+        self.assertEqual(recent[0][:3], ('api:tags', 'SELECT "name" FROM "core_tag" WHERE "id" = ?', 3))
+
+        staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.force_login(staff)
+        self.assertContains(self.client.get(reverse('perf')), 'api:question')
+        self.assertContains(self.client.get(reverse('perf')), 'worker {}'.format(os.getpid()))
+        # Each worker's counters are series of their own
+        metrics = self.client.get(reverse('perf-metrics')).content.decode('utf-8')
+        pid = 'pid="{}"'.format(os.getpid())
+        self.assertIn('qa_requests_total{%s,view="api:page"} 1\n' % pid, metrics)
+        self.assertIn('qa_request_duration_seconds_bucket{%s,view="api:page",le="+Inf"} 1\n' % pid, metrics)
+        self.assertIn('qa_n_plus_one_requests_total{%s,view="api:question"} 0\n' % pid, metrics)
+        self.assertIn('qa_n_plus_one_requests_total{%s,view="api:tags"} 1\n' % pid, metrics)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('perf-metrics'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get(reverse('perf')).status_code, 302)
+
+
+class BenchmarkTest(TransactionTestCase):
+
+    def test_corpus_is_repeatable(self):
+        spec = corpus.SCALES['tiny']
+        records = list(corpus.question_records(spec, seed=7))
+        self.assertEqual(records, list(corpus.question_records(spec, seed=7)))
+        self.assertNotEqual(records, list(corpus.question_records(spec, seed=8)))
+        self.assertEqual(len(records), spec.questions)
+        answers = [answer for record in records for answer in record['answers']]
+        self.assertTrue(any(answer['parent'] is not None for answer in answers))
+        self.assertTrue(all(len(record['answers']) <= spec.max_answers for record in records))
+
+    def test_scenarios_cover_every_route(self):
+        self.assertEqual(set(pattern.name for pattern in api_urls.urlpatterns),
+                         set(scenario.route for scenario in SCENARIOS.values()))
+
+    def test_run(self):
+        names = ['home', 'thread', 'answer-vote-storm', 'tag-autocomplete', 'export-tags', 'sign-up', 'login',
+                 'profile-detail', 'profile-detail-token']
+        results = runner.run(corpus.SCALES['tiny'], names, seed=1, requests=4, warmup=1)
+        clear_caches()
+        self.assertEqual(results['corpus']['questions'], corpus.SCALES['tiny'].questions)
+        self.assertEqual(Question.objects.count(), corpus.SCALES['tiny'].questions)
+        self.assertEqual(list(results['scenarios']), names)
+        for name, result in results['scenarios'].items():
+            self.assertEqual((result['requests'], result['errors']), (4, 0), name)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        # Once the token is cached, authenticating costs no query
+        self.assertEqual(results['scenarios']['profile-detail-token']['queries_max'],
+                         results['scenarios']['profile-detail']['queries_max'])
+        self.assertEqual(json.loads(json.dumps(results))['meta']['seed'], 1)
+        fixtures = Fixtures(corpus.SCALES['tiny'], seed=1)
+        queries = {}
+        for sessions in ('db', 'api'):
+            with override_settings(ALLOWED_HOSTS=['testserver'], SESSION_ENGINE=runner.SESSION_ENGINES[sessions]):
+                queries[sessions] = runner.run_scenario(SCENARIOS['home-signed-in'], fixtures, requests=3,
+                                                        warmup=1)['queries_max']
+        # Only the database engine reads the session from the database
+        self.assertEqual(queries['db'] - queries['api'], 1)
+        slower = json.loads(json.dumps(results))
+        slower['scenarios']['home']['p95_ms'] = results['scenarios']['home']['p95_ms'] / 2
+        regressed = [(name, metric) for name, metric, before, after, flag in runner.compare(slower, results) if flag]
+        self.assertEqual(regressed, [('home', 'p95_ms')])
+
+
+class QueryCountGuard(object):
+    """
+    Checks that a request runs as many queries however much data there is, and shows the SQL that only the
+    bigger dataset runs when it doesn't
+    """
+    # Rows of each kind in the dataset at each step
+    sizes = (1, 4, 16)
+
+    def capture(self, request):
+        clear_caches()
+        search.reset_fallback_index()
+        with CaptureQueriesContext(connection) as queries:
+            request()
+        return [query['sql'] for query in queries.captured_queries]
+
+    def assertConstantQueries(self, request, grow, sizes=None):
+        """
+        Runs `request()` each time `grow(rows)` has added rows up to the next size
+        """
+        baseline = None
+        rows = 0
+        for size in sizes or self.sizes:
+            grow(size - rows)
+            rows = size
+            queries = self.capture(request)
+            if baseline is None:
+                baseline = (size, queries)
+            elif len(queries) != len(baseline[1]):
+                diff = difflib.unified_diff(
+                    [sql_shape(sql) for sql in baseline[1]], [sql_shape(sql) for sql in queries],
+                    '{} rows: {} queries'.format(baseline[0], len(baseline[1])),
+                    '{} rows: {} queries'.format(size, len(queries)), lineterm='')
+                self.fail('\n'.join(['The number of queries grows with the data'] + list(diff)))
+
+
+class PageQueryCountTest(QueryCountGuard, TestCase):
+    """
+    Every template of the page view against growing data
+    """
+
+    def setUp(self):
+        self.owner = make_profile('owner')
+        self.question = Question.objects.create(title='Main question', question='Body', asked_by=self.owner)
+        self.rows = 0
+        self.member = self.client_class()
+        self.member.force_login(self.owner.user)
+
+    def grow(self, rows):
+        """
+        Profiles, tags, questions, answers, replies and votes, `rows` more of each
+        """
+        for index in range(self.rows, self.rows + rows):
+            profile = make_profile('user{}'.format(index))
+            tag = Tag.objects.create(name='tag{}'.format(index))
+            self.question.tag.add(tag)
+            for author in (self.owner, profile):
+                Question.objects.create(title='Question {}'.format(index), question='Body',
+                                        asked_by=author).tag.add(tag)
+            answer = Answer.objects.create(answer='Answer {}'.format(index), answer_by=profile)
+            threads.add_answer(self.question, answer)
+            threads.add_answer(self.question, Answer.objects.create(answer='Reply', answer_by=self.owner,
+                                                                    parent=answer))
+            votes.vote_answer(answer.id, self.owner.id, up_vote=True)
+        self.rows += rows
+
+    def page(self, client, **params):
+        def request():
+            self.assertEqual(client.get(reverse('api:page'), params).status_code, 200)
+        return request
+
+    def test_home(self):
+        self.assertConstantQueries(self.page(self.client), self.grow)
+
+    def test_home_signed_in(self):
+        self.assertConstantQueries(self.page(self.member), self.grow)
+
+    def test_home_sorted(self):
+        for sort in ('hot', 'top', 'unanswered'):
+            self.assertConstantQueries(self.page(self.client, sort=sort), self.grow)
+
+    def test_search(self):
+        self.assertConstantQueries(self.page(self.client, searchText='question'), self.grow)
+
+    def test_thread(self):
+        self.assertConstantQueries(self.page(self.member, question_thread_id=self.question.id), self.grow)
+
+    def test_question_edit(self):
+        self.assertConstantQueries(self.page(self.member, question_id=self.question.id), self.grow)
+
+    def test_new_question(self):
+        self.assertConstantQueries(self.page(self.member, question='true'), self.grow)
+
+    def test_profile(self):
+        self.assertConstantQueries(self.page(self.member, profile='true'), self.grow)
+
+    def test_login(self):
+        self.assertConstantQueries(self.page(self.client, **{'login-signup': 'true'}), self.grow)
+
+    def test_reports_the_extra_queries(self):
+        def request():
+            return [question.asked_by.title for question in Question.objects.all()]
+        with self.assertRaises(AssertionError) as failure:
+            self.assertConstantQueries(request, self.grow, sizes=(1, 2))
+        message = str(failure.exception)
+        self.assertIn('+++ 2 rows: 6 queries', message)
+        self.assertIn('+SELECT "core_profile"."id"', message)
+
+
+class ProfileStatsTest(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.profile = make_profile('author')
+        self.other = make_profile('other')
+        self.question = Question.objects.create(title='Question', question='Body', asked_by=self.other)
+        Question.objects.create(title='Mine', question='Body', asked_by=self.profile)
+        self.answers = [Answer.objects.create(answer='Answer {}'.format(index), answer_by=self.profile)
+                        for index in range(3)]
+        for answer in self.answers:
+            threads.add_answer(self.question, answer)
+
+    def test_counts_in_one_cached_query(self):
+        with self.assertNumQueries(1):
+            stats = profiles.profile_stats(self.profile.id)
+        self.assertEqual(stats, profiles.ProfileStats(questions=1, answers=3, accepted_answers=0, reputation=0))
+        with self.assertNumQueries(0):
+            self.assertEqual(profiles.profile_stats(self.profile.id), stats)
+        self.assertEqual(profiles.profile_stats(self.other.id), (1, 0, 0, 0))
+        self.assertIsNone(profiles.profile_stats(0))
+
+    @override_settings(PROFILE_CACHE='default')
+    def test_nothing_cached_in_a_process_local_cache(self):
+        # The other workers couldn't drop its entries
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                profiles.profile_stats(self.profile.id)
+            with self.assertNumQueries(1):
+                profiles.user_profile(self.profile.user_id)
+
+    def test_writes_refresh_the_stats(self):
+        profiles.profile_stats(self.profile.id)
+        threads.accept_answer(self.question.id, self.answers[0].id)
+        self.assertEqual(profiles.profile_stats(self.profile.id).accepted_answers, 1)
+        reputation.apply_events()
+        self.assertEqual(profiles.profile_stats(self.profile.id).reputation, reputation.weights()['answer_accepted'])
+        Question.objects.create(title='Another', question='Body', asked_by=self.profile)
+        self.answers[1].delete()
+        self.assertEqual(profiles.profile_stats(self.profile.id)[:2], (2, 2))
+        # Somebody else's activity leaves the cached stats alone
+        Answer.objects.create(answer='Elsewhere', answer_by=self.other)
+        with self.assertNumQueries(0):
+            profiles.profile_stats(self.profile.id)
+
+    def test_profile_page(self):
+        self.client.force_login(self.profile.user)
+        response = self.client.get(reverse('api:page'), {'profile': 'true'})
+        self.assertEqual(response.context['profile_stats'], (1, 3, 0, 0))
+        self.assertNotIn('profile_stats', self.client.get(reverse('api:page')).context)
+
+    def test_signed_in_profile_is_cached_between_requests(self):
+        self.client.force_login(self.profile.user)
+        self.client.get(reverse('api:page'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api:page'))
+        self.assertEqual(response.context['user'], self.profile)
+        self.assertFalse([query for query in queries.captured_queries if 'FROM "core_profile"' in query['sql']])
+        self.profile.title = 'Renamed'
+        self.profile.save()
+        self.assertEqual(self.client.get(reverse('api:page')).context['user'].title, 'Renamed')
+
+
+@override_settings(REPUTATION_WEIGHTS={'question_asked': 1, 'question_up_voted': 5, 'question_down_voted': -2,
+                                       'answer_up_voted': 10, 'answer_down_voted': -2, 'answer_accepted': 15})
+class ReputationTest(TransactionTestCase):
+
+    def setUp(self):
+        self.author = make_profile('author')
+        self.voters = [make_profile('voter{}'.format(index)) for index in range(5)]
+
+    def reputations(self):
+        return dict(Profile.objects.values_list('user__username', 'reputation'))
+
+    def test_events_credit_the_author(self):
+        self.client.post(reverse('api:question'), {'title': 'Title', 'question': 'Body',
+                                                   'profile_id': self.author.id})
+        question = Question.objects.get()
+        answer = Answer.objects.create(answer='Answer', answer_by=self.author)
+        threads.add_answer(question, answer)
+        votes.vote_question(question.id, self.voters[0].id, up_vote=True)
+        votes.vote_answer(answer.id, self.voters[0].id, up_vote=True)
+        votes.vote_answer(answer.id, self.voters[0].id, up_vote=True)
+        votes.vote_answer(answer.id, self.voters[1].id, down_vote=True)
+        # Turned around, and voting on one's own answer or accepting it counts for nothing
+        votes.vote_answer(answer.id, self.voters[1].id, up_vote=True)
+        votes.vote_answer(answer.id, self.author.id, up_vote=True)
+        threads.accept_answer(question.id, answer.id)
+        self.assertEqual(sorted(ReputationEvent.objects.values_list('kind', 'count')), [
+            ('answer_down_voted', -1), ('answer_down_voted', 1), ('answer_up_voted', 1), ('answer_up_voted', 1),
+            ('question_asked', 1), ('question_up_voted', 1)])
+        self.assertEqual(reputation.apply_events(batch_size=4), 6)
+        self.assertEqual(reputation.apply_events(), 0)
+        self.assertEqual(self.reputations(), dict({'author': 1 + 5 + 10 + 10},
+                                                  **{voter.user.username: 0 for voter in self.voters}))
+
+    def test_accepting_another_answer_takes_the_acceptance_back(self):
+        question = Question.objects.create(title='Title', question='Body', asked_by=self.voters[0])
+        first, second = [Answer.objects.create(answer='Answer', answer_by=profile)
+                         for profile in (self.author, self.voters[1])]
+        for answer in (first, second):
+            threads.add_answer(question, answer)
+        threads.accept_answer(question.id, first.id)
+        threads.accept_answer(question.id, second.id)
+        threads.accept_answer(question.id, second.id)
+        self.assertEqual(list(Answer.objects.filter(accepted_or_not=True)), [second])
+        self.assertEqual(sorted(ReputationEvent.objects.filter(kind=ReputationEvent.ANSWER_ACCEPTED).values_list(
+            'answer_id', 'count')), [(first.id, -1), (first.id, 1), (second.id, 1)])
+        reputation.apply_events()
+        self.assertEqual(self.reputations()['author'], 0)
+        self.assertEqual(self.reputations()['voter1'], 15)
+        self.assertEqual(profiles.profile_stats(self.author.id).accepted_answers, 0)
+
+        other = Question.objects.create(title='Other', question='Body', asked_by=self.voters[0])
+        with self.assertRaises(Answer.DoesNotExist):
+            threads.accept_answer(other.id, first.id)
+        self.assertIsNone(Question.objects.get(id=other.id).accepted_answer)
+
+    def test_recompute_in_parallel(self):
+        question = Question.objects.create(title='Title', question='Body', asked_by=self.author)
+        answers = []
+        for voter in self.voters:
+            answers.append(Answer.objects.create(answer='Answer', answer_by=voter))
+            threads.add_answer(question, answers[-1])
+            votes.vote_question(question.id, voter.id, up_vote=True)
+        for voter, answer in zip(self.voters, answers[1:] + answers[:1]):
+            votes.vote_answer(answer.id, voter.id, down_vote=True)
+        reputation.apply_events()
+        # Left pending, the recompute counts it too
+        threads.accept_answer(question.id, answers[0].id)
+        with override_settings(REPUTATION_WEIGHTS={'question_up_voted': 1, 'answer_down_voted': -1,
+                                                   'answer_accepted': 100}):
+            self.assertEqual(reputation.recompute(workers=2, chunk_size=2), 6)
+            self.assertEqual(reputation.apply_events(), 0)
+            self.assertEqual(reputation.recompute(workers=2, chunk_size=2), 0)
+        self.assertEqual(self.reputations(), {'author': 5, 'voter0': 99, 'voter1': -1, 'voter2': -1, 'voter3': -1,
+                                              'voter4': -1})
+
+
+class RankingTest(TestCase):
+
+    def setUp(self):
+        self.profile = make_profile('asker')
+        self.voters = [make_profile('voter{}'.format(index)) for index in range(3)]
+        now = timezone.now()
+        self.questions = {}
+        for title, hours_ago in (('old', 48), ('recent', 2), ('new', 0)):
+            self.questions[title] = Question.objects.create(title=title, question='Body', asked_by=self.profile)
+            Question.objects.filter(id=self.questions[title].id).update(created=now - timedelta(hours=hours_ago))
+
+    def listing(self, **params):
+        clear_caches()
+        response = self.client.get(reverse('api:page'), params)
+        return [question.title for question in response.context['questions']]
+
+    def test_votes_and_answers_rescore_only_their_question(self):
+        self.assertEqual(ranking.rank_questions(batch_size=2), 3)
+        self.assertEqual(self.listing(sort='hot'), ['new', 'recent', 'old'])
+        for voter in self.voters:
+            votes.vote_question(self.questions['recent'].id, voter.id, up_vote=True)
+        threads.add_answer(self.questions['old'], Answer.objects.create(answer='Answer', answer_by=self.voters[0]))
+        votes.rollup_votes()
+        self.assertEqual(sorted(Question.objects.filter(ranked=False).values_list('title', flat=True)),
+                         ['old', 'recent'])
+        self.assertEqual(ranking.rank_questions(), 2)
+        self.assertEqual(ranking.rank_questions(), 0)
+        # Three votes make up for two hours, not for two days
+        self.assertEqual(self.listing(sort='hot'), ['recent', 'new', 'old'])
+        self.assertEqual(self.listing(sort='top'), ['recent', 'new', 'old'])
+        self.assertEqual(self.listing(sort='unanswered'), ['new', 'recent'])
+        self.assertEqual(self.listing(ordering='votes'), self.listing(sort='top'))
+
+    def test_new_questions_are_scored_when_asked(self):
+        self.client.post(reverse('api:question'), {'title': 'Asked', 'question': 'Body',
+                                                   'profile_id': self.profile.id})
+        self.assertTrue(Question.objects.get(title='Asked').ranked)
+        ranking.rank_questions()
+        self.assertEqual(self.listing(sort='hot')[0], 'Asked')
+
+    def test_full_rescore_after_the_settings_changed(self):
+        ranking.rank_questions()
+        for voter in self.voters:
+            votes.vote_question(self.questions['old'].id, voter.id, up_vote=True)
+        votes.rollup_votes()
+        ranking.rank_questions()
+        self.assertEqual(self.listing(sort='hot')[0], 'new')
+        with override_settings(HOT_SCORE_DECAY=10 ** 7):
+            self.assertEqual(ranking.rank_all(chunk_size=2), 3)
+            self.assertEqual(ranking.rank_all(), 0)
+        self.assertEqual(self.listing(sort='hot')[0], 'old')
+
+
+class AccountsTest(TestCase):
+
+    def setUp(self):
+        clear_caches()
+
+    def sign_up(self, username, email):
+        return self.client.post(reverse('api:sign-up'), {'username': username, 'email': email,
+                                                         'first_name': 'First', 'last_name': 'Last'})
+
+    def log_in(self, username_email):
+        return self.client.post(reverse('api:user-login'), {'username_email': username_email})
+
+    def test_sign_up_relies_on_the_unique_constraints(self):
+        response = self.sign_up('alice', 'Alice@example.com')
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(username='alice')
+        self.assertEqual(response.data['token'], Token.objects.get(user=user).key)
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.id)
+        self.client.logout()
+        for username, email in (('alice', 'other@example.com'), ('bob', 'alice@EXAMPLE.com')):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.sign_up(username, email).status_code, 400)
+            self.assertFalse([query for query in queries.captured_queries
+                              if query['sql'].startswith('SELECT') and 'auth_user' in query['sql']])
+        # Users without an email don't clash with each other
+        User.objects.create(username='imported1')
+        User.objects.create(username='imported2')
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_email_index_migration_lists_case_duplicates(self):
+        migration = import_module('core.migrations.0014_user_email_index')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX {}'.format(connection.ops.quote_name(migration.EMAIL_INDEX_NAME)))
+        migration.check_duplicate_emails(apps, None)
+        User.objects.create(username='bob', email='Bob@example.com')
+        User.objects.create(username='robert', email='bob@EXAMPLE.com')
+        User.objects.create(username='carol', email='carol@example.com')
+        with self.assertRaisesRegexp(IntegrityError, 'bob Bob@example.com\n.* robert bob@EXAMPLE.com$'):
+            migration.check_duplicate_emails(apps, None)
+
+    def test_log_in_with_one_lookup(self):
+        self.sign_up('alice', 'alice@example.com')
+        token = Token.objects.get().key
+        for username_email in ('alice', 'ALICE@example.com'):
+            self.client.logout()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.log_in(username_email)
+            self.assertEqual((response.status_code, response.data['token']), (200, token))
+            self.assertEqual(len([query for query in queries.captured_queries
+                                  if query['sql'].startswith('SELECT') and 'auth_user' in query['sql']]), 1)
+            self.assertFalse([query for query in queries.captured_queries if 'authtoken_token' in query['sql']])
+        self.assertEqual(self.log_in('nobody').status_code, 400)
+        User.objects.filter(username='alice').update(is_active=False)
+        self.assertEqual(self.log_in('alice').status_code, 400)
+
+    def test_cached_token_follows_the_token(self):
+        user = User.objects.create(username='carol')
+        key = accounts.token_for(user)
+        self.assertEqual(accounts.token_for(user), key)
+        Token.objects.filter(user=user).get().delete()
+        self.assertNotEqual(accounts.token_for(user), key)
+        self.assertEqual(accounts.token_for(user), Token.objects.get(user=user).key)
+
+
+class TokenAuthenticationTest(TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.profile = make_profile('client')
+        self.key = accounts.token_for(self.profile.user)
+
+    def get(self, key):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api:profile-detail', kwargs={'pk': self.profile.id}),
+                                       HTTP_AUTHORIZATION='Token {}'.format(key))
+        return response.status_code, len([query for query in queries.captured_queries
+                                          if 'authtoken_token' in query['sql']])
+
+    def test_cached_until_rotated_or_deactivated(self):
+        self.assertEqual(self.get(self.key), (200, 1))
+        self.assertEqual(self.get(self.key), (200, 0))
+        self.assertEqual(self.get('0' * 40), (403, 1))
+        # Logging in again keeps the entry
+        self.client.post(reverse('api:user-login'), {'username_email': 'client'})
+        self.client.logout()
+        self.assertEqual(self.get(self.key), (200, 0))
+        Token.objects.filter(user=self.profile.user).get().delete()
+        new_key = accounts.token_for(self.profile.user)
+        self.assertEqual(self.get(self.key), (403, 1))
+        self.assertEqual(self.get(new_key), (200, 1))
+        user = self.profile.user
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.get(new_key), (403, 1))
+
+    def test_writes_in_other_workers_reach_the_cached_tokens(self):
+        self.assertEqual(self.get(self.key), (200, 1))
+        # Another worker deactivates the user: its save moves the shared generation on, not this worker's entry
+        User.objects.filter(id=self.profile.user_id).update(is_active=False)
+        accounts.next_generation(self.profile.user_id)
+        self.assertEqual(self.get(self.key), (403, 1))
+
+    @override_settings(TOKEN_CACHE='default')
+    def test_nothing_cached_without_a_shared_generation(self):
+        self.assertEqual(self.get(self.key), (200, 1))
+        self.assertEqual(self.get(self.key), (200, 1))
+
+
+@override_settings(SESSION_ENGINE='api.sessions', SESSION_ANONYMOUS_SIGNED_COOKIES=True)
+class SessionsTest(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.profile = make_profile('reader')
+
+    def page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api:page'))
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries
+                if 'django_session' in query['sql'] or 'FROM "auth_user" WHERE' in query['sql']], response
+
+    def stored_session(self):
+        return Session.objects.get(session_key=self.client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    def test_signed_in_page_views_skip_the_database(self):
+        self.client.post(reverse('api:user-login'), {'username_email': 'reader'})
+        self.page_queries()
+        queries, response = self.page_queries()
+        self.assertEqual(queries, [])
+        self.assertEqual(response.context['user'], self.profile)
+        user = self.profile.user
+        user.is_active = False
+        user.save()
+        queries, response = self.page_queries()
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+    def test_activity_is_written_behind(self):
+        self.client.post(reverse('api:user-login'), {'username_email': 'reader'})
+        stored = self.stored_session()
+        self.page_queries()
+        self.assertEqual(self.page_queries()[0], [])
+        self.assertEqual(self.stored_session().expire_date, stored.expire_date)
+        self.assertIn(LAST_ACTIVITY_KEY, SessionStore(stored.session_key).load())
+        with override_settings(SESSION_ACTIVITY_WRITE_INTERVAL=0):
+            self.page_queries()
+        self.assertGreater(self.stored_session().expire_date, stored.expire_date)
+
+    @override_settings(SESSION_CACHE_ALIAS='default', USER_CACHE='default')
+    def test_process_local_caches_are_left_alone(self):
+        self.client.post(reverse('api:user-login'), {'username_email': 'reader'})
+        for _ in range(2):
+            queries, response = self.page_queries()
+            self.assertEqual(len(queries), 2)
+        self.assertIsNone(caches['default'].get(accounts.user_key(self.profile.user_id)))
+
+    def test_anonymous_sessions_live_in_a_signed_cookie(self):
+        store = SessionStore()
+        store['seen'] = 1
+        store.save()
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(SessionStore(store.session_key)['seen'], 1)
+        self.assertEqual(SessionStore(store.session_key[:-4] + 'abcd').load(), {})
+        store = SessionStore(store.session_key)
+        store.cycle_key()
+        store[SESSION_KEY] = str(self.profile.user.pk)
+        store.save()
+        self.assertEqual(Session.objects.get().session_key, store.session_key)
+        self.assertEqual(SessionStore(store.session_key)['seen'], 1)
+
+    def test_purge_in_batches(self):
+        now = timezone.now()
+        Session.objects.bulk_create([Session(session_key='expired{}'.format(index), session_data='',
+                                             expire_date=now - timedelta(days=1)) for index in range(5)] +
+                                    [Session(session_key='alive{}'.format(index), session_data='',
+                                             expire_date=now + timedelta(days=1)) for index in range(2)])
+        out = StringIO()
+        call_command('purge_sessions', batch_size=2, stdout=out)
+        self.assertIn('Deleted 5 expired sessions', out.getvalue())
+        self.assertEqual(sorted(Session.objects.values_list('session_key', flat=True)), ['alive0', 'alive1'])
+
+
+@override_settings(AVATAR_SIZES=(32, 64), AVATAR_WORKERS=0)
+class AvatarsTest(TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        media = override_settings(MEDIA_ROOT=directory)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.profile = make_profile('pictured')
+
+    def picture(self, color=(200, 30, 30, 128)):
+        output = BytesIO()
+        Image.new('RGBA', (300, 200), color).save(output, 'PNG')
+        return ContentFile(output.getvalue())
+
+    def render(self, profile, size=30):
+        return Template('{% load avatars %}{% avatar profile size id="profile-img" %}').render(
+            Context({'profile': profile, 'size': size}))
+
+    def test_thumbnails_made_on_upload(self):
+        self.assertIn('img/male-avatar.jpg', self.render(self.profile))
+        # Until the thumbnails are made, the original stands in
+        Profile.objects.filter(id=self.profile.id).update(avatar=default_storage.save('profile/me.png', self.picture()))
+        self.profile.refresh_from_db()
+        self.assertIn(self.profile.avatar.url, self.render(self.profile))
+        avatars.process(self.profile.id)
+        profile = Profile.objects.get(id=self.profile.id)
+        made = avatars.variants(profile)
+        self.assertEqual(sorted(made['sizes']), ['32', '64'])
+        for size, files in made['sizes'].items():
+            self.assertEqual(sorted(files), ['jpeg', 'webp'])
+            for image_format, name in files.items():
+                image = Image.open(default_storage.open(name))
+                self.assertEqual((image.format.lower(), image.size), (image_format, (int(size), int(size))))
+        html = self.render(profile)
+        self.assertIn('<source type="image/webp" srcset="{} 1x, {} 2x">'.format(
+            default_storage.url(made['sizes']['32']['webp']), default_storage.url(made['sizes']['64']['webp'])), html)
+        self.assertIn('id="profile-img"', html)
+        self.assertIn(default_storage.url(made['sizes']['64']['jpeg']), self.render(profile, 200))
+        self.assertFalse(avatars.process(self.profile.id))
+
+    def test_same_picture_shares_its_thumbnails(self):
+        self.profile.avatar.save('me.png', self.picture())
+        other = make_profile('twin')
+        other.avatar.save('twin.png', self.picture())
+        third = make_profile('other')
+        third.avatar.save('other.png', self.picture(color=(0, 0, 255, 255)))
+        first, second, different = [avatars.variants(profile) for profile in Profile.objects.filter(
+            id__in=[self.profile.id, other.id, third.id]).order_by('id')]
+        self.assertEqual(first['sizes'], second['sizes'])
+        self.assertNotEqual(first['sizes'], different['sizes'])
+        other.avatar = None
+        other.save()
+        self.assertEqual(Profile.objects.get(id=other.id).avatar_variants, '')
+
+    @skipUnless(threads_share_test_database(), 'Needs a test database the threads share')
+    def test_make_avatars_over_the_pool(self):
+        self.profile.avatar.save('me.png', self.picture())
+        Profile.objects.filter(id=self.profile.id).update(avatar_variants='')
+        out = StringIO()
+        with override_settings(AVATAR_WORKERS=2):
+            call_command('make_avatars', stdout=out)
+        self.assertIn('thumbnails of 1 avatars', out.getvalue())
+        self.assertFalse(avatars.is_stale(Profile.objects.get(id=self.profile.id)))
+        with override_settings(AVATAR_SIZES=(32, 64, 128)):
+            call_command('make_avatars', everything=True, stdout=out)
+            self.assertIn('128', avatars.variants(Profile.objects.get(id=self.profile.id))['sizes'])
@@ -1,6 +1,7 @@
 from django.conf.urls import url
 from api.views import UserRegistrationViewSet, UserLoginViewSet, UserLogoutViewSet, PageViewSet, QuestionViewSet, \
-    ProfileViewSet, AnswerViewSet
+    ProfileViewSet, AnswerViewSet, QuestionListViewSet, QuestionThreadViewSet, TagListViewSet, ProfileDetailViewSet, \
+    ExportViewSet, TagAutocompleteViewSet
 
 urlpatterns = [
     url('^sign-up/$', UserRegistrationViewSet.as_view(), name='sign-up'),
@@ -9,5 +10,11 @@ urlpatterns = [
     url('^question/$', QuestionViewSet.as_view(), name='question'),
     url('^profile/$', ProfileViewSet.as_view(), name='profile'),
     url('^answer/$', AnswerViewSet.as_view(), name='answer'),
+    url('^questions/$', QuestionListViewSet.as_view(), name='question-list'),
+    url(r'^questions/(?P<pk>\d+)/$', QuestionThreadViewSet.as_view(), name='question-detail'),
+    url('^tags/$', TagListViewSet.as_view(), name='tag-list'),
+    url('^tags/autocomplete/$', TagAutocompleteViewSet.as_view(), name='tag-autocomplete'),
+    url(r'^profiles/(?P<pk>\d+)/$', ProfileDetailViewSet.as_view(), name='profile-detail'),
+    url(r'^export/(?P<dataset>\w+)/$', ExportViewSet.as_view(), name='export'),
     url('^$', PageViewSet.as_view(), name='page'),
 ]
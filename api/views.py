@@ -1,19 +1,35 @@
 # -*- coding: utf-8 -*-
-from django.db.models import Q
-from django.http import HttpResponseRedirect
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseRedirect, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse, \
+    HttpResponseForbidden
+from django.utils.encoding import force_bytes
 from django.urls import reverse
-from django.views.generic import TemplateView
+from django.utils.decorators import method_decorator
+from django.views.generic import TemplateView, View
 from rest_framework import status
-from django.contrib.auth import get_user_model, logout
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotFound, ValidationError
+from django.contrib.auth import logout
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth import login
+from api import readers
+from api.cache import response_cache
+from api.instrumentation import registry, timer
+from api.pagination import CursorPaginator, InvalidCursor
 from api.serializers import ProfileSerializer, UserRegistrationSerializer, UserLoginSerializer, QuestionSerializer,\
     AnswerSerializer
+from core import exporter, profiles, search
 from core.models import Profile, Question, Answer, Tag
-
-User = get_user_model()
+from core.tags import tag_catalog, MAX_SUGGESTIONS
+from core.threads import load_thread, build_answer_tree
+from core.models.question_answer import QuestionQuerySet
 
 
 class UserRegistrationViewSet(APIView):
@@ -28,13 +44,11 @@ class UserRegistrationViewSet(APIView):
             user id
     """
     serializer_class = UserRegistrationSerializer
-    querset = User.objects.filter(is_active=True)
 
     def post(self, request, format=None):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid(raise_exception=True):
-            user = self.querset.objects.get(username=serializer.validated_data.get('user_username'))
-            login(request, user)
+            login(request, serializer.user)
             return Response(serializer.validated_data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -50,14 +64,12 @@ class UserLoginViewSet(APIView):
             username
             user id
     """
-    queryset = User.objects.filter(is_active=True)
     serializer_class = UserLoginSerializer
 
     def post(self, request, format=None):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid():
-            user = self.queryset.get(id=serializer.validated_data.get('user_id'))
-            login(request, user)
+            login(request, serializer.user)
             return Response(serializer.validated_data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -78,42 +90,102 @@ class PageViewSet(TemplateView):
     and based on that it selects the template
     """
     template_name = 'home.html'
+    paginate_by = 20
+    max_paginate_by = 100
+
+    def get(self, request, *args, **kwargs):
+        if not response_cache.is_cacheable(request):
+            return super(PageViewSet, self).get(request, *args, **kwargs)
+        response = response_cache.get(request)
+        if response is None:
+            response = super(PageViewSet, self).get(request, *args, **kwargs)
+            with timer('template'):
+                response.render()
+            response_cache.set(request, response)
+        return response
+
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET.get('page_size', self.paginate_by))
+        except (TypeError, ValueError):
+            return self.paginate_by
+        return max(1, min(page_size, self.max_paginate_by))
+
+    def paginate_questions(self, questions):
+        """
+        Keyset paginate the listing so any page costs one indexed query no matter how deep it is.
+        `sort` is one of `QuestionQuerySet.LISTING_SORTS`, `ordering=newest|votes` still works
+        """
+        sort = QuestionQuerySet.listing_sort(self.request.GET.get('sort'), self.request.GET.get('ordering'))
+        paginator = CursorPaginator(questions.for_listing(sort), self.get_page_size(),
+                                    ordering=QuestionQuerySet.LISTING_SORTS[sort])
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            page = paginator.page()
+        return {'questions': page.object_list, 'page_obj': page, 'sort': sort, 'page_size': paginator.page_size,
+                'sorts': sorted(QuestionQuerySet.LISTING_SORTS)}
+
+    def get_reply_depth(self):
+        # Bounded, each level is rendered by one more nested include
+        try:
+            return max(0, min(int(self.request.GET.get('reply_depth', settings.THREAD_REPLY_DEPTH)),
+                              settings.THREAD_REPLY_DEPTH * 4))
+        except (TypeError, ValueError):
+            return settings.THREAD_REPLY_DEPTH
+
+    def get_collapsed_answers(self):
+        return [int(answer_id) for answer_id in self.request.GET.get('collapse', '').split(',')
+                if answer_id.strip().isdigit()]
+
+    def search_questions(self, search_text):
+        """
+        Best matches first from the search index, a search has no further pages
+        """
+        return {'questions': search.search_questions(search_text, limit=self.get_page_size(),
+                                                     queryset=Question.objects.for_listing()),
+                'search_text': search_text, 'page_size': self.get_page_size()}
 
     def get_context_data(self, **kwargs):
         question = Question.objects.all()
-        data = {'tags': Tag.objects.all(), 'questions': question}
-        if self.request.GET.get('searchText'):
-            data.update({'questions': question.filter(Q(title__icontains=self.request.GET.get('searchText')) |
-                                                      Q(tag__in=data['tags'].filter(name__icontains=self.request.GET.get('searchText')))).distinct()
-                         })
+        data = {'tags': tag_catalog.all(), 'questions': question}
         if self.request.GET.get('question_thread_id'):
             try:
-                answer = Answer.objects.get(accepted_or_not=True,
-                                            question_answer__id=self.request.GET.get('question_thread_id'))
-            except Answer.DoesNotExist:
-                answer = None
-            data.update({'question': question.get(id=self.request.GET.get('question_thread_id')),
-                         'accepted': answer})
+                thread = load_thread(self.request.GET.get('question_thread_id'))
+            except (Question.DoesNotExist, ValueError):
+                raise Http404('Question does not exist')
+            reply_depth = self.get_reply_depth()
+            collapsed = self.get_collapsed_answers()
+            data.update({'question': thread.question, 'answers': thread.answers, 'accepted': thread.accepted,
+                         'reply_depth': reply_depth, 'collapsed': collapsed,
+                         'answer_tree': build_answer_tree(thread.answers, max_depth=reply_depth,
+                                                          collapsed=collapsed)})
             self.template_name = 'question_answer_thread.html'
         if self.request.GET.get('question_id'):
             self.template_name = 'question.html'
-            data.update({'question': Question.objects.get(id=self.request.GET.get('question_id'))})
-        if self.request.GET.get('question_id'):
-            self.template_name = 'question.html'
-            data.update({'question': Question.objects.get(id=self.request.GET.get('question_id'))})
+            question_object = Question.objects.get(id=self.request.GET.get('question_id'))
+            # Picked here once, the template would run a query for each tag it lists. The form submits the tags the
+            # question ends up with, all of them have to be selected
+            data.update({'question': question_object,
+                         'selected_tag_ids': set(question_object.tag.values_list('id', flat=True))})
         if self.request.GET.get('question'):
             self.template_name = 'question.html'
         if self.request.user.is_authenticated:
             if self.request.GET.get('profile'):
                 self.template_name = 'profile.html'
-            profile = Profile.objects.filter(user=self.request.user)
+            profile = profiles.request_profile(self.request)
             if profile:
-                profile = profile.first()
-                data.update({'user': profile, 'user_question': question.filter(asked_by=profile),
-                             'user_answer': Answer.objects.filter(answer_by=profile)})
+                data['user'] = profile
+                if self.template_name == 'profile.html':
+                    data['profile_stats'] = profiles.profile_stats(profile.id)
         else:
             if self.request.GET.get('login-signup'):
                 self.template_name = 'login_registration.html'
+        if self.template_name == 'home.html':
+            if self.request.GET.get('searchText'):
+                data.update(self.search_questions(self.request.GET.get('searchText')))
+            else:
+                data.update(self.paginate_questions(data['questions']))
         kwargs.update(data)
         return kwargs
 
@@ -128,7 +200,7 @@ class PageViewSet(TemplateView):
         return self.response_class(
             request=self.request,
             template=self.get_template_names(),
-            context=self.get_context_data(),
+            context=context,
             using=self.template_engine,
             **response_kwargs
         )
@@ -142,7 +214,7 @@ class QuestionViewSet(APIView):
     queryset = Question.objects.all()
 
     def post(self, request, format=None):
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(data=request.data, context={'request': request})
         if serializer.is_valid(raise_exception=True):
             return Response(serializer.validated_data, status=serializer.validated_data.get('status'))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -162,7 +234,7 @@ class AnswerViewSet(APIView):
     def post(self, request, format=None):
         data = request.data.dict()
         data.update({'user': request.user})
-        serializer = self.serializer_class(data=data)
+        serializer = self.serializer_class(data=data, context={'request': request})
         if serializer.is_valid(raise_exception=True):
             return Response(serializer.validated_data, status=serializer.validated_data.get('status'))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -186,3 +258,161 @@ class ProfileViewSet(APIView):
         if serializer.is_valid(raise_exception=True):
             return Response(serializer.validated_data, status=serializer.validated_data.get('status'))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ReadOnlyJSONMixin(object):
+    """
+    Encodes the payload once, tags it with an ETag and answers a matching `If-None-Match` with a bare 304
+    """
+    page_size = 20
+    max_page_size = 100
+
+    def get_page_size(self):
+        try:
+            return max(1, min(int(self.request.GET.get('page_size', self.page_size)), self.max_page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+
+    def get_page(self, paginator):
+        try:
+            return paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise ValidationError({'cursor': 'Invalid cursor'})
+
+    def paginated(self, page, results):
+        return {'results': results, 'next': page.next_cursor, 'previous': page.previous_cursor}
+
+    def json_response(self, payload):
+        content = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':'))
+        etag = '"{}"'.format(hashlib.md5(force_bytes(content)).hexdigest())
+        if etag in [tag.strip() for tag in self.request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+
+class QuestionListViewSet(ReadOnlyJSONMixin, APIView):
+    """
+    Lists the questions, newest first or by `sort=hot|top|unanswered` (`ordering=votes` still works), keyset
+    paginated with `cursor`. `fields=id,title,...` returns only those fields.
+    """
+
+    def get(self, request, format=None):
+        sort = QuestionQuerySet.listing_sort(request.GET.get('sort'), request.GET.get('ordering'))
+        ordering = QuestionQuerySet.LISTING_SORTS[sort]
+        fields = readers.parse_fields(request.GET.get('fields'), readers.QUESTION_FIELDS)
+        queryset = Question.objects.sorted_by(sort)
+        if request.GET.get('tag'):
+            queryset = queryset.filter(tag__slug=request.GET.get('tag'))
+        page = self.get_page(CursorPaginator(readers.question_rows(queryset, fields, ordering), self.get_page_size(),
+                                             ordering=ordering))
+        return self.json_response(self.paginated(page, readers.shape_questions(page, fields)))
+
+
+class QuestionThreadViewSet(ReadOnlyJSONMixin, APIView):
+    """
+    A question with all of its answers. `fields` picks the question fields, `answer_fields` the answer ones.
+    """
+
+    def get(self, request, pk, format=None):
+        try:
+            question = readers.read_thread(
+                pk, readers.parse_fields(request.GET.get('fields'), readers.QUESTION_FIELDS),
+                readers.parse_fields(request.GET.get('answer_fields'), readers.ANSWER_FIELDS))
+        except Question.DoesNotExist:
+            raise NotFound('Question does not exist')
+        return self.json_response(question)
+
+
+class TagListViewSet(ReadOnlyJSONMixin, APIView):
+    """
+    Lists the tags by name, keyset paginated with `cursor`
+    """
+    page_size = 100
+    max_page_size = 1000
+
+    def get(self, request, format=None):
+        fields = readers.parse_fields(request.GET.get('fields'), readers.TAG_FIELDS)
+        page = self.get_page(CursorPaginator(readers.tag_rows(Tag.objects.all(), fields), self.get_page_size(),
+                                             ordering=('name', 'id')))
+        return self.json_response(self.paginated(page, [readers.shape(row, readers.TAG_COLUMNS, fields)
+                                                        for row in page]))
+
+
+class TagAutocompleteViewSet(ReadOnlyJSONMixin, APIView):
+    """
+    Tags whose name starts with `q`, most used first, served from the in-process tag catalog
+    """
+    limit = 10
+    max_limit = MAX_SUGGESTIONS
+
+    def get(self, request, format=None):
+        try:
+            limit = max(1, min(int(request.GET.get('limit', self.limit)), self.max_limit))
+        except (TypeError, ValueError):
+            limit = self.limit
+        results = [{'id': tag.id, 'name': tag.name, 'slug': tag.slug, 'question_count': question_count}
+                   for tag, question_count in tag_catalog.autocomplete(request.GET.get('q', ''), limit)]
+        return self.json_response({'version': tag_catalog.version, 'results': results})
+
+
+class ProfileDetailViewSet(ReadOnlyJSONMixin, APIView):
+    """
+    Public details of a profile
+    """
+
+    def get(self, request, pk, format=None):
+        try:
+            profile = readers.read_profile(pk, readers.parse_fields(request.GET.get('fields'),
+                                                                    readers.PROFILE_FIELDS))
+        except Profile.DoesNotExist:
+            raise NotFound('Profile does not exist')
+        return self.json_response(profile)
+
+
+class ExportViewSet(APIView):
+    """
+    Streams a whole dataset (questions, answers, tags or profiles) for staff users.
+    `output` is jsonl or csv, `gzip=1` compresses the stream
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, dataset, format=None):
+        # `format` is taken by DRF's content negotiation
+        output = request.GET.get('output', 'jsonl')
+        if dataset not in exporter.DATASETS or output not in exporter.FORMATS:
+            raise NotFound('Unknown dataset or output')
+        gzip = request.GET.get('gzip') in ('1', 'true')
+        response = StreamingHttpResponse(exporter.export(dataset, output, gzip),
+                                         content_type='application/gzip' if gzip else exporter.CONTENT_TYPES[output])
+        response['Content-Disposition'] = 'attachment; filename="{name}"'.format(
+            name=exporter.filename(dataset, output, gzip))
+        return response
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class PerfViewSet(TemplateView):
+    """
+    Query and latency aggregates of the sampled requests served by this worker, see `api.instrumentation`
+    """
+    template_name = 'perf.html'
+
+    def get_context_data(self, **kwargs):
+        views, recent_n_plus_one = registry.snapshot()
+        kwargs.update({'views': views, 'recent_n_plus_one': recent_n_plus_one,
+                       'sample_rate': getattr(settings, 'PERF_SAMPLE_RATE', 0), 'pid': os.getpid()})
+        return kwargs
+
+
+class PerfMetricsViewSet(View):
+    """
+    The same aggregates for Prometheus, labelled with the pid of the worker, to staff and to scrapers from
+    `INTERNAL_IPS`
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+            return HttpResponseForbidden()
+        return HttpResponse(registry.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -4,9 +4,12 @@ from __future__ import unicode_literals
 from django.contrib import admin
 
 # Register your models here.
-from core.models import Profile, Tag, Question, Answer
+from core.models import Profile, Tag, Question, Answer, Vote, ImportCheckpoint, ReputationEvent
 
 admin.site.register(Profile)
 admin.site.register(Tag)
 admin.site.register(Question)
 admin.site.register(Answer)
+admin.site.register(Vote)
+admin.site.register(ImportCheckpoint)
+admin.site.register(ReputationEvent)
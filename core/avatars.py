@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Thumbnails of the avatars, so pages send an avatar at the size they show it rather than the original upload.
+
+Once a profile is saved with a new `avatar`, a pool of `AVATAR_WORKERS` threads crops the upload to a square and
+scales it down to each of `AVATAR_SIZES`, as a JPEG and as a WebP. The files are named after the hash of the
+upload's bytes: a name always holds the same picture, so it can be cached for good, and uploading the same
+picture again reuses them. `Profile.avatar_variants` records them, and the `avatar` template tag
+(`api/templatetags/avatars.py`) picks the smallest ones covering the size a page shows.
+
+`manage.py make_avatars` makes the thumbnails of the avatars uploaded before, or of every avatar after
+AVATAR_SIZES changed.
+"""
+import hashlib
+import json
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils.six import BytesIO
+from PIL import Image, ImageOps
+
+from core import profiles
+from core.models import Profile
+
+logger = logging.getLogger('qa.avatars')
+
+# (Pillow format, file extension, quality) of each variant
+FORMATS = (('JPEG', 'jpg', 85), ('WEBP', 'webp', 80))
+VARIANTS_DIR = 'avatars'
+# EXIF orientations of pictures taken with the camera turned, and how to turn them back
+ORIENTATION_TAG = 274
+ORIENTATIONS = {3: Image.ROTATE_180, 6: Image.ROTATE_270, 8: Image.ROTATE_90}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def sizes():
+    return sorted(getattr(settings, 'AVATAR_SIZES', (32, 64, 128, 256)))
+
+
+def workers():
+    return getattr(settings, 'AVATAR_WORKERS', 2)
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(max(1, workers()))
+    return _pool
+
+
+def variants(profile):
+    """
+    {'source': name of the avatar they were made from, 'sizes': {size: {format: name}}}, empty until they're made
+    """
+    return json.loads(profile.avatar_variants) if profile.avatar_variants else {}
+
+
+def is_stale(profile):
+    return bool(profile.avatar) and variants(profile).get('source') != profile.avatar.name
+
+
+def upright(image):
+    try:
+        orientation = (image._getexif() or {}).get(ORIENTATION_TAG)
+    except (AttributeError, IndexError, KeyError, SyntaxError, TypeError, ValueError):
+        # Not a JPEG, or its EXIF is broken
+        return image
+    return image.transpose(ORIENTATIONS[orientation]) if orientation in ORIENTATIONS else image
+
+
+def thumbnail(image, size, image_format, quality):
+    image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no transparency, it goes on white
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    output = BytesIO()
+    image.save(output, image_format, quality=quality, optimize=image_format == 'JPEG')
+    return output.getvalue()
+
+
+def make_variants(name):
+    """
+    Thumbnails of the avatar stored as `name`, in every size and format, reusing those already stored
+
+    :returns: what `variants` reads
+    :raises IOError: if the avatar isn't a picture Pillow can read
+    """
+    with default_storage.open(name, 'rb') as upload:
+        content = upload.read()
+    digest = hashlib.sha1(content).hexdigest()
+    image = None
+    made = {}
+    for size in sizes():
+        for image_format, extension, quality in FORMATS:
+            path = '{}/{}/{}-{}.{}'.format(VARIANTS_DIR, digest[:2], digest, size, extension)
+            if not default_storage.exists(path):
+                if image is None:
+                    image = Image.open(BytesIO(content))
+                    image.load()
+                    image = upright(image)
+                path = default_storage.save(path, ContentFile(thumbnail(image, size, image_format, quality)))
+            made.setdefault(str(size), {})[image_format.lower()] = path
+    return {'source': name, 'sizes': made}
+
+
+def process(profile_id):
+    """
+    Makes the thumbnails of the profile's avatar, unless they're up to date already
+
+    :returns: whether the profile got new thumbnails
+    """
+    profile = Profile.objects.filter(pk=profile_id).only('id', 'user_id', 'avatar', 'avatar_variants').first()
+    if profile is None or not is_stale(profile):
+        return False
+    made = make_variants(profile.avatar.name)
+    # Only for the avatar they were made from, an upload meanwhile has its own thumbnails on the way
+    updated = Profile.objects.filter(pk=profile_id, avatar=profile.avatar.name).update(
+        avatar_variants=json.dumps(made, sort_keys=True))
+    if updated:
+        profiles.profiles_changed([profile_id], [profile.user_id])
+    return bool(updated)
+
+
+def _process(profile_id):
+    try:
+        return process(profile_id)
+    except Exception:
+        # A pool thread has nobody to raise to
+        logger.exception('Thumbnails of the avatar of profile %s failed', profile_id)
+        return False
+    finally:
+        connection.close()
+
+
+def schedule(profile):
+    """
+    Makes the thumbnails of the profile's new avatar in the pool once the transaction commits, right there with
+    AVATAR_WORKERS = 0
+    """
+    if not profile.avatar:
+        if profile.avatar_variants:
+            Profile.objects.filter(pk=profile.pk).update(avatar_variants='')
+        return
+    if not is_stale(profile):
+        return
+    profile_id = profile.pk
+    if workers() <= 0:
+        transaction.on_commit(lambda: process(profile_id))
+    else:
+        transaction.on_commit(lambda: pool().apply_async(_process, (profile_id,)))
+
+
+def process_all(everything=False):
+    """
+    Makes the missing thumbnails, or all of them again with `everything` (say after AVATAR_SIZES changed)
+
+    :returns: number of profiles that got new thumbnails
+    """
+    profile_ids = Profile.objects.exclude(avatar='').exclude(avatar__isnull=True)
+    if everything:
+        profile_ids.update(avatar_variants='')
+    profile_ids = list(profile_ids.order_by('id').values_list('id', flat=True))
+    if workers() <= 0:
+        return sum(process(profile_id) for profile_id in profile_ids)
+    return sum(pool().imap_unordered(_process, profile_ids))
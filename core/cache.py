@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Local memory cache backend with least-recently-used eviction.
+
+Django's own `LocMemCache` culls an arbitrary third of the entries once it's full, this one only drops the
+entry that hasn't been read for the longest time. Expired entries are dropped when they're next read.
+
+    CACHES = {'responses': {'BACKEND': 'core.cache.LRUCache', 'LOCATION': 'responses',
+                            'TIMEOUT': 300, 'OPTIONS': {'MAX_ENTRIES': 5000}}}
+
+`shared_cache` hands out a cache only if its entries are seen by every worker, for the caches whose entries
+have to go when another worker writes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.six.moves import cPickle as pickle
+
+# Keyed by LOCATION, so every instance of the same cache in a process shares its entries
+_caches = {}
+_locks = {}
+
+
+class LRUCache(BaseCache):
+
+    def __init__(self, name, params):
+        BaseCache.__init__(self, params)
+        self._cache = _caches.setdefault(name, OrderedDict())
+        self._lock = _locks.setdefault(name, threading.Lock())
+
+    def _get_live(self, key):
+        """
+        (pickled value, expiry) of a key that hasn't expired, marking it as the most recently used
+        """
+        entry = self._cache.pop(key, None)
+        if entry is None or (entry[1] is not None and entry[1] <= time.time()):
+            return None
+        self._cache[key] = entry
+        return entry
+
+    def _set(self, key, pickled, timeout):
+        self._cache.pop(key, None)
+        if len(self._cache) >= self._max_entries:
+            self._cull()
+        self._cache[key] = (pickled, self.get_backend_timeout(timeout))
+
+    def _cull(self):
+        while len(self._cache) >= self._max_entries:
+            self._cache.popitem(last=False)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._get_live(key) is not None:
+                return False
+            self._set(key, pickled, timeout)
+            return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            entry = self._get_live(key)
+        if entry is None:
+            return default
+        try:
+            return pickle.loads(entry[0])
+        except pickle.PickleError:
+            return default
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._set(key, pickled, timeout)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            entry = self._get_live(key)
+            if entry is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(entry[0]) + delta
+            self._cache[key] = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), entry[1])
+        return value
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            return self._get_live(key) is not None
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+PROCESS_LOCAL_BACKENDS = (LocMemCache, LRUCache)
+# Keeps nothing, every read misses
+_uncached = DummyCache('uncached', {})
+
+
+def is_process_local(cache):
+    return isinstance(cache, PROCESS_LOCAL_BACKENDS)
+
+
+def shared_cache(alias):
+    """
+    The cache `alias`, or a cache keeping nothing if `alias` lives in this process only: the other workers
+    couldn't drop its entries when they change what's behind them
+    """
+    cache = caches[alias]
+    return _uncached if is_process_local(cache) else cache
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming export of questions, answers, tags and profiles as JSONL or CSV, optionally gzipped.
+
+Rows are read through `iterator()` (a server-side cursor on Postgres) and handled a chunk at a time: the tags
+and answers of a chunk of questions come with one query each over the id range of the chunk. Nothing but the
+current chunk is held in memory, whatever the size of the corpus.
+
+The questions dataset in JSONL has the answers nested the way `core.importer` reads them, so it can be
+imported into another instance as it is.
+"""
+import csv
+import json
+import zlib
+from collections import OrderedDict, defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import six
+from django.utils.encoding import force_bytes, force_text
+
+from core.importer import CSV_TAG_SEPARATOR
+from core.models import Question, Tag, Profile
+
+FORMATS = ('jsonl', 'csv')
+CONTENT_TYPES = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+# Lines are handed out in blocks of about this many bytes instead of one by one
+BLOCK_SIZE = 64 * 1024
+
+QUESTION_COLUMNS = OrderedDict((
+    ('id', 'id'),
+    ('title', 'title'),
+    ('question', 'question'),
+    ('asked_by', 'asked_by__user__username'),
+    ('up_vote', 'up_vote'),
+    ('down_vote', 'down_vote'),
+    ('answer_count', 'answer_count'),
+    ('accepted_answer_id', 'accepted_answer_id'),
+    ('created', 'created'),
+    ('modified', 'modified'),
+    ('last_activity_at', 'last_activity_at'),
+))
+NESTED_ANSWER_COLUMNS = OrderedDict((
+    ('ref', 'answer_id'),
+    ('parent', 'answer__parent_id'),
+    ('answer', 'answer__answer'),
+    ('answer_by', 'answer__answer_by__user__username'),
+    ('accepted', 'answer__accepted_or_not'),
+    ('up_vote', 'answer__up_vote'),
+    ('down_vote', 'answer__down_vote'),
+    ('favourite', 'answer__favourite'),
+    ('created', 'answer__created'),
+))
+ANSWER_COLUMNS = OrderedDict((
+    ('id', 'answer_id'),
+    ('question_id', 'question_id'),
+    ('parent_id', 'answer__parent_id'),
+    ('answer', 'answer__answer'),
+    ('answer_by', 'answer__answer_by__user__username'),
+    ('accepted_or_not', 'answer__accepted_or_not'),
+    ('up_vote', 'answer__up_vote'),
+    ('down_vote', 'answer__down_vote'),
+    ('favourite', 'answer__favourite'),
+    ('created', 'answer__created'),
+    ('modified', 'answer__modified'),
+))
+TAG_COLUMNS = OrderedDict((
+    ('id', 'id'),
+    ('name', 'name'),
+    ('slug', 'slug'),
+))
+PROFILE_COLUMNS = OrderedDict((
+    ('id', 'id'),
+    ('username', 'user__username'),
+    ('title', 'title'),
+    ('description', 'description'),
+    ('location', 'location'),
+    ('personal_website', 'personal_website'),
+    ('twitter_username', 'twitter_username'),
+    ('github_username', 'github_username'),
+    ('avatar', 'avatar'),
+    ('reputation', 'reputation'),
+))
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def rows(queryset, columns):
+    for row in queryset.values(*columns.values()).iterator():
+        yield OrderedDict((name, row[lookup]) for name, lookup in columns.items())
+
+
+def question_records(chunk_size=1000, answers=True):
+    """
+    Questions with their tag names and, if `answers`, their answers. Two queries per chunk of questions
+    """
+    for chunk in chunked(rows(Question.objects.order_by('id'), QUESTION_COLUMNS), chunk_size):
+        # The chunk is ordered by id, a range covers it without binding every id
+        first, last = chunk[0]['id'], chunk[-1]['id']
+        tags = defaultdict(list)
+        tag_rows = Question.tag.through.objects.filter(question_id__gte=first, question_id__lte=last).order_by(
+            'question_id', 'tag__name').values_list('question_id', 'tag__name')
+        for question_id, name in tag_rows:
+            tags[question_id].append(name)
+        nested = defaultdict(list)
+        if answers:
+            answer_rows = Question.answer.through.objects.filter(
+                question_id__gte=first, question_id__lte=last).order_by('question_id', 'answer__created', 'answer_id')
+            answer_rows = answer_rows.values('question_id', *NESTED_ANSWER_COLUMNS.values())
+            for row in answer_rows:
+                nested[row['question_id']].append(OrderedDict(
+                    (name, row[lookup]) for name, lookup in NESTED_ANSWER_COLUMNS.items()))
+        for record in chunk:
+            record['tags'] = tags[record['id']]
+            if answers:
+                record['answers'] = nested[record['id']]
+            yield record
+
+
+def answer_records(chunk_size=1000, **kwargs):
+    """
+    Answers with the id of their question, one row per question an answer belongs to
+    """
+    return rows(Question.answer.through.objects.order_by('question_id', 'answer_id'), ANSWER_COLUMNS)
+
+
+def tag_records(chunk_size=1000, **kwargs):
+    return rows(Tag.objects.order_by('id'), TAG_COLUMNS)
+
+
+def profile_records(chunk_size=1000, **kwargs):
+    return rows(Profile.objects.order_by('id'), PROFILE_COLUMNS)
+
+
+# dataset -> (CSV columns, records)
+DATASETS = OrderedDict((
+    ('questions', (tuple(QUESTION_COLUMNS) + ('tags',), question_records)),
+    ('answers', (tuple(ANSWER_COLUMNS), answer_records)),
+    ('tags', (tuple(TAG_COLUMNS), tag_records)),
+    ('profiles', (tuple(PROFILE_COLUMNS), profile_records)),
+))
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return CSV_TAG_SEPARATOR.join(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return force_text(value)
+
+
+class CSVLines(object):
+    """
+    Turns rows into CSV lines one at a time through a reused buffer
+    """
+
+    def __init__(self):
+        # The csv module of Python 2 only writes bytes
+        self.buffer = six.BytesIO() if six.PY2 else six.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def line(self, values):
+        values = [csv_value(value) for value in values]
+        self.writer.writerow([value.encode('utf-8') for value in values] if six.PY2 else values)
+        line = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return force_bytes(line)
+
+
+def export_lines(dataset, format='jsonl', chunk_size=1000):
+    columns, records = DATASETS[dataset]
+    if format == 'csv':
+        lines = CSVLines()
+        yield lines.line(columns)
+        for record in records(chunk_size, answers=False):
+            yield lines.line(record[column] for column in columns)
+    else:
+        for record in records(chunk_size, answers=True):
+            yield force_bytes(json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False)) + b'\n'
+
+
+def blocks(lines, size=BLOCK_SIZE):
+    block, length = [], 0
+    for line in lines:
+        block.append(line)
+        length += len(line)
+        if length >= size:
+            yield b''.join(block)
+            block, length = [], 0
+    if block:
+        yield b''.join(block)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(dataset, format='jsonl', gzip=False, chunk_size=1000):
+    """
+    Blocks of bytes of the whole dataset
+    """
+    output = blocks(export_lines(dataset, format, chunk_size))
+    return gzipped(output) if gzip else output
+
+
+def filename(dataset, format='jsonl', gzip=False):
+    return '{dataset}.{format}{extension}'.format(dataset=dataset, format=format, extension='.gz' if gzip else '')
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk import of questions, their answers and tags from dumps of other Q&A systems.
+
+Records are read from the input one at a time and written a chunk at a time: the tags and profiles a chunk
+refers to are resolved with one query each, then its answers, questions, search documents and M2M rows go in
+with one bulk insert per table, all inside a single transaction. The byte offset reached in the input is
+stored in that same transaction, so an interrupted import picks up after the last committed chunk.
+
+JSONL, one question per line. `ref`/`parent` link replies to answers of the same question:
+
+    {"title": "...", "question": "...", "asked_by": "username", "tags": ["python"], "created": "2019-01-09T19:29:00Z",
+     "up_vote": 0, "down_vote": 0, "answers": [{"ref": "1", "answer": "...", "answer_by": "username",
+     "parent": null, "accepted": false, "up_vote": 0, "down_vote": 0, "favourite": 0, "created": "..."}]}
+
+CSV with a header row, questions only: title, question, asked_by, tags (separated by `|`), created, up_vote,
+down_vote.
+"""
+import csv
+import datetime
+import json
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Case, DateTimeField, F, Max, Value, When
+from django.utils import six, timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core import profiles, search
+from core.models import Question, Answer, Profile, ImportCheckpoint
+from core.signals import questions_imported
+from core.tags import add_question_counts, resolve_tags
+
+User = get_user_model()
+
+FORMATS = ('jsonl', 'csv')
+CSV_TAG_SEPARATOR = '|'
+# Stays below the 999 bound parameters SQLite allows in one statement
+LOOKUP_BATCH_SIZE = 500
+
+
+class LineReader(object):
+    """
+    Lines of a binary stream, keeping track of the byte offset after the last line handed out
+    """
+
+    def __init__(self, stream, offset=0, decode=False):
+        self.stream = stream
+        self.offset = offset
+        self.decode = decode
+        stream.seek(offset)
+
+    def seek(self, offset):
+        self.stream.seek(offset)
+        self.offset = offset
+
+    def __iter__(self):
+        for line in iter(self.stream.readline, b''):
+            self.offset += len(line)
+            yield line.decode('utf-8') if self.decode else line
+
+
+def read_jsonl(stream, offset=0):
+    """
+    Yields (record, offset after it) from `offset` on
+    """
+    lines = LineReader(stream, offset)
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line.decode('utf-8')), lines.offset
+
+
+def read_csv(stream, offset=0):
+    """
+    Yields (record, offset after it) from `offset` on, the header row is read first wherever that is
+    """
+    # The csv module of Python 2 only reads bytes
+    lines = LineReader(stream, decode=six.PY3)
+    rows = csv.reader(iter(lines))
+    header = [cell.strip() for cell in decoded(next(rows, []))]
+    if offset > lines.offset:
+        lines.seek(offset)
+    for row in rows:
+        if any(row):
+            yield dict(zip(header, decoded(row))), lines.offset
+
+
+def decoded(row):
+    return [cell.decode('utf-8') for cell in row] if six.PY2 else row
+
+
+def read_records(stream, format, offset=0):
+    return read_jsonl(stream, offset) if format == 'jsonl' else read_csv(stream, offset)
+
+
+def parse_created(value):
+    created = (parse_datetime(value) or parse_date(value)) if value else None
+    if created is None:
+        return timezone.now()
+    if not isinstance(created, datetime.datetime):
+        created = datetime.datetime.combine(created, datetime.time())
+    return timezone.make_aware(created) if timezone.is_naive(created) else created
+
+
+def normalize(record):
+    """
+    The fields of a question record with defaults filled in, from either format
+    """
+    tags = record.get('tags') or []
+    if isinstance(tags, six.string_types):
+        tags = tags.split(CSV_TAG_SEPARATOR)
+    answers = [{
+        'ref': six.text_type(answer['ref']) if answer.get('ref') is not None else None,
+        'parent': six.text_type(answer['parent']) if answer.get('parent') is not None else None,
+        'answer': answer.get('answer') or '',
+        'answer_by': answer.get('answer_by') or None,
+        'accepted': bool(answer.get('accepted')),
+        'up_vote': int(answer.get('up_vote') or 0),
+        'down_vote': int(answer.get('down_vote') or 0),
+        'favourite': int(answer.get('favourite') or 0),
+        'created': parse_created(answer.get('created')),
+    } for answer in record.get('answers') or []]
+    return {
+        'title': (record.get('title') or '')[:Question._meta.get_field('title').max_length],
+        'question': record.get('question') or '',
+        'asked_by': record.get('asked_by') or None,
+        'tags': sorted(set(tag.strip() for tag in tags if tag.strip())),
+        'up_vote': int(record.get('up_vote') or 0),
+        'down_vote': int(record.get('down_vote') or 0),
+        'created': parse_created(record.get('created')),
+        'answers': answers,
+    }
+
+
+def batches(values, size=LOOKUP_BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def resolve_profiles(usernames, create=False):
+    """
+    {username: profile id}. Unknown users are left out unless `create`, then they get a user with an unusable
+    password and an empty profile
+    """
+    usernames = set(usernames)
+    profiles = {}
+    for batch in batches(usernames):
+        profiles.update(Profile.objects.filter(user__username__in=batch).values_list('user__username', 'id'))
+    missing = usernames.difference(profiles)
+    if not create or not missing:
+        return profiles
+    users = {}
+    for batch in batches(missing):
+        users.update(User.objects.filter(username__in=batch).values_list('username', 'id'))
+    User.objects.bulk_create([User(username=username, password=make_password(None))
+                              for username in missing.difference(users)])
+    for batch in batches(missing.difference(users)):
+        users.update(User.objects.filter(username__in=batch).values_list('username', 'id'))
+    Profile.objects.bulk_create([Profile(user_id=user_id) for user_id in users.values()])
+    for batch in batches(missing):
+        profiles.update(Profile.objects.filter(user__username__in=batch).values_list('user__username', 'id'))
+    return profiles
+
+
+def allocate_ids(model, objects):
+    """
+    Only Postgres hands back the ids of a bulk insert, on other backends the ids are assigned up front.
+    A concurrent insert into the same table then fails the chunk with an IntegrityError, resuming retries it.
+    """
+    if connection.features.can_return_ids_from_bulk_insert or not objects:
+        return
+    start = (model.objects.aggregate(last_id=Max('id'))['last_id'] or 0) + 1
+    for offset, obj in enumerate(objects):
+        obj.id = start + offset
+
+
+def bulk_insert(model, objects):
+    """
+    Inserts `TimeStampedModel` instances keeping their `created` and `modified`
+    """
+    allocate_ids(model, objects)
+    created = [obj.created for obj in objects]
+    for obj in objects:
+        obj.update_modified = False
+    model.objects.bulk_create(objects)
+    # `created` is an auto_now_add field, which an insert always sets to now
+    for batch in batches(zip(objects, created), size=LOOKUP_BATCH_SIZE // 2):
+        model.objects.filter(id__in=[obj.id for obj, value in batch]).update(created=Case(
+            *[When(id=obj.id, then=Value(value)) for obj, value in batch], output_field=DateTimeField()))
+    for obj, value in zip(objects, created):
+        obj.created = value
+
+
+def insert_answers(records, profile_ids):
+    """
+    Inserts the answers of the records level by level, so replies can point at the parents inserted before them
+
+    :returns: [[Answer, ...] of each record]
+    """
+    answers = []
+    pending = []
+    for record in records:
+        refs = set(answer['ref'] for answer in record['answers'] if answer['ref'] is not None)
+        by_ref = {}
+        objects = []
+        for answer in record['answers']:
+            obj = Answer(answer=answer['answer'], answer_by_id=profile_ids.get(answer['answer_by']),
+                         accepted_or_not=answer['accepted'], up_vote=answer['up_vote'],
+                         down_vote=answer['down_vote'], favourite=answer['favourite'],
+                         created=answer['created'], modified=answer['created'])
+            if answer['ref'] is not None:
+                by_ref.setdefault(answer['ref'], obj)
+            parent = answer['parent'] if answer['parent'] in refs and answer['parent'] != answer['ref'] else None
+            objects.append(obj)
+            pending.append((obj, by_ref, parent))
+        answers.append(objects)
+    while pending:
+        level = [(obj, by_ref, parent) for obj, by_ref, parent in pending
+                 if parent is None or by_ref[parent].id is not None]
+        if not level:
+            # What's left only refers to itself in a cycle, those become top level answers
+            level = [(obj, by_ref, None) for obj, by_ref, parent in pending]
+        for obj, by_ref, parent in level:
+            obj.parent_id = by_ref[parent].id if parent is not None else None
+        inserted = set(id(obj) for obj, by_ref, parent in level)
+        bulk_insert(Answer, [obj for obj, by_ref, parent in level])
+        pending = [entry for entry in pending if id(entry[0]) not in inserted]
+    return answers
+
+
+@transaction.atomic
+def import_chunk(checkpoint_id, records, position, create_profiles=False):
+    """
+    Writes the records and moves the checkpoint to `position`, all or nothing
+
+    :returns: (ids of the new questions, number of answers)
+    """
+    tag_ids = resolve_tags(tag for record in records for tag in record['tags'])
+    profile_ids = resolve_profiles(set(record['asked_by'] for record in records if record['asked_by']) |
+                                   set(answer['answer_by'] for record in records for answer in record['answers']
+                                       if answer['answer_by']), create=create_profiles)
+    answers = insert_answers(records, profile_ids)
+    questions = []
+    for record, record_answers in zip(records, answers):
+        accepted = [answer.id for answer in record_answers if answer.accepted_or_not]
+        questions.append(Question(
+            title=record['title'], question=record['question'], asked_by_id=profile_ids.get(record['asked_by']),
+            up_vote=record['up_vote'], down_vote=record['down_vote'], answer_count=len(record_answers),
+            accepted_answer_id=accepted[-1] if accepted else None,
+            created=record['created'], modified=record['created'],
+            last_activity_at=max([record['created']] + [answer['created'] for answer in record['answers']])))
+    bulk_insert(Question, questions)
+    Question.answer.through.objects.bulk_create([
+        Question.answer.through(question_id=question.id, answer_id=answer.id)
+        for question, record_answers in zip(questions, answers) for answer in record_answers])
+    # Names sharing a slug resolve to the same tag
+    tag_links = [Question.tag.through(question_id=question.id, tag_id=tag_id)
+                 for question, record in zip(questions, records)
+                 for tag_id in set(tag_ids[tag] for tag in record['tags'] if tag in tag_ids)]
+    Question.tag.through.objects.bulk_create(tag_links)
+    add_question_counts(Counter(link.tag_id for link in tag_links))
+    search.index_documents({
+        question.id: search.compose_document(question.title, question.question, record['tags'],
+                                             [answer.answer for answer in record_answers])
+        for question, record, record_answers in zip(questions, records, answers)})
+    answer_count = sum(len(record_answers) for record_answers in answers)
+    profiles.profiles_changed(profile_ids.values())
+    ImportCheckpoint.objects.filter(id=checkpoint_id).update(
+        position=position, questions=F('questions') + len(questions), answers=F('answers') + answer_count,
+        modified=timezone.now())
+    return [question.id for question in questions], answer_count
+
+
+def import_questions(stream, name, format='jsonl', chunk_size=1000, create_profiles=False, restart=False):
+    """
+    Imports the records of a binary stream, resuming from the checkpoint called `name` unless `restart`.
+    Only one chunk of records is held in memory at a time.
+
+    Yields (questions, answers) imported by each chunk once it's committed
+    """
+    checkpoint, created = ImportCheckpoint.objects.get_or_create(name=name)
+    if restart and not created:
+        ImportCheckpoint.objects.filter(id=checkpoint.id).update(position=0, questions=0, answers=0)
+        checkpoint.position = 0
+    chunk = []
+    position = checkpoint.position
+    for record, position in read_records(stream, format, checkpoint.position):
+        chunk.append(normalize(record))
+        if len(chunk) >= chunk_size:
+            yield _import_chunk(checkpoint.id, chunk, position, create_profiles)
+            chunk = []
+    if chunk:
+        yield _import_chunk(checkpoint.id, chunk, position, create_profiles)
+
+
+def _import_chunk(checkpoint_id, records, position, create_profiles):
+    question_ids, answer_count = import_chunk(checkpoint_id, records, position, create_profiles)
+    questions_imported.send(sender=Question, question_ids=question_ids)
+    return len(question_ids), answer_count
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import reputation
+
+
+class Command(BaseCommand):
+    help = 'Apply new reputation events to the profiles every REPUTATION_APPLY_INTERVAL seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=settings.REPUTATION_APPLY_INTERVAL,
+                            help='Seconds between two runs')
+        parser.add_argument('--batch-size', type=int, default=settings.REPUTATION_APPLY_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Apply once and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.time()
+            applied = reputation.apply_events(options['batch_size'])
+            if applied or options['verbosity'] > 1:
+                self.stdout.write('Applied {count} reputation events in {seconds:.2f}s'.format(
+                    count=applied, seconds=time.time() - started))
+            if options['once']:
+                return
+            time.sleep(max(0, options['interval'] - (time.time() - started)))
@@ -0,0 +1,36 @@
+import io
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import exporter
+
+
+class Command(BaseCommand):
+    help = 'Stream questions, answers, tags and profiles into one file per dataset, see `core.exporter`'
+
+    def add_arguments(self, parser):
+        parser.add_argument('datasets', nargs='*', help='Any of {datasets}, defaults to all of them'.format(
+            datasets=', '.join(exporter.DATASETS)))
+        parser.add_argument('--format', choices=exporter.FORMATS, default='jsonl')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output-dir', default='.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        unknown = set(options['datasets']).difference(exporter.DATASETS)
+        if unknown:
+            raise CommandError('Unknown datasets: {datasets}'.format(datasets=', '.join(sorted(unknown))))
+        if not os.path.isdir(options['output_dir']):
+            raise CommandError('{path} is not a directory'.format(path=options['output_dir']))
+        for dataset in options['datasets'] or exporter.DATASETS:
+            started = time.time()
+            path = os.path.join(options['output_dir'], exporter.filename(dataset, options['format'], options['gzip']))
+            # Written next to the final file first, so a failed export never replaces the previous one
+            with io.open(path + '.part', 'wb') as output:
+                for block in exporter.export(dataset, options['format'], options['gzip'], options['chunk_size']):
+                    output.write(block)
+            os.rename(path + '.part', path)
+            self.stdout.write('Exported {dataset} to {path} in {seconds:.1f}s'.format(
+                dataset=dataset, path=path, seconds=time.time() - started))
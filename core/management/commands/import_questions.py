@@ -0,0 +1,46 @@
+import io
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import importer
+
+
+class Command(BaseCommand):
+    help = ('Bulk import questions with their answers and tags from a JSONL or CSV dump, see `core.importer` '
+            'for the formats. Re-running the same import resumes after the last committed chunk')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=importer.FORMATS,
+                            help='Defaults to the extension of the file, jsonl if it is neither')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Questions per transaction')
+        parser.add_argument('--name', help='Checkpoint to resume from, defaults to the absolute path')
+        parser.add_argument('--restart', action='store_true', help='Start over instead of resuming')
+        parser.add_argument('--create-profiles', action='store_true',
+                            help='Create a user and profile for authors that don\'t exist instead of leaving '
+                                 'their questions and answers without one')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError('{path} is not a file'.format(path=path))
+        format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        name = options['name'] or os.path.abspath(path)
+        started = time.time()
+        questions = answers = 0
+        with io.open(path, 'rb') as stream:
+            for chunk_questions, chunk_answers in importer.import_questions(
+                    stream, name, format=format, chunk_size=options['chunk_size'],
+                    create_profiles=options['create_profiles'], restart=options['restart']):
+                questions += chunk_questions
+                answers += chunk_answers
+                if options['verbosity'] > 0:
+                    self.stdout.write(self.progress(questions, answers, started))
+        self.stdout.write('Imported ' + self.progress(questions, answers, started))
+
+    def progress(self, questions, answers, started):
+        elapsed = max(time.time() - started, 1e-6)
+        return '{questions} questions, {answers} answers, {rate:.0f} rows/s'.format(
+            questions=questions, answers=answers, rate=(questions + answers) / elapsed)
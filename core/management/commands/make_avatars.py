@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import avatars
+
+
+class Command(BaseCommand):
+    help = 'Make the missing avatar thumbnails over the AVATAR_WORKERS threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='everything',
+                            help='Make every thumbnail again, after AVATAR_SIZES changed')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        made = avatars.process_all(options['everything'])
+        self.stdout.write('Made the thumbnails of {count} avatars in {seconds:.2f}s'.format(
+            count=made, seconds=time.time() - started))
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import ranking
+
+
+class Command(BaseCommand):
+    help = 'Score the questions voted on or answered since the last run every HOT_RANK_INTERVAL seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=settings.HOT_RANK_INTERVAL,
+                            help='Seconds between two runs')
+        parser.add_argument('--batch-size', type=int, default=settings.HOT_RANK_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Score once and exit')
+        parser.add_argument('--full', action='store_true',
+                            help='Rescore every question once and exit, after the HOT_SCORE_* settings changed')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            started = time.time()
+            changed = ranking.rank_all(options['batch_size'])
+            self.stdout.write('Rescored {count} questions in {seconds:.2f}s'.format(
+                count=changed, seconds=time.time() - started))
+            return
+        while True:
+            started = time.time()
+            ranked = ranking.rank_questions(options['batch_size'])
+            if ranked or options['verbosity'] > 1:
+                self.stdout.write('Scored {count} questions in {seconds:.2f}s'.format(
+                    count=ranked, seconds=time.time() - started))
+            if options['once']:
+                return
+            time.sleep(max(0, options['interval'] - (time.time() - started)))
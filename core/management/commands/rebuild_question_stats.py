@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import threads
+from core.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Recompute answer_count, accepted_answer and last_activity_at of every question from its answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report the drift, exit with an error if any')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        last_id, checked, drifted = 0, 0, 0
+        while True:
+            questions = list(Question.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'answer_count', 'accepted_answer_id', 'last_activity_at')[:options['chunk_size']])
+            if not questions:
+                break
+            expected = threads.compute_question_stats([question[0] for question in questions])
+            for question_id, answer_count, accepted_answer_id, last_activity_at in questions:
+                stats = expected[question_id]
+                if (answer_count, accepted_answer_id) == stats[:2] and last_activity_at >= stats[2]:
+                    continue
+                drifted += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write('Question {id}: {stored} != {expected}'.format(
+                        id=question_id, stored=(answer_count, accepted_answer_id, last_activity_at),
+                        expected=stats))
+                if not options['check']:
+                    Question.objects.filter(id=question_id).update(
+                        answer_count=stats[0], accepted_answer_id=stats[1],
+                        last_activity_at=max(stats[2], last_activity_at), ranked=False)
+            checked += len(questions)
+            last_id = questions[-1][0]
+        message = '{drifted} of {checked} questions drifted'.format(drifted=drifted, checked=checked)
+        if options['check'] and drifted:
+            raise CommandError(message)
+        self.stdout.write(message if options['check'] else message + ', rebuilt')
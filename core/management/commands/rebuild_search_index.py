@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+from core.models import Question
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the search document of every question, e.g. after changing SEARCH_INCLUDE_ANSWERS, and the '
+            'full-text index after changing SEARCH_CONFIG')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        last_id, total = 0, 0
+        while True:
+            questions = list(Question.objects.filter(id__gt=last_id).order_by('id')[:options['chunk_size']])
+            if not questions:
+                break
+            for question in questions:
+                search.index_question(question)
+            last_id = questions[-1].id
+            total += len(questions)
+        search.reset_fallback_index()
+        self.stdout.write('Indexed {total} questions'.format(total=total))
+        if search.rebuild_full_text_index():
+            self.stdout.write('Created the full-text index with {config}'.format(config=search.search_config()))
@@ -0,0 +1,22 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import reputation
+
+
+class Command(BaseCommand):
+    help = ('Rescore every profile from all of its reputation events with the current REPUTATION_WEIGHTS, '
+            'a range of profiles per transaction over a pool of processes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='Processes, defaults to one per CPU')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Profiles per transaction')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        changed = reputation.recompute(options['workers'], options['chunk_size'])
+        self.stdout.write('Recomputed reputation, {count} profiles changed in {seconds:.2f}s'.format(
+            count=changed, seconds=time.time() - started))
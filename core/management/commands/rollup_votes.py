@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import votes
+
+
+class Command(BaseCommand):
+    help = 'Roll the vote ledger up into the question/answer counters every VOTE_ROLLUP_INTERVAL seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=settings.VOTE_ROLLUP_INTERVAL,
+                            help='Seconds between two rollups')
+        parser.add_argument('--batch-size', type=int, default=settings.VOTE_ROLLUP_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Roll up once and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.time()
+            rolled_up = votes.rollup_votes(options['batch_size'])
+            if rolled_up or options['verbosity'] > 1:
+                self.stdout.write('Rolled up {count} votes in {seconds:.2f}s'.format(
+                    count=rolled_up, seconds=time.time() - started))
+            if options['once']:
+                return
+            time.sleep(max(0, options['interval'] - (time.time() - started)))
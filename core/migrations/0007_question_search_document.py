@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-18 17:41
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+SEARCH_INDEX_NAME = 'core_questionsearchdocument_fts'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        # With the config the queries use, see core/search.py
+        schema_editor.execute(
+            "CREATE INDEX {name} ON core_questionsearchdocument USING gin (to_tsvector('{config}', document))".format(
+                name=SEARCH_INDEX_NAME, config=getattr(settings, 'SEARCH_CONFIG', 'english')))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS {name}'.format(name=SEARCH_INDEX_NAME))
+
+
+def build_search_documents(apps, schema_editor):
+    Question = apps.get_model('core', 'Question')
+    QuestionSearchDocument = apps.get_model('core', 'QuestionSearchDocument')
+    last_id = 0
+    while True:
+        questions = list(Question.objects.filter(id__gt=last_id).order_by('id').prefetch_related('tag')[:1000])
+        if not questions:
+            break
+        QuestionSearchDocument.objects.bulk_create([
+            QuestionSearchDocument(question_id=question.id, document=u'\n'.join(
+                [question.title, question.question] + [tag.name for tag in question.tag.all()]))
+            for question in questions
+        ])
+        last_id = questions[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_question_answer_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionSearchDocument',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='core.Question')),
+                ('document', models.TextField(blank=True, help_text=b'Text the question is searched by')),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(build_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-18 17:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_question_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('direction', models.SmallIntegerField(choices=[(1, b'Up-vote'), (-1, b'Down-vote')])),
+                ('counted_direction', models.SmallIntegerField(default=0, help_text=b'Direction the counters currently include')),
+                ('rolled_up', models.BooleanField(db_index=True, default=False, help_text=b'Whether the counters of the target include this vote')),
+                ('answer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='vote_answer', to='core.Answer')),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='vote_question', to='core.Question')),
+                ('voter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_voter', to='core.Profile')),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'abstract': False,
+                'get_latest_by': 'modified',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set([('voter', 'answer'), ('voter', 'question')]),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-18 17:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def build_question_stats(apps, schema_editor):
+    Question = apps.get_model('core', 'Question')
+    Answer = apps.get_model('core', 'Answer')
+    last_id = 0
+    while True:
+        rows = list(Question.objects.filter(id__gt=last_id).order_by('id').annotate(
+            num_answers=models.Count('answer'), last_answer_at=models.Max('answer__created')).values_list(
+            'id', 'modified', 'num_answers', 'last_answer_at')[:1000])
+        if not rows:
+            break
+        accepted = dict(Answer.objects.filter(question_answer__in=[row[0] for row in rows], accepted_or_not=True)
+                        .order_by('-id').values_list('question_answer', 'id'))
+        for question_id, modified, num_answers, last_answer_at in rows:
+            Question.objects.filter(id=question_id).update(
+                answer_count=num_answers, accepted_answer_id=accepted.get(question_id),
+                last_activity_at=max(modified, last_answer_at or modified))
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_vote_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='accepted_answer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='question_accepted_answer', to='core.Answer'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='answer_count',
+            field=models.IntegerField(default=0, help_text=b'Number of answers, maintained along with `answer`'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='last_activity_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text=b'Last time the question was edited, answered or accepted'),
+        ),
+        migrations.RunPython(build_question_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-18 17:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_tag_questions(apps, schema_editor):
+    Tag = apps.get_model('core', 'Tag')
+    counts = Tag.objects.order_by().annotate(num_questions=models.Count('question_tag')).values_list(
+        'id', 'num_questions')
+    for tag_id, num_questions in counts:
+        if num_questions:
+            Tag.objects.filter(id=tag_id).update(question_count=num_questions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='question_count',
+            field=models.IntegerField(default=0, help_text=b'Number of questions tagged with it, maintained along with `Question.tag`'),
+        ),
+        migrations.RunPython(count_tag_questions, migrations.RunPython.noop),
+    ]
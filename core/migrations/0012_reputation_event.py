@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-18 18:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+def record_past_events(apps, schema_editor):
+    """
+    Events for what already happened, marked as applied: `manage.py recompute_reputation` rescores the profiles
+    from them
+    """
+    Question = apps.get_model('core', 'Question')
+    Vote = apps.get_model('core', 'Vote')
+    ReputationEvent = apps.get_model('core', 'ReputationEvent')
+    kinds = {('question', 1): 'question_up_voted', ('question', -1): 'question_down_voted',
+             ('answer', 1): 'answer_up_voted', ('answer', -1): 'answer_down_voted'}
+
+    def events():
+        for question_id, profile_id in Question.objects.exclude(asked_by=None).values_list('id', 'asked_by_id'):
+            yield ReputationEvent(profile_id=profile_id, kind='question_asked', question_id=question_id)
+        votes = Vote.objects.values_list('voter_id', 'direction', 'question_id', 'question__asked_by_id',
+                                         'answer_id', 'answer__answer_by_id')
+        for voter_id, direction, question_id, asker_id, answer_id, author_id in votes:
+            profile_id = asker_id if question_id else author_id
+            if profile_id and profile_id != voter_id:
+                kind = kinds['question' if question_id else 'answer', direction]
+                yield ReputationEvent(profile_id=profile_id, actor_id=voter_id, question_id=question_id,
+                                      answer_id=answer_id, kind=kind)
+        accepted = Question.answer.through.objects.filter(answer__accepted_or_not=True).values_list(
+            'question_id', 'question__asked_by_id', 'answer_id', 'answer__answer_by_id')
+        for question_id, asker_id, answer_id, author_id in accepted:
+            if author_id and author_id != asker_id:
+                yield ReputationEvent(profile_id=author_id, actor_id=asker_id, question_id=question_id,
+                                      answer_id=answer_id, kind='answer_accepted')
+
+    batch = []
+    for event in events():
+        event.applied = True
+        batch.append(event)
+        if len(batch) >= 500:
+            ReputationEvent.objects.bulk_create(batch)
+            batch = []
+    ReputationEvent.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_tag_question_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReputationEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('kind', models.CharField(choices=[(b'question_asked', b'Question asked'), (b'question_up_voted', b'Question up-voted'), (b'question_down_voted', b'Question down-voted'), (b'answer_up_voted', b'Answer up-voted'), (b'answer_down_voted', b'Answer down-voted'), (b'answer_accepted', b'Answer accepted')], max_length=32)),
+                ('count', models.SmallIntegerField(default=1)),
+                ('applied', models.BooleanField(db_index=True, default=False, help_text=b'Whether the reputation of the profile includes this event')),
+                ('actor', models.ForeignKey(blank=True, help_text=b'Profile that voted or accepted', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.Profile')),
+                ('answer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.Answer')),
+                ('profile', models.ForeignKey(help_text=b'Profile credited', on_delete=django.db.models.deletion.CASCADE, related_name='reputation_events', to='core.Profile')),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.Question')),
+            ],
+            options={
+                'ordering': ('-modified', '-created'),
+                'abstract': False,
+                'get_latest_by': 'modified',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='reputationevent',
+            index_together=set([('profile', 'kind')]),
+        ),
+        migrations.RunPython(record_past_events, migrations.RunPython.noop),
+    ]
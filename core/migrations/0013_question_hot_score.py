@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.18 on 2026-10-18 18:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_reputation_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='hot_score',
+            field=models.FloatField(default=0, help_text=b'Time decayed votes and answers, see `core.ranking`'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='ranked',
+            field=models.BooleanField(db_index=True, default=False, help_text=b'Whether `hot_score` is up to date with the votes and answers'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=[b'-hot_score', b'-id'], name=b'question_hot_score_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=[b'answer_count', b'-created', b'-id'], name=b'question_unanswered_idx'),
+        ),
+    ]
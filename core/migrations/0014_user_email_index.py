@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import IntegrityError, migrations
+from django.db.models import Count
+from django.db.models.functions import Upper
+
+EMAIL_INDEX_NAME = 'auth_user_email_ci_uniq'
+
+
+def email_index_sql(apps, schema_editor):
+    """
+    A unique index on the case folded email of the users who have one, matching the `email__iexact` lookup of
+    each backend, or None on the others
+    """
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    table = schema_editor.quote_name(User._meta.db_table)
+    email = schema_editor.quote_name(User._meta.get_field('email').column)
+    name = schema_editor.quote_name(EMAIL_INDEX_NAME)
+    if schema_editor.connection.vendor == 'postgresql':
+        return "CREATE UNIQUE INDEX {name} ON {table} (UPPER({email}::text)) WHERE {email} <> ''".format(
+            name=name, table=table, email=email)
+    if schema_editor.connection.vendor == 'sqlite':
+        return "CREATE UNIQUE INDEX {name} ON {table} ({email} COLLATE NOCASE) WHERE {email} <> ''".format(
+            name=name, table=table, email=email)
+    return None
+
+
+def check_duplicate_emails(apps, schema_editor):
+    """
+    Stops before the index if users share an email up to case (sign-ups only ever compared it exactly), listing
+    them: which of the accounts keeps the address is for an admin to decide
+    """
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    users = User.objects.exclude(email='').exclude(email__isnull=True).annotate(folded_email=Upper('email'))
+    folded = users.values('folded_email').annotate(users=Count('id')).filter(users__gt=1).values_list(
+        'folded_email', flat=True)
+    duplicates = list(users.filter(folded_email__in=list(folded)).order_by('folded_email', 'id').values_list(
+        'id', 'username', 'email'))
+    if duplicates:
+        raise IntegrityError(
+            'Users share an email up to case, give all but one of each of them another email and migrate again:\n' +
+            '\n'.join('{} {} {}'.format(*user) for user in duplicates))
+
+
+def create_email_index(apps, schema_editor):
+    sql = email_index_sql(apps, schema_editor)
+    if sql:
+        schema_editor.execute(sql)
+
+
+def drop_email_index(apps, schema_editor):
+    if email_index_sql(apps, schema_editor):
+        schema_editor.execute('DROP INDEX IF EXISTS {name}'.format(name=schema_editor.quote_name(EMAIL_INDEX_NAME)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0013_question_hot_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
@@ -1,3 +1,7 @@
 from .user_profile import Profile
 from .question_answer import Question, Answer
 from .utils import Tag
+from .search import QuestionSearchDocument
+from .vote import Vote
+from .imports import ImportCheckpoint
+from .reputation import ReputationEvent
@@ -0,0 +1,14 @@
+from django_extensions.db.models import TimeStampedModel, models
+
+
+class ImportCheckpoint(TimeStampedModel):
+    """
+    How far `core.importer` got through an input, written in the same transaction as the rows of each chunk
+    """
+    name = models.CharField(max_length=255, unique=True, help_text='Input the import reads, its path by default')
+    position = models.BigIntegerField(default=0, help_text='Byte offset after the last committed record')
+    questions = models.BigIntegerField(default=0)
+    answers = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return u"{name}@{position}".format(name=self.name, position=self.position)
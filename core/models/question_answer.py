@@ -1,6 +1,46 @@
+from django.utils import timezone
 from django_extensions.db.models import TimeStampedModel, models
 
 
+class QuestionQuerySet(models.QuerySet):
+    LISTING_SORTS = {
+        'hot': ('-hot_score', '-id'),
+        'top': ('-up_vote', '-created', '-id'),
+        'new': ('-created', '-id'),
+        'unanswered': ('-created', '-id'),
+    }
+    DEFAULT_LISTING_SORT = 'new'
+    # The `ordering` parameter the listings took before `sort`
+    LISTING_ORDERINGS = {
+        'newest': 'new',
+        'votes': 'top',
+    }
+
+    @classmethod
+    def listing_sort(cls, sort=None, ordering=None):
+        """
+        The sort named by `sort`, or else by the older `ordering`, or the default one
+        """
+        if sort in cls.LISTING_SORTS:
+            return sort
+        return cls.LISTING_ORDERINGS.get(ordering, cls.DEFAULT_LISTING_SORT)
+
+    def sorted_by(self, sort):
+        """
+        The questions of the `sort` listing in its order, each one served by an index
+        """
+        queryset = self.filter(answer_count=0) if sort == 'unanswered' else self
+        return queryset.order_by(*self.LISTING_SORTS[sort])
+
+    def for_listing(self, sort=None):
+        """
+        Only the columns rendered by `home.html`, with `asked_by` joined in the same query
+        """
+        return self.select_related('asked_by').only(
+            'id', 'title', 'question', 'up_vote', 'down_vote', 'answer_count', 'hot_score', 'created',
+            'asked_by__id').sorted_by(self.listing_sort(sort))
+
+
 class Question(TimeStampedModel):
     title = models.CharField(max_length=225)
     question = models.TextField("Question")
@@ -11,6 +51,24 @@ class Question(TimeStampedModel):
     asked_by = models.ForeignKey("Profile", on_delete=models.SET_NULL, null=True, related_name='question_asked_by')
     up_vote = models.IntegerField("Up-vote", default=0)
     down_vote = models.IntegerField("Up-vote", default=0)
+    answer_count = models.IntegerField(default=0, help_text='Number of answers, maintained along with `answer`')
+    accepted_answer = models.ForeignKey("Answer", on_delete=models.SET_NULL, null=True, blank=True,
+                                        related_name='question_accepted_answer')
+    last_activity_at = models.DateTimeField(default=timezone.now, db_index=True,
+                                            help_text='Last time the question was edited, answered or accepted')
+    hot_score = models.FloatField(default=0, help_text='Time decayed votes and answers, see `core.ranking`')
+    ranked = models.BooleanField(default=False, db_index=True,
+                                 help_text='Whether `hot_score` is up to date with the votes and answers')
+
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['-created', '-id'], name='question_created_id_idx'),
+            models.Index(fields=['-up_vote', '-created', '-id'], name='question_votes_created_id_idx'),
+            models.Index(fields=['-hot_score', '-id'], name='question_hot_score_id_idx'),
+            models.Index(fields=['answer_count', '-created', '-id'], name='question_unanswered_idx'),
+        ]
 
     def __str__(self):
         return 'u{id}_{title}'.format(id=self.id, title=self.title)
@@ -26,5 +84,10 @@ class Answer(TimeStampedModel):
     accepted_or_not = models.BooleanField(default=False, help_text='User can accept the answer')
     favourite = models.IntegerField(default=0, help_text='User can like the answer')
 
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['-created', '-id'], name='answer_created_id_idx'),
+        ]
+
     def __str__(self):
         return 'u{id}'.format(id=self.id)
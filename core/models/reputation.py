@@ -0,0 +1,40 @@
+from django_extensions.db.models import TimeStampedModel, models
+
+
+class ReputationEvent(TimeStampedModel):
+    """
+    Append-only ledger of what earned or cost a profile reputation. `count` is 1, or -1 for an event taken back
+    (an up vote turned into a down vote). `Profile.reputation` is the weighted sum of the events of the profile,
+    see `core.reputation`
+    """
+    QUESTION_ASKED = 'question_asked'
+    QUESTION_UP_VOTED = 'question_up_voted'
+    QUESTION_DOWN_VOTED = 'question_down_voted'
+    ANSWER_UP_VOTED = 'answer_up_voted'
+    ANSWER_DOWN_VOTED = 'answer_down_voted'
+    ANSWER_ACCEPTED = 'answer_accepted'
+    KINDS = (
+        (QUESTION_ASKED, 'Question asked'),
+        (QUESTION_UP_VOTED, 'Question up-voted'),
+        (QUESTION_DOWN_VOTED, 'Question down-voted'),
+        (ANSWER_UP_VOTED, 'Answer up-voted'),
+        (ANSWER_DOWN_VOTED, 'Answer down-voted'),
+        (ANSWER_ACCEPTED, 'Answer accepted'),
+    )
+
+    profile = models.ForeignKey("Profile", on_delete=models.CASCADE, related_name='reputation_events',
+                                help_text='Profile credited')
+    kind = models.CharField(max_length=32, choices=KINDS)
+    count = models.SmallIntegerField(default=1)
+    actor = models.ForeignKey("Profile", on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                              help_text='Profile that voted or accepted')
+    question = models.ForeignKey("Question", on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    answer = models.ForeignKey("Answer", on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    applied = models.BooleanField(default=False, db_index=True,
+                                  help_text='Whether the reputation of the profile includes this event')
+
+    class Meta(TimeStampedModel.Meta):
+        index_together = (('profile', 'kind'),)
+
+    def __str__(self):
+        return u"{profile}_{kind}_{count}".format(profile=self.profile_id, kind=self.kind, count=self.count)
@@ -0,0 +1,14 @@
+from django.db import models
+
+
+class QuestionSearchDocument(models.Model):
+    """
+    Denormalized text of a question (title, body, tags and optionally answers) that the search index is built on
+    """
+    question = models.OneToOneField("Question", on_delete=models.CASCADE, primary_key=True,
+                                    related_name='search_document')
+    document = models.TextField(blank=True, help_text='Text the question is searched by')
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return u"{id}".format(id=self.question_id)
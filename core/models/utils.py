@@ -4,7 +4,10 @@ from django_extensions.db.fields import AutoSlugField
 
 class Tag(models.Model):
     name = models.CharField("Tag Name", help_text="Name of the tag", max_length=200)
-    slug = AutoSlugField(populate_from='name', unique=True)
+    # A slug given on insert is kept, `core.tags.resolve_tags` works them out for a whole batch of new tags
+    slug = AutoSlugField(populate_from='name', unique=True, overwrite_on_add=False)
+    question_count = models.IntegerField(default=0, help_text='Number of questions tagged with it, maintained '
+                                                              'along with `Question.tag`')
 
     def __str__(self):
         return u"{id}_{name}".format(id=self.id, name=self.slug)
@@ -0,0 +1,27 @@
+from django_extensions.db.models import TimeStampedModel, models
+
+
+class Vote(TimeStampedModel):
+    """
+    Ledger of who voted on what. A profile has at most one vote per question/answer, the up_vote/down_vote
+    counters of the target are rolled up from here by `core.votes.rollup_votes`
+    """
+    UP = 1
+    DOWN = -1
+    DIRECTIONS = ((UP, 'Up-vote'), (DOWN, 'Down-vote'))
+
+    voter = models.ForeignKey("Profile", on_delete=models.CASCADE, related_name='vote_voter')
+    question = models.ForeignKey("Question", on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='vote_question')
+    answer = models.ForeignKey("Answer", on_delete=models.CASCADE, null=True, blank=True, related_name='vote_answer')
+    direction = models.SmallIntegerField(choices=DIRECTIONS)
+    counted_direction = models.SmallIntegerField(default=0, help_text='Direction the counters currently include')
+    rolled_up = models.BooleanField(default=False, db_index=True,
+                                    help_text='Whether the counters of the target include this vote')
+
+    class Meta(TimeStampedModel.Meta):
+        unique_together = (('voter', 'question'), ('voter', 'answer'))
+
+    def __str__(self):
+        return u"{voter}_{direction}_{target}".format(voter=self.voter_id, direction=self.direction,
+                                                       target=self.question_id or self.answer_id)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+The profile of the signed-in user and the activity numbers of a profile, both cached.
+
+`profile_stats` reads the reputation of a profile and counts its questions, answers and accepted answers in a
+single query of correlated subqueries, the numbers are then cached until the profile writes something.
+`request_profile` looks up the profile of the signed-in user once per request, and keeps it in the cache
+between requests until the profile or its user is saved.
+
+Both live in `PROFILE_CACHE` for at most `PROFILE_CACHE_TIMEOUT` seconds. Their entries are dropped as soon as
+something changes and once more when the transaction commits, so a reader racing the write can't keep the old
+values around. A cache living in each process (LocMem) can't have its entries dropped by the other workers,
+with one nothing is cached.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from core.cache import shared_cache
+from core.models import Profile, Question, Answer
+
+ProfileStats = namedtuple('ProfileStats', ('questions', 'answers', 'accepted_answers', 'reputation'))
+
+
+def cache():
+    return shared_cache(getattr(settings, 'PROFILE_CACHE', 'default'))
+
+
+def timeout():
+    return getattr(settings, 'PROFILE_CACHE_TIMEOUT', 600)
+
+
+def stats_key(profile_id):
+    return 'profile:stats:{}'.format(profile_id)
+
+
+def profile_key(user_id):
+    return 'profile:user:{}'.format(user_id)
+
+
+def count_of(queryset, column):
+    """
+    Correlated subquery counting the rows of `queryset` (filtered on an `OuterRef`) grouped by `column`
+    """
+    counts = queryset.order_by().values(column).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def load_profile_stats(profile_ids):
+    """
+    {profile id: ProfileStats}, in one query
+    """
+    rows = Profile.objects.filter(id__in=profile_ids).annotate(
+        question_total=count_of(Question.objects.filter(asked_by=OuterRef('pk')), 'asked_by'),
+        answer_total=count_of(Answer.objects.filter(answer_by=OuterRef('pk')), 'answer_by'),
+        accepted_total=count_of(Answer.objects.filter(answer_by=OuterRef('pk'), accepted_or_not=True),
+                                'answer_by'),
+    ).values_list('id', 'question_total', 'answer_total', 'accepted_total', 'reputation')
+    return {row[0]: ProfileStats(*row[1:]) for row in rows}
+
+
+def profile_stats(profile_id):
+    """
+    :returns: ProfileStats, or None if there is no such profile
+    """
+    stats = cache().get(stats_key(profile_id))
+    if stats is None:
+        stats = load_profile_stats([profile_id]).get(profile_id)
+        if stats is not None:
+            cache().set(stats_key(profile_id), tuple(stats), timeout())
+        return stats
+    return ProfileStats(*stats)
+
+
+def user_profile(user_id):
+    """
+    The profile of the user with the user joined in, or None if the user has no profile
+    """
+    profile = cache().get(profile_key(user_id))
+    if profile is None:
+        profile = Profile.objects.select_related('user').filter(user_id=user_id).first()
+        # Users without a profile are remembered as well
+        cache().set(profile_key(user_id), profile or False, timeout())
+    return profile or None
+
+
+def request_profile(request):
+    """
+    `user_profile` of the signed-in user, looked up once per request
+    """
+    if not hasattr(request, '_profile'):
+        request._profile = user_profile(request.user.pk) if request.user.is_authenticated else None
+    return request._profile
+
+
+def profiles_changed(profile_ids=(), user_ids=()):
+    """
+    Drops the cached stats of the profiles and the cached profiles of the users
+    """
+    keys = [stats_key(profile_id) for profile_id in profile_ids if profile_id] + \
+        [profile_key(user_id) for user_id in user_ids if user_id]
+    if keys:
+        cache().delete_many(keys)
+        transaction.on_commit(lambda: cache().delete_many(keys))
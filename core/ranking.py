@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Hotness of questions, precomputed into the indexed `Question.hot_score` so `sort=hot` is a plain index scan.
+
+The score is the order of magnitude of the question's votes (up minus down, plus `HOT_SCORE_ANSWER_WEIGHT`
+per answer) plus its age: every `HOT_SCORE_DECAY` seconds a question is newer weigh as much as ten times the
+votes. Time only moves new questions up, so a score never goes stale by itself, only when the votes or answers
+of its question change.
+
+Those writes clear `Question.ranked`, and `rank_questions` (the `rank_questions` management command) scores
+the unranked questions in batches. `rank_all` rescores every question, for after the settings changed.
+"""
+import math
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, FloatField, Value, When
+from django.utils import timezone
+
+from core import signals
+from core.models import Question
+
+EPOCH = datetime(2019, 1, 1, tzinfo=timezone.utc)
+# Questions per CASE statement, stays below the 999 bound parameters SQLite allows in one statement
+UPDATE_BATCH_SIZE = 250
+SCORED_COLUMNS = ('id', 'up_vote', 'down_vote', 'answer_count', 'created', 'hot_score')
+
+
+def hot_score(up_vote, down_vote, answer_count, created):
+    votes = up_vote - down_vote + getattr(settings, 'HOT_SCORE_ANSWER_WEIGHT', 2) * answer_count
+    sign = (votes > 0) - (votes < 0)
+    age = (created - EPOCH).total_seconds()
+    return sign * math.log10(max(abs(votes), 1)) + age / getattr(settings, 'HOT_SCORE_DECAY', 45000)
+
+
+def rank_new(question):
+    """
+    Scores a question before it's inserted, so `sort=hot` lists it right away
+    """
+    # `created` is only filled in on insert, a few microseconds later
+    question.hot_score = hot_score(question.up_vote, question.down_vote, question.answer_count,
+                                   question.created or timezone.now())
+    question.ranked = True
+    return question
+
+
+def score(rows):
+    """
+    {question id: new score} of the `SCORED_COLUMNS` rows whose score changed
+    """
+    scores = {}
+    for question_id, up_vote, down_vote, answer_count, created, current in rows:
+        new = hot_score(up_vote, down_vote, answer_count, created)
+        if new != current:
+            scores[question_id] = new
+    return scores
+
+
+def store(scores):
+    items = sorted(scores.items())
+    for start in range(0, len(items), UPDATE_BATCH_SIZE):
+        batch = items[start:start + UPDATE_BATCH_SIZE]
+        Question.objects.filter(id__in=[question_id for question_id, new in batch]).update(hot_score=Case(
+            *[When(id=question_id, then=Value(new)) for question_id, new in batch], output_field=FloatField()))
+
+
+def rank_batch(batch_size):
+    """
+    Scores up to `batch_size` unranked questions
+
+    :returns: number of questions ranked
+    """
+    with transaction.atomic():
+        # Locked, a vote rolled up meanwhile waits and clears `ranked` again after this commits
+        rows = list(Question.objects.select_for_update().filter(ranked=False).order_by('id').values_list(
+            *SCORED_COLUMNS)[:batch_size])
+        scores = score(rows)
+        store(scores)
+        Question.objects.filter(id__in=[row[0] for row in rows]).update(ranked=True)
+    if scores:
+        signals.questions_ranked.send(sender=Question, question_ids=list(scores))
+    return len(rows)
+
+
+def rank_questions(batch_size=1000):
+    """
+    Scores every question touched since the last run
+
+    :returns: number of questions ranked
+    """
+    total = 0
+    while True:
+        ranked = rank_batch(batch_size)
+        total += ranked
+        if ranked < batch_size:
+            return total
+
+
+def rank_all(chunk_size=1000):
+    """
+    Rescores every question, `chunk_size` of them per transaction
+
+    :returns: number of questions whose score changed
+    """
+    last_id, changed = 0, 0
+    while True:
+        with transaction.atomic():
+            rows = list(Question.objects.select_for_update().filter(id__gt=last_id).order_by('id').values_list(
+                *SCORED_COLUMNS)[:chunk_size])
+            if not rows:
+                return changed
+            scores = score(rows)
+            store(scores)
+            Question.objects.filter(id__gte=rows[0][0], id__lte=rows[-1][0], ranked=False).update(ranked=True)
+        if scores:
+            signals.questions_ranked.send(sender=Question, question_ids=list(scores))
+        changed += len(scores)
+        last_id = rows[-1][0]
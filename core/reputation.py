@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Reputation, from an append-only ledger of the events that earn or cost it.
+
+Asking a question, having a question or an answer voted on and having an answer accepted each append a
+`ReputationEvent` crediting the author, never the voter, and nothing is credited for voting on or accepting
+one's own posts. A vote turned around takes back the event of its former direction with a `count` of -1.
+`REPUTATION_WEIGHTS` says how many points each kind of event is worth.
+
+`apply_events` folds new events into `Profile.reputation` in batches (the `apply_reputation` command), with one
+UPDATE per distinct delta. `recompute` rescores every profile from all of its events, a range of profiles per
+transaction spread over a pool of processes (the `recompute_reputation` command), for after the weights
+changed.
+
+Both lock the profiles before their events, in id order, so they can run at the same time: a recomputed range
+counts every event it marks as applied, and the events it doesn't see yet are left to `apply_events`.
+"""
+import multiprocessing
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils.six.moves import range
+
+from core import profiles
+from core.models import Profile, ReputationEvent
+
+DEFAULT_WEIGHTS = {
+    ReputationEvent.QUESTION_ASKED: 1,
+    ReputationEvent.QUESTION_UP_VOTED: 5,
+    ReputationEvent.QUESTION_DOWN_VOTED: -2,
+    ReputationEvent.ANSWER_UP_VOTED: 10,
+    ReputationEvent.ANSWER_DOWN_VOTED: -2,
+    ReputationEvent.ANSWER_ACCEPTED: 15,
+}
+# Stays below the 999 bound parameters SQLite allows in one statement
+BATCH_SIZE = 500
+
+
+def weights():
+    return dict(DEFAULT_WEIGHTS, **getattr(settings, 'REPUTATION_WEIGHTS', {}))
+
+
+def record(kind, profile_id, count=1, actor_id=None, question_id=None, answer_id=None):
+    if profile_id is None or profile_id == actor_id:
+        return
+    ReputationEvent.objects.create(profile_id=profile_id, kind=kind, count=count, actor_id=actor_id,
+                                   question_id=question_id, answer_id=answer_id)
+
+
+def record_vote(author_id, voter_id, up_vote, changed, question_id=None, answer_id=None):
+    """
+    A new vote earns the points of its direction, a changed one also takes back those of the other direction
+    """
+    if question_id:
+        kinds = (ReputationEvent.QUESTION_UP_VOTED, ReputationEvent.QUESTION_DOWN_VOTED)
+    else:
+        kinds = (ReputationEvent.ANSWER_UP_VOTED, ReputationEvent.ANSWER_DOWN_VOTED)
+    kind, other = kinds if up_vote else reversed(kinds)
+    record(kind, author_id, actor_id=voter_id, question_id=question_id, answer_id=answer_id)
+    if changed:
+        record(other, author_id, count=-1, actor_id=voter_id, question_id=question_id, answer_id=answer_id)
+
+
+def batches(values, size=BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def lock_profiles(queryset, *fields):
+    return list(queryset.select_for_update().order_by('id').values_list('id', *fields))
+
+
+def apply_batch(batch_size):
+    """
+    Adds up to `batch_size` new events to the reputation of their profiles
+
+    :returns: (events looked at, events applied)
+    """
+    with transaction.atomic():
+        candidates = list(ReputationEvent.objects.filter(applied=False).order_by('id').values_list(
+            'id', 'profile_id')[:batch_size])
+        profile_ids = sorted(set(profile_id for event_id, profile_id in candidates))
+        for batch in batches(profile_ids):
+            lock_profiles(Profile.objects.filter(id__in=batch))
+        # Read again under the locks, a recompute may have counted some of them meanwhile
+        pending = []
+        for batch in batches(event_id for event_id, profile_id in candidates):
+            pending.extend(ReputationEvent.objects.select_for_update().filter(
+                id__in=batch, applied=False).values_list('id', 'profile_id', 'kind', 'count'))
+        table = weights()
+        deltas = defaultdict(int)
+        for event_id, profile_id, kind, count in pending:
+            deltas[profile_id] += table.get(kind, 0) * count
+        by_delta = defaultdict(list)
+        for profile_id, delta in deltas.items():
+            if delta:
+                by_delta[delta].append(profile_id)
+        for delta, delta_profile_ids in by_delta.items():
+            for batch in batches(delta_profile_ids):
+                Profile.objects.filter(id__in=batch).update(reputation=F('reputation') + delta)
+        for batch in batches(event_id for event_id, profile_id, kind, count in pending):
+            ReputationEvent.objects.filter(id__in=batch).update(applied=True)
+        profiles.profiles_changed(list(deltas))
+    return len(candidates), len(pending)
+
+
+def apply_events(batch_size=1000):
+    """
+    Brings the reputation of every profile up to date with the ledger
+
+    :returns: number of events applied
+    """
+    total = 0
+    while True:
+        seen, applied = apply_batch(batch_size)
+        total += applied
+        if seen < batch_size:
+            return total
+
+
+@transaction.atomic
+def recompute_range(first_id, last_id):
+    """
+    Sets the reputation of the profiles with ids from `first_id` to `last_id` to the weighted sum of all their
+    events
+
+    :returns: number of profiles whose reputation changed
+    """
+    current = dict(lock_profiles(Profile.objects.filter(id__gte=first_id, id__lte=last_id), 'reputation'))
+    events = ReputationEvent.objects.filter(profile_id__gte=first_id, profile_id__lte=last_id)
+    events.filter(applied=False).update(applied=True)
+    table = weights()
+    scores = dict.fromkeys(current, 0)
+    totals = events.filter(applied=True).order_by().values_list('profile_id', 'kind').annotate(total=Sum('count'))
+    for profile_id, kind, total in totals:
+        scores[profile_id] += table.get(kind, 0) * total
+    changed = [(profile_id, score) for profile_id, score in sorted(scores.items()) if score != current[profile_id]]
+    for batch in batches(changed, size=BATCH_SIZE // 2):
+        Profile.objects.filter(id__in=[profile_id for profile_id, score in batch]).update(reputation=Case(
+            *[When(id=profile_id, then=Value(score)) for profile_id, score in batch], output_field=IntegerField()))
+    profiles.profiles_changed([profile_id for profile_id, score in changed])
+    return len(changed)
+
+
+def profile_ranges(size):
+    """
+    (first id, last id) of consecutive runs of `size` profiles, covering all of them
+    """
+    chunk = []
+    for profile_id in Profile.objects.order_by('id').values_list('id', flat=True).iterator():
+        chunk.append(profile_id)
+        if len(chunk) >= size:
+            yield chunk[0], chunk[-1]
+            chunk = []
+    if chunk:
+        yield chunk[0], chunk[-1]
+
+
+def _recompute_range(id_range):
+    return recompute_range(*id_range)
+
+
+def recompute(workers=1, chunk_size=1000):
+    """
+    Rescores every profile from its events, `chunk_size` profiles per transaction over `workers` processes
+
+    :returns: number of profiles whose reputation changed
+    """
+    ranges = list(profile_ranges(chunk_size))
+    # Without row locks (SQLite) a writer locks the whole database, the ranges might as well go one by one
+    if workers <= 1 or len(ranges) <= 1 or not connection.features.has_select_for_update:
+        return sum(recompute_range(*id_range) for id_range in ranges)
+    # The pool forks this process, the children have to open their own connections
+    connections.close_all()
+    pool = multiprocessing.Pool(min(workers, len(ranges)))
+    try:
+        return sum(pool.imap_unordered(_recompute_range, ranges))
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Question search.
+
+Every question has a `QuestionSearchDocument` holding its title, body, tag names and optionally the answers.
+On Postgres the documents are matched through a GIN full-text index, anywhere else (SQLite in the tests) an
+in-process inverted index built from the same documents is used. The queries only use the index if it was created
+with SEARCH_CONFIG, `manage.py rebuild_search_index` creates it again after the setting changed.
+"""
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from core.models import Question, QuestionSearchDocument
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+SEARCH_INDEX_NAME = 'core_questionsearchdocument_fts'
+INDEX_CONFIG_RE = re.compile(r"to_tsvector\('([^']+)'::regconfig")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def include_answers():
+    return getattr(settings, 'SEARCH_INCLUDE_ANSWERS', False)
+
+
+def search_config():
+    return getattr(settings, 'SEARCH_CONFIG', 'english')
+
+
+def search_vector():
+    # The expression has to match the one the GIN index was created on, so the config is inlined
+    return "to_tsvector('{config}', document)".format(config=search_config())
+
+
+def compose_document(title, text, tag_names, answers=()):
+    parts = [title, text]
+    parts.extend(tag_names)
+    if include_answers():
+        parts.extend(answers)
+    return u'\n'.join(part for part in parts if part)
+
+
+def build_document(question):
+    answers = question.answer.values_list('answer', flat=True) if include_answers() else ()
+    return compose_document(question.title, question.question, question.tag.values_list('name', flat=True), answers)
+
+
+class InvertedIndex(object):
+    """
+    term -> {question id: term frequency}, ranked with tf-idf. Only meant for databases without full-text search.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def add(self, question_id, document):
+        frequencies = defaultdict(int)
+        for term in tokenize(document):
+            frequencies[term] += 1
+        with self.lock:
+            self._remove(question_id)
+            for term, frequency in frequencies.items():
+                self.postings[term][question_id] = frequency
+            self.documents[question_id] = list(frequencies)
+
+    def remove(self, question_id):
+        with self.lock:
+            self._remove(question_id)
+
+    def _remove(self, question_id):
+        for term in self.documents.pop(question_id, ()):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(question_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def search(self, text, limit):
+        terms = set(tokenize(text))
+        if not terms:
+            return []
+        with self.lock:
+            matches = [self.postings.get(term, {}) for term in terms]
+            if not all(matches):
+                return []
+            total = float(len(self.documents))
+            candidates = set.intersection(*(set(postings) for postings in matches))
+            scores = dict.fromkeys(candidates, 0.0)
+            for postings in matches:
+                idf = math.log(1 + total / len(postings))
+                for question_id in candidates:
+                    scores[question_id] += postings[question_id] * idf
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked[:limit]
+
+
+_fallback_index = None
+_fallback_lock = threading.Lock()
+
+
+def get_fallback_index():
+    global _fallback_index
+    if _fallback_index is None:
+        with _fallback_lock:
+            if _fallback_index is None:
+                index = InvertedIndex()
+                for question_id, document in QuestionSearchDocument.objects.values_list('question_id', 'document'):
+                    index.add(question_id, document)
+                _fallback_index = index
+    return _fallback_index
+
+
+def reset_fallback_index():
+    global _fallback_index
+    _fallback_index = None
+
+
+def uses_full_text():
+    return connection.vendor == 'postgresql'
+
+
+def full_text_index_config():
+    """
+    Text search config the GIN index was created with, None without the index
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT indexdef FROM pg_indexes WHERE indexname = %s', [SEARCH_INDEX_NAME])
+        row = cursor.fetchone()
+    match = INDEX_CONFIG_RE.search(row[0]) if row else None
+    return match.group(1) if match else None
+
+
+@transaction.atomic
+def rebuild_full_text_index():
+    """
+    Creates the GIN index again with SEARCH_CONFIG, unless it uses it already
+
+    :returns: whether the index was created
+    """
+    if not uses_full_text() or full_text_index_config() == search_config():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('DROP INDEX IF EXISTS {name}'.format(name=SEARCH_INDEX_NAME))
+        cursor.execute('CREATE INDEX {name} ON {table} USING gin ({vector})'.format(
+            name=SEARCH_INDEX_NAME, table=QuestionSearchDocument._meta.db_table, vector=search_vector()))
+    return True
+
+
+def index_question(question):
+    document = build_document(question)
+    QuestionSearchDocument.objects.update_or_create(question_id=question.pk, defaults={'document': document})
+    if not uses_full_text() and _fallback_index is not None:
+        _fallback_index.add(question.pk, document)
+
+
+def index_documents(documents):
+    """
+    Bulk insert the search documents of new questions, {question id: document}
+    """
+    QuestionSearchDocument.objects.bulk_create([QuestionSearchDocument(question_id=question_id, document=document)
+                                                for question_id, document in documents.items()])
+    if not uses_full_text():
+        transaction.on_commit(lambda: _add_to_fallback_index(documents))
+
+
+def _add_to_fallback_index(documents):
+    if _fallback_index is not None:
+        for question_id, document in documents.items():
+            _fallback_index.add(question_id, document)
+
+
+def unindex_question(question_id):
+    if _fallback_index is not None:
+        _fallback_index.remove(question_id)
+
+
+def rank_questions(text, limit=20):
+    """
+    [(question id, rank), ...] best match first
+    """
+    if not text or not text.strip():
+        return []
+    if not uses_full_text():
+        return get_fallback_index().search(text, limit)
+    vector = search_vector()
+    query = "plainto_tsquery('{config}', %s)".format(config=search_config())
+    return list(QuestionSearchDocument.objects.extra(
+        select={'rank': 'ts_rank({vector}, {query})'.format(vector=vector, query=query)},
+        select_params=(text,),
+        where=['{vector} @@ {query}'.format(vector=vector, query=query)],
+        params=(text,),
+    ).order_by('-rank', '-question_id').values_list('question_id', 'rank')[:limit])
+
+
+def search_questions(text, limit=20, queryset=None):
+    """
+    Questions matching `text` ordered by relevance
+    """
+    ranked = rank_questions(text, limit)
+    if queryset is None:
+        queryset = Question.objects.all()
+    questions = queryset.in_bulk([question_id for question_id, rank in ranked])
+    return [questions[question_id] for question_id, rank in ranked if question_id in questions]
@@ -0,0 +1,122 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver, Signal
+
+from core import avatars, profiles, search, tags
+from core.models import Question, Answer, Tag, Profile
+
+User = get_user_model()
+
+# Sent by `core.votes.rollup_batch` once the counters of these questions and answers changed
+votes_rolled_up = Signal(providing_args=['question_ids', 'answer_ids'])
+# Sent by `core.importer` once a chunk of bulk inserted questions is committed
+questions_imported = Signal(providing_args=['question_ids'])
+# Sent by `core.ranking` once the hot scores of these questions changed
+questions_ranked = Signal(providing_args=['question_ids'])
+
+
+@receiver(post_save, sender=Question, dispatch_uid='index_question_on_save')
+def index_question_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_question(instance)
+
+
+@receiver(post_delete, sender=Question, dispatch_uid='unindex_question_on_delete')
+def unindex_question_on_delete(sender, instance, **kwargs):
+    search.unindex_question(instance.pk)
+
+
+@receiver(m2m_changed, sender=Question.tag.through, dispatch_uid='index_question_on_tag_change')
+def index_question_on_tag_change(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        for question in instance.question_tag.all():
+            search.index_question(question)
+    else:
+        search.index_question(instance)
+
+
+@receiver(m2m_changed, sender=Question.answer.through, dispatch_uid='index_question_on_answer_change')
+def index_question_on_answer_change(sender, instance, action, reverse, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and search.include_answers():
+        for question in (instance.question_answer.all() if reverse else [instance]):
+            search.index_question(question)
+
+
+@receiver(post_save, sender=Answer, dispatch_uid='index_question_on_answer_save')
+def index_question_on_answer_save(sender, instance, created, raw=False, **kwargs):
+    # A new answer isn't attached to its question yet, `m2m_changed` takes care of that one
+    if not raw and not created and search.include_answers():
+        for question in instance.question_answer.all():
+            search.index_question(question)
+
+
+@receiver(m2m_changed, sender=Question.tag.through, dispatch_uid='count_tag_questions')
+def count_tag_questions(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps `Tag.question_count` in step. Removals are counted before they happen, `pk_set` of a removal
+    holds whatever was asked for rather than the links that actually existed
+    """
+    through = Question.tag.through.objects
+    if action == 'post_add' and pk_set:
+        if reverse:
+            tags.add_question_counts({instance.pk: len(pk_set)})
+        else:
+            tags.add_question_counts({tag_id: 1 for tag_id in pk_set})
+    elif action in ('pre_remove', 'pre_clear'):
+        if reverse:
+            links = through.filter(tag_id=instance.pk)
+            if action == 'pre_remove':
+                links = links.filter(question_id__in=pk_set)
+            tags.add_question_counts({instance.pk: -links.count()})
+        else:
+            links = through.filter(question_id=instance.pk)
+            if action == 'pre_remove':
+                links = links.filter(tag_id__in=pk_set)
+            tags.add_question_counts({tag_id: -1 for tag_id in links.values_list('tag_id', flat=True)})
+
+
+@receiver(pre_delete, sender=Question, dispatch_uid='uncount_tag_questions_on_delete')
+def uncount_tag_questions_on_delete(sender, instance, **kwargs):
+    # The links go with the question without an m2m_changed
+    tags.add_question_counts({tag_id: -1 for tag_id in Question.tag.through.objects.filter(
+        question_id=instance.pk).values_list('tag_id', flat=True)})
+
+
+@receiver(post_save, sender=Tag, dispatch_uid='refresh_tag_catalog_on_save')
+@receiver(post_delete, sender=Tag, dispatch_uid='refresh_tag_catalog_on_delete')
+def refresh_tag_catalog(sender, **kwargs):
+    tags.tags_changed()
+
+
+@receiver(post_save, sender=Question, dispatch_uid='refresh_profile_stats_on_question_save')
+@receiver(post_delete, sender=Question, dispatch_uid='refresh_profile_stats_on_question_delete')
+def refresh_profile_stats_on_question(sender, instance, created=True, **kwargs):
+    if created:
+        profiles.profiles_changed([instance.asked_by_id])
+
+
+@receiver(post_save, sender=Answer, dispatch_uid='refresh_profile_stats_on_answer_save')
+@receiver(post_delete, sender=Answer, dispatch_uid='refresh_profile_stats_on_answer_delete')
+def refresh_profile_stats_on_answer(sender, instance, created=True, **kwargs):
+    # Edits don't change the counts, `accept_answer` takes care of the accepted flag
+    if created:
+        profiles.profiles_changed([instance.answer_by_id])
+
+
+@receiver(post_save, sender=Profile, dispatch_uid='refresh_cached_profile_on_save')
+@receiver(post_delete, sender=Profile, dispatch_uid='refresh_cached_profile_on_delete')
+def refresh_cached_profile(sender, instance, **kwargs):
+    profiles.profiles_changed([instance.pk], [instance.user_id])
+
+
+@receiver(post_save, sender=Profile, dispatch_uid='make_avatar_thumbnails')
+def make_avatar_thumbnails(sender, instance, raw=False, **kwargs):
+    if not raw:
+        avatars.schedule(instance)
+
+
+@receiver(post_save, sender=User, dispatch_uid='refresh_cached_profile_on_user_save')
+def refresh_cached_profile_on_user_save(sender, instance, **kwargs):
+    profiles.profiles_changed(user_ids=[instance.pk])
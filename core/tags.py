@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+In-process catalog of every tag, for the pages and the tag autocomplete.
+
+Each worker loads the tags once into an array sorted by lowercased name, a prefix is then two bisections away.
+The catalog carries a version kept in the cache (`TAG_CATALOG_CACHE`): creating, renaming or deleting tags
+bumps it, and a worker compares its own against it at most every `TAG_CATALOG_CHECK_INTERVAL` seconds,
+reloading when it moved. Whatever the cache, a worker reloads a catalog older than `TAG_CATALOG_MAX_AGE`
+seconds, which bounds how stale it gets when the cache isn't shared between the workers.
+
+`Tag.question_count` is kept up to date incrementally with F() updates as questions gain and lose tags, the
+worker making the change applies the same delta to its catalog once the transaction commits. Counts don't move
+the version, the other workers see them with their next reload.
+
+Tags given by name (forms, the API, imports) are matched on their slug: `resolve_tags` finds the existing ones
+with one query and bulk creates the rest.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.six.moves import range
+
+from core.models import Tag
+
+TagEntry = namedtuple('TagEntry', ('id', 'name', 'slug'))
+
+MAX_SUGGESTIONS = 50
+# Prefixes up to this long match too many tags to rank on every keystroke, their best are ranked ahead of time
+RANKED_PREFIX_LENGTH = 2
+
+
+def check_interval():
+    return getattr(settings, 'TAG_CATALOG_CHECK_INTERVAL', 5)
+
+
+def max_age():
+    return getattr(settings, 'TAG_CATALOG_MAX_AGE', 300)
+
+
+class TagCatalog(object):
+    version_key = 'tag_catalog:version'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (sorted lowercased names, entries in the same order, {tag id: question count},
+        #  {short prefix: indexes of its most used tags}), swapped as a whole
+        self.snapshot = None
+        self.version = None
+        self.checked_at = 0
+        self.loaded_at = 0
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'TAG_CATALOG_CACHE', 'default')]
+
+    def shared_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            # Starting from the clock, a version evicted from the cache can't come back as an old one
+            self.cache.add(self.version_key, int(time.time() * 1000), timeout=None)
+            version = self.cache.get(self.version_key, 0)
+        return version
+
+    def load(self):
+        self.ensure_fresh()
+        return self.snapshot
+
+    def ensure_fresh(self):
+        if self.snapshot is not None and time.time() - self.checked_at < check_interval():
+            return
+        with self.lock:
+            if self.snapshot is not None and time.time() - self.checked_at < check_interval():
+                return
+            version = self.shared_version()
+            if self.snapshot is None or version != self.version or time.time() - self.loaded_at >= max_age():
+                self.reload(version)
+            self.checked_at = time.time()
+
+    def reload(self, version):
+        rows = sorted(Tag.objects.values_list('id', 'name', 'slug', 'question_count'),
+                      key=lambda row: (row[1].lower(), row[0]))
+        keys = tuple(row[1].lower() for row in rows)
+        entries = tuple(TagEntry(*row[:3]) for row in rows)
+        counts = {row[0]: row[3] for row in rows}
+        # Walking the tags most used first fills the ranking of every short prefix in one pass
+        ranked = defaultdict(list)
+        for index in sorted(range(len(rows)), key=lambda index: (-rows[index][3], index)):
+            for length in range(1, min(len(keys[index]), RANKED_PREFIX_LENGTH) + 1):
+                best = ranked[keys[index][:length]]
+                if len(best) < MAX_SUGGESTIONS:
+                    best.append(index)
+        self.snapshot = (keys, entries, counts, dict(ranked))
+        self.version = version
+        self.loaded_at = time.time()
+
+    def invalidate(self):
+        """
+        Tags were added, renamed or removed, every worker reloads
+        """
+        with self.lock:
+            self.snapshot = None
+            try:
+                self.cache.incr(self.version_key)
+            except ValueError:
+                pass
+
+    def add_counts(self, deltas):
+        """
+        Applies committed {tag id: delta} question counts to this worker's catalog, the others see them with their
+        next reload
+        """
+        with self.lock:
+            if self.snapshot is None:
+                return
+            keys, entries, counts, ranked = self.snapshot
+            for tag_id, delta in deltas.items():
+                if tag_id in counts:
+                    counts[tag_id] += delta
+            names = set(entry.name.lower() for entry in entries if entry.id in deltas)
+            for prefix in set(name[:length] for name in names for length in range(1, RANKED_PREFIX_LENGTH + 1)):
+                ranked[prefix] = rank(keys, entries, counts, prefix, MAX_SUGGESTIONS)
+
+    def all(self):
+        """
+        Every tag, by name
+        """
+        return list(self.load()[1])
+
+    def question_count(self, tag_id):
+        return self.load()[2].get(tag_id, 0)
+
+    def autocomplete(self, prefix, limit=10):
+        """
+        [(TagEntry, question count), ...] of the tags whose name starts with `prefix`, most used first
+        """
+        keys, entries, counts, ranked = self.load()
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        limit = min(limit, MAX_SUGGESTIONS)
+        if len(prefix) <= RANKED_PREFIX_LENGTH:
+            matches = ranked.get(prefix, ())[:limit]
+        else:
+            matches = rank(keys, entries, counts, prefix, limit)
+        return [(entries[index], counts.get(entries[index].id, 0)) for index in matches]
+
+
+def rank(keys, entries, counts, prefix, limit):
+    """
+    Indexes of the `limit` most used tags whose lowercased name starts with `prefix`, ties by name
+    """
+    start = bisect_left(keys, prefix)
+    end = bisect_left(keys, prefix + u'\uffff', start)
+    return heapq.nsmallest(limit, range(start, end), key=lambda index: (-counts.get(entries[index].id, 0), index))
+
+
+tag_catalog = TagCatalog()
+
+
+def add_question_counts(deltas):
+    """
+    Moves `question_count` of the tags by {tag id: delta}, one query per distinct delta (and 500 tags)
+    """
+    by_delta = defaultdict(list)
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(tag_id)
+    for delta, tag_ids in by_delta.items():
+        for start in range(0, len(tag_ids), 500):
+            Tag.objects.filter(id__in=tag_ids[start:start + 500]).update(
+                question_count=F('question_count') + delta)
+    if by_delta:
+        deltas = dict(deltas)
+        transaction.on_commit(lambda: tag_catalog.add_counts(deltas))
+
+
+def tags_changed():
+    transaction.on_commit(tag_catalog.invalidate)
+
+
+def parse_tag_names(values):
+    """
+    Unique tag names, in order, out of strings that may each hold several comma separated names
+    """
+    names, seen = [], set()
+    for value in values:
+        for name in value.split(','):
+            name = name.strip()
+            if name and name.lower() not in seen:
+                seen.add(name.lower())
+                names.append(name)
+    return names
+
+
+def tag_slug(name):
+    """
+    The slug `AutoSlugField` gives a new tag of this name, unless another tag already has it
+    """
+    field = Tag._meta.get_field('slug')
+    return field.slugify_func(name)[:field.max_length].strip(field.separator)
+
+
+def _tag_ids(slugs):
+    ids = {}
+    slugs = list(slugs)
+    for start in range(0, len(slugs), 500):
+        ids.update(Tag.objects.filter(slug__in=slugs[start:start + 500]).values_list('slug', 'id'))
+    return ids
+
+
+def resolve_tags(names):
+    """
+    {name: tag id}. Names are matched on their slug, so `Python` and `python` are the same tag; the tags that
+    don't exist yet are created in one insert. Names without a slug (only punctuation) are left out.
+    """
+    names = set(names)
+    slugs = {}
+    for name in names:
+        slug = tag_slug(name)
+        if slug:
+            slugs.setdefault(slug, name)
+    ids = _tag_ids(slugs)
+    missing = [slug for slug in slugs if slug not in ids]
+    if missing:
+        try:
+            with transaction.atomic():
+                # With their slugs set, `AutoSlugField` doesn't look each one up to make it unique
+                Tag.objects.bulk_create([Tag(name=slugs[slug], slug=slug) for slug in missing])
+        except IntegrityError:
+            # Some of them were created concurrently, the others one at a time
+            for slug in set(missing).difference(_tag_ids(missing)):
+                try:
+                    with transaction.atomic():
+                        Tag.objects.create(name=slugs[slug], slug=slug)
+                except IntegrityError:
+                    pass
+        ids.update(_tag_ids(missing))
+        tags_changed()
+    return {name: ids[tag_slug(name)] for name in names if tag_slug(name) in ids}
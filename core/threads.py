@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Loading a question with everything its thread page renders in a fixed number of queries, and keeping the
+answer_count/accepted_answer/last_activity_at of questions in step with their answers.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from core import profiles, reputation
+from core.models import Question, Answer, ReputationEvent
+
+Thread = namedtuple('Thread', ('question', 'answers', 'accepted'))
+
+
+def load_thread(question_id):
+    """
+    The question with its author, all of its answers with their authors and the accepted answer,
+    in two queries however many answers there are
+
+    :raises Question.DoesNotExist:
+    """
+    question = Question.objects.select_related('asked_by__user').get(id=question_id)
+    answers = list(question.answer.select_related('answer_by__user'))
+    accepted = next((answer for answer in answers if answer.id == question.accepted_answer_id), None)
+    return Thread(question, answers, accepted)
+
+
+@transaction.atomic
+def add_answer(question, answer):
+    question.answer.add(answer)
+    Question.objects.filter(id=question.id).update(answer_count=F('answer_count') + 1,
+                                                   last_activity_at=timezone.now(), ranked=False)
+
+
+@transaction.atomic
+def accept_answer(question_id, answer_id):
+    """
+    Makes the answer the accepted one of the question. An answer accepted before is unflagged and its author
+    loses the reputation the acceptance earned.
+
+    :raises Answer.DoesNotExist: if the answer isn't one of the question's
+    """
+    asker_id = Question.objects.select_for_update().filter(id=question_id).values_list(
+        'asked_by_id', flat=True).first()
+    answer_ids = Answer.objects.filter(question_answer=question_id)
+    if asker_id is None or not answer_ids.filter(id=answer_id).exists():
+        raise Answer.DoesNotExist('Answer {} is not an answer of question {}'.format(answer_id, question_id))
+
+    previous = list(answer_ids.filter(accepted_or_not=True).exclude(id=answer_id).values_list('id', 'answer_by_id'))
+    Answer.objects.filter(id__in=[previous_id for previous_id, _ in previous]).update(accepted_or_not=False)
+    for previous_id, author_id in previous:
+        reputation.record(ReputationEvent.ANSWER_ACCEPTED, author_id, count=-1, actor_id=asker_id,
+                          question_id=question_id, answer_id=previous_id)
+    changed = [author_id for _, author_id in previous]
+
+    if Answer.objects.filter(id=answer_id, accepted_or_not=False).update(accepted_or_not=True):
+        author_id = Answer.objects.filter(id=answer_id).values_list('answer_by_id', flat=True).first()
+        reputation.record(ReputationEvent.ANSWER_ACCEPTED, author_id, actor_id=asker_id, question_id=question_id,
+                          answer_id=answer_id)
+        changed.append(author_id)
+    if changed:
+        profiles.profiles_changed(changed)
+    Question.objects.filter(id=question_id).update(accepted_answer_id=answer_id, last_activity_at=timezone.now())
+
+
+def compute_question_stats(question_ids):
+    """
+    What answer_count, accepted_answer and last_activity_at of the questions should be, from their answers
+
+    :returns: {question id: (answer_count, accepted_answer_id, last_activity_at)}
+    """
+    accepted = dict(Answer.objects.filter(question_answer__in=question_ids, accepted_or_not=True).order_by(
+        '-id').values_list('question_answer', 'id'))
+    rows = Question.objects.filter(id__in=question_ids).order_by().annotate(
+        num_answers=Count('answer'), last_answer_at=Max('answer__created')).values_list(
+        'id', 'modified', 'num_answers', 'last_answer_at')
+    return {question_id: (num_answers, accepted.get(question_id), max(modified, last_answer_at or modified))
+            for question_id, modified, num_answers, last_answer_at in rows}
+
+
+class AnswerNode(object):
+    """
+    An answer with its replies. `hidden_replies` counts the replies left out by a depth limit or a collapse
+    """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.children = []
+        self.depth = 0
+        self.descendants = 0
+        self.hidden_replies = 0
+
+    @property
+    def collapsed(self):
+        return self.hidden_replies > 0
+
+
+def build_answer_tree(answers, max_depth=None, collapsed=()):
+    """
+    Assembles the replies of `answers` (as loaded by `load_thread`, every reply is also an answer of the
+    question) into a tree in O(n), keeping the given order among siblings.
+
+    :param max_depth: replies deeper than this are cut off and only counted on their ancestor
+    :param collapsed: ids of the answers whose replies are only counted
+    :returns: top level `AnswerNode`s
+    """
+    nodes = [AnswerNode(answer) for answer in answers]
+    by_id = {node.answer.id: node for node in nodes}
+    roots = []
+    for node in nodes:
+        parent = by_id.get(node.answer.parent_id)
+        if parent is None or parent is node:
+            roots.append(node)
+        else:
+            parent.children.append(node)
+
+    # Depth first pre-order without recursion, so deep threads can't hit the recursion limit
+    order = []
+    stack = list(reversed(roots))
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        for child in reversed(node.children):
+            child.depth = node.depth + 1
+            stack.append(child)
+    for node in reversed(order):
+        node.descendants = sum(child.descendants + 1 for child in node.children)
+
+    collapsed = set(collapsed)
+    for node in order:
+        if node.children and (node.answer.id in collapsed or (max_depth is not None and node.depth >= max_depth)):
+            node.hidden_replies = node.descendants
+            node.children = []
+    return roots
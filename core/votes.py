@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Votes and favourites.
+
+Every vote is a row in the `Vote` ledger, one per profile and target, so voting twice is a no-op. Writers only
+touch their own ledger row; the up_vote/down_vote counters of questions and answers are a rollup of the ledger
+refreshed in batches by `rollup_votes` (see the `rollup_votes` management command), so a hot question doesn't
+serialize every voter on its row lock.
+
+Counters are only ever changed with single `UPDATE ... SET column = column + n` statements, so concurrent
+writers never overwrite each other and only the counted columns are written.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core import reputation, signals
+from core.models import Question, Answer, Vote
+
+
+def increments(**columns):
+    return {column: F(column) + 1 for column, enabled in columns.items() if enabled}
+
+
+def direction_of(up_vote=False, down_vote=False):
+    if up_vote:
+        return Vote.UP
+    if down_vote:
+        return Vote.DOWN
+    return None
+
+
+def cast_vote(voter_id, direction, question_id=None, answer_id=None):
+    """
+    Records the vote of `voter_id` in the ledger.
+
+    :returns: `True` if it's a new vote, `False` if it changed the direction of the existing vote
+        and `None` if the very same vote was already cast
+    """
+    target = {'question_id': question_id} if question_id else {'answer_id': answer_id}
+    try:
+        with transaction.atomic():
+            Vote.objects.create(voter_id=voter_id, direction=direction, **target)
+        return True
+    except IntegrityError:
+        changed = Vote.objects.filter(voter_id=voter_id, **target).exclude(direction=direction).update(
+            direction=direction, rolled_up=False, modified=timezone.now())
+        return False if changed else None
+
+
+@transaction.atomic
+def vote_question(question_id, profile_id, up_vote=False, down_vote=False):
+    """
+    Votes on the question, a new or changed vote moves the reputation of its author
+    """
+    direction = direction_of(up_vote, down_vote)
+    cast = cast_vote(profile_id, direction, question_id=question_id) if direction else None
+    if cast is not None:
+        author_id = Question.objects.filter(id=question_id).values_list('asked_by_id', flat=True).first()
+        reputation.record_vote(author_id, profile_id, direction == Vote.UP, changed=not cast,
+                               question_id=question_id)
+
+
+@transaction.atomic
+def vote_answer(answer_id, profile_id, up_vote=False, down_vote=False, favourite=False):
+    """
+    Votes and favourites the answer in one transaction, a new or changed vote moves the reputation of its author
+    """
+    direction = direction_of(up_vote, down_vote)
+    cast = cast_vote(profile_id, direction, answer_id=answer_id) if direction else None
+    if cast is not None:
+        author_id = Answer.objects.filter(id=answer_id).values_list('answer_by_id', flat=True).first()
+        reputation.record_vote(author_id, profile_id, direction == Vote.UP, changed=not cast, answer_id=answer_id)
+    changes = increments(favourite=favourite)
+    if changes:
+        Answer.objects.filter(id=answer_id).update(**changes)
+
+
+def rollup_batch(batch_size):
+    """
+    Folds up to `batch_size` pending ledger rows into the counters of their targets
+    """
+    with transaction.atomic():
+        count, changed = _rollup_batch(batch_size)
+    if changed:
+        signals.votes_rolled_up.send(sender=Vote, question_ids=[pk for model, pk in changed if model is Question],
+                                     answer_ids=[pk for model, pk in changed if model is Answer])
+    return count
+
+
+def _rollup_batch(batch_size):
+    pending = list(Vote.objects.select_for_update().filter(rolled_up=False).order_by('id').values_list(
+        'id', 'question_id', 'answer_id', 'direction', 'counted_direction')[:batch_size])
+    deltas = defaultdict(lambda: {'up_vote': 0, 'down_vote': 0})
+    counted = defaultdict(list)
+    for vote_id, question_id, answer_id, direction, counted_direction in pending:
+        delta = deltas[(Question, question_id) if question_id else (Answer, answer_id)]
+        delta['up_vote'] += (direction == Vote.UP) - (counted_direction == Vote.UP)
+        delta['down_vote'] += (direction == Vote.DOWN) - (counted_direction == Vote.DOWN)
+        counted[direction].append(vote_id)
+    changed = []
+    # Same lock order in every batch so two rollups can't deadlock each other
+    for (model, pk), delta in sorted(deltas.items(), key=lambda item: (item[0][0].__name__, item[0][1])):
+        changes = {column: F(column) + value for column, value in delta.items() if value}
+        if changes:
+            if model is Question:
+                # The hot score of the question moves with its votes, see `core.ranking`
+                changes['ranked'] = False
+            model.objects.filter(pk=pk).update(**changes)
+            changed.append((model, pk))
+    for direction, vote_ids in counted.items():
+        Vote.objects.filter(id__in=vote_ids).update(rolled_up=True, counted_direction=direction)
+    return len(pending), changed
+
+
+def rollup_votes(batch_size=1000):
+    """
+    Brings the counters up to date with the ledger
+
+    :returns: number of ledger rows rolled up
+    """
+    total = 0
+    while True:
+        rolled_up = rollup_batch(batch_size)
+        total += rolled_up
+        if rolled_up < batch_size:
+            return total
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+import tempfile
 
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -62,9 +63,11 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PART_APPS + LOCAL_APPS
 # End Application definition
 
 MIDDLEWARE = [
+    'api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'api.sessions.SessionActivityMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -145,3 +148,160 @@ STATIC_URL = '/static/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, '../media/')
 MEDIA_URL = '/media/'
+
+# Search
+# Text search configuration of the Postgres full-text index, after changing it `manage.py rebuild_search_index`
+# creates the index again: the queries don't use an index made with another one
+SEARCH_CONFIG = 'english'
+# Index the answers of a question along with its title, body and tags
+SEARCH_INCLUDE_ANSWERS = False
+
+# Votes
+# Seconds between two rollups of the vote ledger into the question/answer counters (`manage.py rollup_votes`)
+VOTE_ROLLUP_INTERVAL = 60
+VOTE_ROLLUP_BATCH_SIZE = 1000
+
+# Reputation
+# Points each kind of reputation event is worth (see core/reputation.py). After changing them, rescore every
+# profile from its events with `manage.py recompute_reputation`
+REPUTATION_WEIGHTS = {
+    'question_asked': 1,
+    'question_up_voted': 5,
+    'question_down_voted': -2,
+    'answer_up_voted': 10,
+    'answer_down_voted': -2,
+    'answer_accepted': 15,
+}
+# Seconds between two applications of new events to the profiles (`manage.py apply_reputation`)
+REPUTATION_APPLY_INTERVAL = 60
+REPUTATION_APPLY_BATCH_SIZE = 1000
+
+# Ranking
+# The hot score of a question (see core/ranking.py) is the order of magnitude of its votes, each answer counting
+# as this many votes, plus its age: a question newer by HOT_SCORE_DECAY seconds weighs as much as ten times the
+# votes. After changing them, rescore every question with `manage.py rank_questions --full`
+HOT_SCORE_ANSWER_WEIGHT = 2
+HOT_SCORE_DECAY = 45000
+# Seconds between two scorings of the questions voted on or answered meanwhile (`manage.py rank_questions`)
+HOT_RANK_INTERVAL = 60
+HOT_RANK_BATCH_SIZE = 1000
+
+# Threads
+# Levels of replies rendered under an answer before the rest of the subtree is collapsed
+THREAD_REPLY_DEPTH = 3
+
+# Instrumentation
+# Share of the requests whose queries and timings are recorded (0 turns it off, 1 records every request), the
+# aggregates are on /qa-admin/perf/. A request repeating one SQL shape more than the threshold is an N+1.
+PERF_SAMPLE_RATE = float(os.environ.get('perf_sample_rate', 0))
+PERF_N_PLUS_ONE_THRESHOLD = 10
+# Addresses allowed to scrape /qa-admin/perf/metrics/ without logging in
+INTERNAL_IPS = ['127.0.0.1']
+
+# Tag catalog
+# Cache holding the version of the in-process tag catalogs (see core/tags.py), it has to be shared between the
+# workers for them to see each other's new, renamed and deleted tags right away. Each worker compares versions at
+# most every CHECK_INTERVAL seconds, and reloads its catalog after MAX_AGE seconds anyway: that's as stale as the
+# question counts of the other workers' writes get, and the tags too with a cache that isn't shared (`default`)
+TAG_CATALOG_CACHE = 'shared'
+TAG_CATALOG_CHECK_INTERVAL = 5
+TAG_CATALOG_MAX_AGE = 300
+
+# Profiles
+# Cache holding the profile of each signed-in user and the activity numbers of profiles (see core/profiles.py),
+# both are dropped on writes and kept for at most this many seconds otherwise. Nothing is cached unless the cache
+# is shared between the workers
+PROFILE_CACHE = 'shared'
+PROFILE_CACHE_TIMEOUT = 600
+
+# Accounts
+# Cache holding the API token key of each user a login hands out (see api/accounts.py), dropped when the token
+# is saved or deleted, and the token generation of each user. Nothing is cached unless it's shared between the
+# workers
+TOKEN_CACHE = 'shared'
+TOKEN_CACHE_TIMEOUT = 3600
+# Cache of each worker resolving the API tokens of `Authorization: Token <key>` requests to their users. Saving or
+# deleting the token or saving its user moves the user's token generation on in TOKEN_CACHE, and every worker
+# then looks the token up again. Entries last at most the TIMEOUT of the cache, a deactivation bypassing `save()`
+# takes that long to apply
+TOKEN_AUTH_CACHE = 'tokens'
+# Cache holding the signed-in user of each session (`api.authentication.CachedModelBackend`), dropped when the
+# user is saved. Unless it's shared between the workers, nothing is cached: a password change or a deactivation
+# would take up to the timeout to reach the other workers
+USER_CACHE = 'shared'
+USER_CACHE_TIMEOUT = 300
+AUTHENTICATION_BACKENDS = ['api.authentication.CachedModelBackend']
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        # First, so requests without credentials keep getting a 403 rather than a 401
+        'rest_framework.authentication.SessionAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ),
+}
+
+# Sessions
+# `api.sessions` (see api/sessions.py) serves sessions from SESSION_CACHE_ALIAS, a cache shared by every worker
+# (it reads them from the database with one that isn't), and writes their activity to the database at most every
+# SESSION_ACTIVITY_WRITE_INTERVAL seconds. With SESSION_ANONYMOUS_SIGNED_COOKIES the sessions without a signed-in
+# user are kept in a signed cookie. `manage.py purge_sessions` deletes the expired sessions in batches.
+SESSION_ENGINE = os.environ.get('session_engine', 'django.contrib.sessions.backends.db')
+SESSION_CACHE_ALIAS = os.environ.get('session_cache_alias', 'shared')
+SESSION_ACTIVITY_WRITE_INTERVAL = 300
+SESSION_ANONYMOUS_SIGNED_COOKIES = True
+SESSION_PURGE_BATCH_SIZE = 500
+
+# Avatars
+# Widths in pixels of the square thumbnails made of each avatar (see core/avatars.py), as JPEG and WebP. Their
+# names hold the hash of the upload, the web server can send them with `Cache-Control: max-age=31536000,
+# immutable`. After changing them, make them again with `manage.py make_avatars --all`
+AVATAR_SIZES = (32, 64, 128, 256)
+# Threads making the thumbnails of new uploads in each worker, 0 makes them in the request
+AVATAR_WORKERS = 2
+
+# Caches
+# The `responses` cache holds whole pages rendered for anonymous readers (see api/cache.py), point it at
+# `django.core.cache.backends.filebased.FileBasedCache` or `...db.DatabaseCache` to share it between workers.
+# The generations the pages are keyed on are kept in RESPONSE_GENERATION_CACHE, so a write in any process drops
+# the pages of every worker. Nothing is cached unless it's shared between the workers
+RESPONSE_GENERATION_CACHE = 'shared'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Seen by every worker on the host, for the entries other workers' writes have to drop (see core/cache.py).
+    # With workers on more than one host, point it at memcached
+    'shared': {
+        'BACKEND': os.environ.get('shared_cache_backend', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('shared_cache_location', os.path.join(tempfile.gettempdir(), 'qa-shared-cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+    'responses': {
+        'BACKEND': os.environ.get('response_cache_backend', 'core.cache.LRUCache'),
+        'LOCATION': os.environ.get('response_cache_location', 'responses'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    # Users of the API tokens, see TOKEN_AUTH_CACHE
+    'tokens': {
+        'BACKEND': 'core.cache.LRUCache',
+        'LOCATION': 'tokens',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Rendered per-answer and question header blocks of the thread page, keyed on the row's `modified`
+    'fragments': {
+        'BACKEND': 'core.cache.LRUCache',
+        'LOCATION': 'fragments',
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+}
@@ -18,7 +18,11 @@ from django.contrib import admin
 from django.conf.urls.static import static
 from django.conf import settings
 
+from api.views import PerfViewSet, PerfMetricsViewSet
+
 urlpatterns = [
+    url(r'^qa-admin/perf/$', PerfViewSet.as_view(), name='perf'),
+    url(r'^qa-admin/perf/metrics/$', PerfMetricsViewSet.as_view(), name='perf-metrics'),
     url(r'^qa-admin/', admin.site.urls),
     url(r'^qa/', include('api.urls', namespace='api')),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) + static(settings.MEDIA_URL,